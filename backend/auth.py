@@ -1,19 +1,66 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 from passlib.context import CryptContext
 from typing import Tuple
 
+logger = logging.getLogger(__name__)
+
+# Hash cost parameters. Defaults match what was hardcoded before calibration;
+# tools/calibrate_password_hash.py benchmarks this host and writes tuned values
+# to PASSWORD_HASH_CONFIG. The configured costs are also the minimums, so
+# existing hashes below them are upgraded on the next successful login.
+PASSWORD_HASH_CONFIG = os.getenv(
+    "PASSWORD_HASH_CONFIG",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "password_hash.json"),
+)
+
+DEFAULT_HASH_PARAMS = {
+    "argon2": {"time_cost": 3, "memory_cost": 65536, "parallelism": 4},
+    "bcrypt": {"rounds": 12},
+}
+
+
+def load_hash_params(path: str = PASSWORD_HASH_CONFIG) -> dict:
+    """Return hash cost parameters from ``path`` merged over the defaults."""
+    params = {scheme: dict(values) for scheme, values in DEFAULT_HASH_PARAMS.items()}
+    try:
+        with open(path) as f:
+            stored = json.load(f)
+    except FileNotFoundError:
+        return params
+    except (OSError, ValueError) as e:
+        logger.warning("Ignoring unreadable password hash config %s: %s", path, e)
+        return params
+    for scheme, values in params.items():
+        values.update({k: int(v) for k, v in stored.get(scheme, {}).items() if k in values})
+    return params
+
+
+hash_params = load_hash_params()
+
 # Use argon2 primarily with bcrypt as fallback to avoid bcrypt initialization issues
 try:
     pwd_context = CryptContext(
         schemes=["argon2", "bcrypt"],
         deprecated="auto",
-        argon2__rounds=3,
+        argon2__rounds=hash_params["argon2"]["time_cost"],
+        argon2__min_rounds=hash_params["argon2"]["time_cost"],
+        argon2__memory_cost=hash_params["argon2"]["memory_cost"],
+        argon2__parallelism=hash_params["argon2"]["parallelism"],
     )
 except Exception:
     # Fallback if argon2 not available
     pwd_context = CryptContext(
         schemes=["bcrypt"],
         deprecated="auto",
-        bcrypt__rounds=12,
+        bcrypt__rounds=hash_params["bcrypt"]["rounds"],
+        bcrypt__min_rounds=hash_params["bcrypt"]["rounds"],
     )
 
 # bcrypt has a 72-byte limit for passwords
@@ -39,7 +86,86 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 
 
 def needs_rehash(hashed_password: str) -> bool:
+    """True if the hash uses a deprecated scheme or costs below the current config."""
     try:
         return pwd_context.needs_update(hashed_password)
     except Exception:
         return False
+
+
+# ---------- Off-event-loop hashing ----------
+# Argon2/bcrypt are deliberately CPU-heavy. Running them inline in an async
+# handler stalls every request and Socket.IO session on the loop, so the async
+# wrappers below run them on a bounded thread pool (both libraries release the
+# GIL while hashing). At most HASH_MAX_WORKERS hashes run at once and at most
+# HASH_MAX_PENDING more may wait; beyond that callers get HashPoolBusy.
+
+HASH_MAX_WORKERS = int(os.getenv("HASH_MAX_WORKERS", str(min(4, os.cpu_count() or 1))))
+HASH_MAX_PENDING = int(os.getenv("HASH_MAX_PENDING", "64"))
+
+_hash_executor = ThreadPoolExecutor(max_workers=HASH_MAX_WORKERS, thread_name_prefix="pwhash")
+_hash_admitted = 0
+_hash_stats = {
+    "completed": 0,
+    "rejected": 0,
+    "queue_wait_ms": deque(maxlen=1000),
+    "run_ms": deque(maxlen=1000),
+}
+
+
+class HashPoolBusy(Exception):
+    """Raised when the hashing queue is full; callers should answer 503."""
+
+
+def _timed(fn, submitted_at: float, *args):
+    started = time.perf_counter()
+    try:
+        return fn(*args)
+    finally:
+        _hash_stats["queue_wait_ms"].append((started - submitted_at) * 1000)
+        _hash_stats["run_ms"].append((time.perf_counter() - started) * 1000)
+
+
+async def _run_in_hash_pool(fn, *args):
+    global _hash_admitted
+    if _hash_admitted >= HASH_MAX_WORKERS + HASH_MAX_PENDING:
+        _hash_stats["rejected"] += 1
+        raise HashPoolBusy("Password hashing queue is full")
+
+    _hash_admitted += 1
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_hash_executor, _timed, fn, time.perf_counter(), *args)
+    finally:
+        _hash_admitted -= 1
+        _hash_stats["completed"] += 1
+
+
+async def hash_password_async(password: str) -> str:
+    return await _run_in_hash_pool(hash_password, password)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    return await _run_in_hash_pool(verify_password, plain_password, hashed_password)
+
+
+def _percentile(samples, pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * pct))], 2)
+
+
+def hash_pool_stats() -> dict:
+    """Snapshot of hashing pool load and queue-time metrics (last 1000 calls)."""
+    waits = list(_hash_stats["queue_wait_ms"])
+    runs = list(_hash_stats["run_ms"])
+    return {
+        "workers": HASH_MAX_WORKERS,
+        "max_pending": HASH_MAX_PENDING,
+        "in_flight": _hash_admitted,
+        "completed": _hash_stats["completed"],
+        "rejected": _hash_stats["rejected"],
+        "queue_wait_ms": {"p50": _percentile(waits, 0.5), "p95": _percentile(waits, 0.95), "max": _percentile(waits, 1.0)},
+        "run_ms": {"p50": _percentile(runs, 0.5), "p95": _percentile(runs, 0.95), "max": _percentile(runs, 1.0)},
+    }
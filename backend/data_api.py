@@ -5,53 +5,169 @@ Will use environment variables:
 - ATLAS_DATA_API_KEY : API key
 - ATLAS_DATA_SOURCE : replica set / cluster name (default: Cluster0)
 - ATLAS_DATABASE : database name (default: mbc)
+- DATA_API_MAX_CONNECTIONS : pooled connections kept to the Data API (default: 20)
+- DATA_API_MAX_RETRIES : retries for transient failures (default: 3)
 
-Provides async functions: find_one(collection, filter), insert_one(collection, document)
+Provides async functions: find_one, find, insert_one, insert_many,
+update_one, update_many, delete_one, delete_many and aggregate. Requests go
+through one long-lived ``httpx`` client with HTTP keep-alive, opened by
+``start()`` at app startup and closed by ``close()`` at shutdown, so each
+call reuses a warm TCP+TLS connection.
+Payloads are Extended JSON, so ObjectIds and datetimes round-trip.
 """
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional
+import asyncio
+import logging
 import os
+import random
+
 import httpx
+from bson import json_util
+
+logger = logging.getLogger(__name__)
 
 ATLAS_DATA_API_URL = os.getenv("ATLAS_DATA_API_URL")
 ATLAS_DATA_API_KEY = os.getenv("ATLAS_DATA_API_KEY")
 ATLAS_DATA_SOURCE = os.getenv("ATLAS_DATA_SOURCE", "Cluster0")
 ATLAS_DATABASE = os.getenv("ATLAS_DATABASE", "mbc")
+DATA_API_MAX_CONNECTIONS = int(os.getenv("DATA_API_MAX_CONNECTIONS", "20"))
+DATA_API_MAX_RETRIES = int(os.getenv("DATA_API_MAX_RETRIES", "3"))
 
 USE_DATA_API = bool(ATLAS_DATA_API_URL and ATLAS_DATA_API_KEY)
 
-async def _post_action(action: str, payload: Dict[str, Any]) -> Dict[str, Any]:
-    url = f"{ATLAS_DATA_API_URL}/action/{action}"
-    headers = {
-        "Content-Type": "application/json",
-        "api-key": ATLAS_DATA_API_KEY,
-    }
-    async with httpx.AsyncClient(timeout=15.0) as client:
-        r = await client.post(url, json=payload, headers=headers)
-        r.raise_for_status()
-        return r.json()
+# Actions that may be repeated safely if the outcome of an attempt is unknown
+_IDEMPOTENT_ACTIONS = {"findOne", "find", "aggregate"}
+_RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Failures where the request never reached the server, so even writes are safe to retry
+_NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+class DataAPIError(Exception):
+    """Raised when a Data API action fails after all retries."""
+
+
+async def start() -> None:
+    """Open the shared keep-alive client (idempotent)."""
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            base_url=ATLAS_DATA_API_URL or "",
+            timeout=httpx.Timeout(15.0, connect=5.0),
+            limits=httpx.Limits(
+                max_connections=DATA_API_MAX_CONNECTIONS,
+                max_keepalive_connections=DATA_API_MAX_CONNECTIONS,
+                keepalive_expiry=60.0,
+            ),
+            headers={
+                "Content-Type": "application/ejson",
+                "Accept": "application/ejson",
+                "api-key": ATLAS_DATA_API_KEY or "",
+            },
+        )
+
+
+async def close() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
 
-async def find_one(collection: str, filter: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+
+def _backoff(attempt: int) -> float:
+    """Exponential backoff with full jitter: up to 0.1s, 0.2s, 0.4s, ... capped at 2s."""
+    return random.uniform(0, min(2.0, 0.1 * 2 ** attempt))
+
+
+async def _post_action(action: str, payload: Dict[str, Any]) -> Dict[str, Any]:
     if not USE_DATA_API:
         raise RuntimeError("Data API not configured")
+    if _client is None:
+        # Used outside the app lifecycle (scripts); the client then lives until close()
+        await start()
+
+    body = json_util.dumps(payload)
+    idempotent = action in _IDEMPOTENT_ACTIONS
+    attempt = 0
+    while True:
+        try:
+            r = await _client.post(f"/action/{action}", content=body)
+            if r.status_code in _RETRY_STATUSES and (idempotent or r.status_code == 429):
+                raise DataAPIError(f"{action} returned HTTP {r.status_code}")
+            r.raise_for_status()
+            return json_util.loads(r.text)
+        except (httpx.TransportError, DataAPIError) as e:
+            retryable = isinstance(e, DataAPIError) or idempotent or isinstance(e, _NOT_SENT_ERRORS)
+            if not retryable or attempt >= DATA_API_MAX_RETRIES:
+                raise DataAPIError(f"Data API {action} failed: {e}") from e
+            delay = _backoff(attempt)
+            logger.warning(f"Data API {action} attempt {attempt + 1} failed ({e}); retrying in {delay:.2f}s")
+            attempt += 1
+            await asyncio.sleep(delay)
+
+
+def _payload(collection: str, database: Optional[str], **fields) -> Dict[str, Any]:
     payload = {
         "dataSource": ATLAS_DATA_SOURCE,
-        "database": ATLAS_DATABASE,
+        "database": database or ATLAS_DATABASE,
         "collection": collection,
-        "filter": filter,
     }
-    res = await _post_action("findOne", payload)
+    payload.update({k: v for k, v in fields.items() if v is not None})
+    return payload
+
+
+async def find_one(collection: str, filter: Dict[str, Any], projection: Optional[Dict[str, Any]] = None,
+                   database: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    res = await _post_action("findOne", _payload(collection, database, filter=filter, projection=projection))
     # Data API returns document in 'document' key or null
     return res.get("document")
 
-async def insert_one(collection: str, document: Dict[str, Any]) -> Dict[str, Any]:
-    if not USE_DATA_API:
-        raise RuntimeError("Data API not configured")
-    payload = {
-        "dataSource": ATLAS_DATA_SOURCE,
-        "database": ATLAS_DATABASE,
-        "collection": collection,
-        "document": document,
-    }
-    res = await _post_action("insertOne", payload)
+
+async def find(collection: str, filter: Dict[str, Any], projection: Optional[Dict[str, Any]] = None,
+               sort: Optional[Dict[str, int]] = None, limit: Optional[int] = None, skip: Optional[int] = None,
+               database: Optional[str] = None) -> List[Dict[str, Any]]:
+    res = await _post_action("find", _payload(
+        collection, database, filter=filter, projection=projection, sort=sort, limit=limit, skip=skip,
+    ))
+    return res.get("documents", [])
+
+
+async def insert_one(collection: str, document: Dict[str, Any], database: Optional[str] = None) -> Dict[str, Any]:
+    res = await _post_action("insertOne", _payload(collection, database, document=document))
     # res contains insertedId
     return res
+
+
+async def insert_many(collection: str, documents: List[Dict[str, Any]], database: Optional[str] = None) -> Dict[str, Any]:
+    """Insert ``documents`` in one request; the response holds ``insertedIds``."""
+    return await _post_action("insertMany", _payload(collection, database, documents=documents))
+
+
+async def update_one(collection: str, filter: Dict[str, Any], update: Dict[str, Any], upsert: bool = False,
+                     database: Optional[str] = None) -> Dict[str, Any]:
+    """The response holds ``matchedCount``, ``modifiedCount`` and, on upsert, ``upsertedId``."""
+    return await _post_action("updateOne", _payload(
+        collection, database, filter=filter, update=update, upsert=upsert or None,
+    ))
+
+
+async def update_many(collection: str, filter: Dict[str, Any], update: Dict[str, Any], upsert: bool = False,
+                      database: Optional[str] = None) -> Dict[str, Any]:
+    return await _post_action("updateMany", _payload(
+        collection, database, filter=filter, update=update, upsert=upsert or None,
+    ))
+
+
+async def delete_one(collection: str, filter: Dict[str, Any], database: Optional[str] = None) -> Dict[str, Any]:
+    """The response holds ``deletedCount``."""
+    return await _post_action("deleteOne", _payload(collection, database, filter=filter))
+
+
+async def delete_many(collection: str, filter: Dict[str, Any], database: Optional[str] = None) -> Dict[str, Any]:
+    return await _post_action("deleteMany", _payload(collection, database, filter=filter))
+
+
+async def aggregate(collection: str, pipeline: List[Dict[str, Any]], database: Optional[str] = None) -> List[Dict[str, Any]]:
+    res = await _post_action("aggregate", _payload(collection, database, pipeline=pipeline))
+    return res.get("documents", [])
@@ -29,6 +29,8 @@ try:
     db = client.get_database("mbc")
     users_collection = db.users
     appointments_collection = db.appointments
+    # Per-doctor lock documents bumped inside booking transactions
+    appointment_locks_collection = db.appointment_locks
     clients_collection = db.clients
     notes_collection = db.notes
     messages_collection = db.messages
@@ -0,0 +1,290 @@
+"""
+Declarative MongoDB index registry.
+
+Every index the backend relies on is listed in ``INDEXES`` and applied by
+``ensure_indexes()`` at FastAPI startup. ``create_index`` is idempotent for an
+identical spec, so re-running on every boot is cheap.
+
+``HOT_QUERIES`` lists the queries behind the busiest endpoints; the CLI can
+explain each one and report whether the winning plan uses an index.
+
+Usage (from repo root):
+
+python backend/indexes.py --check     # report missing indexes
+python backend/indexes.py --apply     # create missing indexes
+python backend/indexes.py --explain   # verify hot queries use an index
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+from dataclasses import dataclass, field
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from pymongo import ASCENDING, DESCENDING, TEXT
+
+from database import db, db_patients
+
+logger = logging.getLogger("mbc")
+
+
+@dataclass(frozen=True)
+class IndexSpec:
+    collection: str
+    keys: tuple
+    name: str
+    options: dict = field(default_factory=dict)
+    database: str = "mbc"
+
+
+@dataclass(frozen=True)
+class HotQuery:
+    description: str
+    collection: str
+    filter: dict
+    sort: tuple = ()
+    database: str = "mbc"
+
+
+INDEXES = [
+    IndexSpec("users", (("email", ASCENDING),), "email_unique", {"unique": True}),
+    IndexSpec(
+        "messages",
+        (("conversation_id", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)),
+        "conversation_timestamp_id",
+    ),
+    IndexSpec(
+        "messages",
+        (("conversation_id", ASCENDING), ("seq", ASCENDING)),
+        "conversation_seq",
+    ),
+    IndexSpec(
+        "messages",
+        (("conversation_id", ASCENDING), ("pos", ASCENDING)),
+        "conversation_pos",
+    ),
+    IndexSpec(
+        "messages",
+        (("conversation_id", ASCENDING), ("index", ASCENDING)),
+        "conversation_index",
+    ),
+    IndexSpec(
+        "messages",
+        (("expires_at", ASCENDING),),
+        "expires_at_ttl",
+        {"expireAfterSeconds": 0},
+    ),
+    IndexSpec(
+        "messages",
+        (("content", TEXT),),
+        "content_text",
+        {"default_language": "english"},
+    ),
+    IndexSpec(
+        "conversations",
+        (("participants", ASCENDING), ("updated_at", DESCENDING)),
+        "participants_updated",
+    ),
+    IndexSpec(
+        "conversations",
+        (("participants_key", ASCENDING),),
+        "participants_key_unique",
+        {"unique": True, "partialFilterExpression": {"participants_key": {"$exists": True}}},
+    ),
+    IndexSpec(
+        "appointments",
+        (("doctor", ASCENDING), ("datetime", ASCENDING)),
+        "doctor_datetime",
+    ),
+    IndexSpec(
+        "appointments",
+        (("doctor", ASCENDING), ("start", ASCENDING), ("end", ASCENDING)),
+        "doctor_start_end",
+    ),
+    IndexSpec(
+        "notes",
+        (("client_id", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)),
+        "client_created_id",
+    ),
+    IndexSpec("contacts", (("created_at", DESCENDING), ("_id", DESCENDING)), "created_at_id"),
+    IndexSpec(
+        "contacts",
+        (("status", ASCENDING), ("created_at", DESCENDING), ("_id", DESCENDING)),
+        "status_created_id",
+    ),
+    IndexSpec("clients", (("created_at", DESCENDING), ("_id", DESCENDING)), "created_at_id"),
+    IndexSpec("notes", (("created_at", DESCENDING), ("_id", DESCENDING)), "created_at_id"),
+    IndexSpec(
+        "patients",
+        (("createdAt", DESCENDING), ("_id", DESCENDING)),
+        "created_at_id",
+        database="mbc_patients",
+    ),
+    IndexSpec(
+        "patients",
+        (("status", ASCENDING), ("createdAt", DESCENDING), ("_id", DESCENDING)),
+        "status_created_id",
+        database="mbc_patients",
+    ),
+]
+
+
+HOT_QUERIES = [
+    HotQuery("login / register lookup", "users", {"email": "probe@example.com"}),
+    HotQuery(
+        "conversation history",
+        "messages",
+        {"conversation_id": None},
+        (("timestamp", DESCENDING), ("_id", DESCENDING)),
+    ),
+    HotQuery(
+        "unread after watermark",
+        "messages",
+        {"conversation_id": None, "pos": {"$gt": 0}, "receiver_email": "probe@example.com"},
+    ),
+    HotQuery(
+        "conversation list",
+        "conversations",
+        {"participants": "probe@example.com"},
+        (("updated_at", DESCENDING),),
+    ),
+    HotQuery(
+        "doctor schedule",
+        "appointments",
+        {"doctor": "probe"},
+        (("datetime", ASCENDING),),
+    ),
+    HotQuery(
+        "appointment conflicts",
+        "appointments",
+        {"doctor": "probe", "start": {"$lt": datetime(2100, 1, 1)}, "end": {"$gt": datetime(2000, 1, 1)}},
+    ),
+    HotQuery(
+        "client notes",
+        "notes",
+        {"client_id": "probe"},
+        (("created_at", DESCENDING), ("_id", DESCENDING)),
+    ),
+    HotQuery("contact inbox", "contacts", {}, (("created_at", DESCENDING), ("_id", DESCENDING))),
+    HotQuery(
+        "delta sync",
+        "messages",
+        {"conversation_id": {"$in": [None]}, "seq": {"$gt": 0}},
+        (("seq", ASCENDING),),
+    ),
+    HotQuery("message search", "messages", {"$text": {"$search": "probe"}}),
+]
+
+
+def _collection(database: str, name: str):
+    return (db_patients if database == "mbc_patients" else db)[name]
+
+
+def _key_signature(keys) -> tuple:
+    keys = list(keys)
+    if any(v == TEXT for _, v in keys) or any(k == "_fts" for k, _ in keys):
+        # Text indexes report their key as {_fts: "text", _ftsx: 1}; a
+        # collection can only have one, so they all compare equal
+        return (("_fts", TEXT),)
+    return tuple((k, int(v) if isinstance(v, (int, float)) else v) for k, v in keys)
+
+
+async def missing_indexes() -> list:
+    """Return the registry entries whose key pattern does not exist yet."""
+    missing = []
+    existing_by_collection = {}
+    for spec in INDEXES:
+        cache_key = (spec.database, spec.collection)
+        if cache_key not in existing_by_collection:
+            info = await _collection(spec.database, spec.collection).index_information()
+            existing_by_collection[cache_key] = {
+                _key_signature(ix["key"]) for ix in info.values()
+            }
+        if _key_signature(spec.keys) not in existing_by_collection[cache_key]:
+            missing.append(spec)
+    return missing
+
+
+async def ensure_indexes() -> None:
+    """Create every registered index. Safe to call on every startup.
+
+    Failures are logged per index so one conflicting legacy index (e.g.
+    duplicate emails blocking a unique index) does not stop the app.
+    """
+    for spec in INDEXES:
+        try:
+            await _collection(spec.database, spec.collection).create_index(
+                list(spec.keys), name=spec.name, **spec.options
+            )
+        except Exception as e:
+            logger.error(f"[INDEX] Failed to create {spec.database}.{spec.collection}.{spec.name}: {e}")
+    logger.info(f"[INDEX] Ensured {len(INDEXES)} index(es)")
+
+
+def _plan_stages(plan) -> list:
+    """Flatten the stage names of an explain plan tree."""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(_plan_stages(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            stages.extend(_plan_stages(item))
+    return stages
+
+
+async def explain_hot_queries() -> list:
+    """Explain each hot query and return (query, uses_index, stages) tuples."""
+    results = []
+    for query in HOT_QUERIES:
+        cursor = _collection(query.database, query.collection).find(query.filter)
+        if query.sort:
+            cursor = cursor.sort(list(query.sort))
+        explain = await cursor.limit(1).explain()
+        stages = _plan_stages(explain.get("queryPlanner", {}).get("winningPlan", {}))
+        uses_index = "COLLSCAN" not in stages and any(
+            s in ("IXSCAN", "EXPRESS_IXSCAN", "IDHACK", "COUNT_SCAN") for s in stages
+        )
+        results.append((query, uses_index, stages))
+    return results
+
+
+async def _main():
+    parser = argparse.ArgumentParser(description="Manage MongoDB indexes")
+    parser.add_argument("--check", action="store_true", help="report missing indexes")
+    parser.add_argument("--apply", action="store_true", help="create missing indexes")
+    parser.add_argument("--explain", action="store_true", help="verify hot queries use an index")
+    args = parser.parse_args()
+    if not (args.check or args.apply or args.explain):
+        args.check = True
+
+    exit_code = 0
+    if args.apply:
+        await ensure_indexes()
+
+    if args.check or args.apply:
+        missing = await missing_indexes()
+        if missing:
+            exit_code = 1
+            for spec in missing:
+                print(f"MISSING  {spec.database}.{spec.collection}  {spec.name}  {list(spec.keys)}")
+        else:
+            print(f"OK       all {len(INDEXES)} registered indexes present")
+
+    if args.explain:
+        for query, uses_index, stages in await explain_hot_queries():
+            status = "INDEX   " if uses_index else "SCAN    "
+            if not uses_index:
+                exit_code = 1
+            print(f"{status} {query.collection:<16} {query.description:<28} {' > '.join(stages)}")
+
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(_main()))
@@ -1,5 +1,6 @@
 import sys
 import os
+import asyncio
 
 # Add backend directory to path for imports
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
@@ -7,10 +8,11 @@ sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 # Apply Pydantic v1 + Python 3.13 compatibility patch BEFORE importing FastAPI
 from pydantic_fix import *  # noqa: F401, F403
 
-from fastapi import FastAPI, HTTPException, UploadFile, File
-from auth import hash_password, verify_password, needs_rehash
+from fastapi import FastAPI, HTTPException, UploadFile, File, Query, Response
+from auth import HashPoolBusy, hash_password_async, hash_pool_stats, verify_password_async, needs_rehash
 from jwt_utils import create_access_token, verify_token
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
 from socketio import AsyncServer
 import socketio
@@ -19,8 +21,9 @@ from logging.handlers import RotatingFileHandler
 from bson import ObjectId
 from datetime import datetime, timedelta
 
-from database import users_collection, appointments_collection, clients_collection, notes_collection, messages_collection, conversations_collection, contacts_collection, patients_collection
-from data_api import USE_DATA_API, find_one as data_find_one, insert_one as data_insert_one
+from repository import repo
+from user_cache import user_profiles
+from user_directory import user_directory
 from schemas import (
     LoginRequest,
     LoginResponse,
@@ -40,7 +43,13 @@ from schemas import (
     ContactResponse,
 )
 from messaging.handlers import setup_websocket_handlers
-from messaging.handlers import connected_users
+from messaging.presence import presence
+from messaging.ingest import IngestBusy
+from messaging.service import message_ingest
+from messaging.write_behind import conversation_bumps
+from messaging.change_seq import change_seqs
+from messaging.rooms import ADMIN_ROOM, conversation_room, join_conversation_room, user_room
+from messaging.pubsub import create_client_manager
 fastapi_app = FastAPI()
 
 # Configure structured logging for backend (file + console)
@@ -65,6 +74,79 @@ if not logger.handlers:
     ch.setFormatter(formatter)
     logger.addHandler(ch)
 
+# Upload limits. Allow larger uploads for recordings; 50 MB default for demo
+MAX_UPLOAD_BYTES = 50 * 1024 * 1024
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+# Room for the multipart boundaries and part headers around the file itself
+UPLOAD_ENVELOPE_BYTES = 64 * 1024
+ALLOWED_UPLOAD_MIMES = {
+    "image/png",
+    "image/jpeg",
+    "image/jpg",
+    "image/gif",
+    "application/pdf",
+    "text/plain",
+    "application/msword",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    # allow common webm/mp4 recording formats for call recordings
+    "video/webm",
+    "audio/webm",
+    "video/mp4",
+    "audio/mp4",
+}
+
+
+class UploadSizeLimitMiddleware:
+    """
+    Enforce MAX_UPLOAD_BYTES on /api/uploads before the form is parsed.
+
+    FastAPI reads the whole multipart body into the UploadFile before the
+    handler runs, so the limit has to apply here: a declared Content-Length
+    over the limit is answered 413 without reading the body, and chunked
+    bodies are counted as they arrive and cut off once they pass it.
+    """
+
+    def __init__(self, app, path: str = "/api/uploads", max_bytes: int = MAX_UPLOAD_BYTES + UPLOAD_ENVELOPE_BYTES):
+        self.app = app
+        self.path = path
+        self.max_bytes = max_bytes
+
+    def _too_large(self) -> HTTPException:
+        return HTTPException(
+            status_code=413,
+            detail=f"File too large (max {MAX_UPLOAD_BYTES // (1024 * 1024)}MB)",
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] != self.path or scope["method"] != "POST":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        declared = headers.get(b"content-length")
+        if declared is not None and declared.isdigit() and int(declared) > self.max_bytes:
+            response = JSONResponse({"detail": self._too_large().detail}, status_code=413)
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise self._too_large()
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+# Registered before CORS so early 413 answers still carry CORS headers
+fastapi_app.add_middleware(UploadSizeLimitMiddleware)
+
+
 # Allow CORS from all origins (for development)
 # Note: allow_credentials=True cannot be used with allow_origins=["*"]
 # So we list specific origins to allow credentials
@@ -75,11 +157,14 @@ fastapi_app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Total-Count"],
 )
 
-# Setup Socket.IO
+# Setup Socket.IO. With SOCKETIO_MESSAGE_QUEUE set, emits are relayed through
+# the queue so several uvicorn workers can share rooms and sids.
 sio = AsyncServer(
     async_mode="asgi",
+    client_manager=create_client_manager(),
     cors_allowed_origins="*",
     ping_timeout=60,
     ping_interval=25,
@@ -89,15 +174,6 @@ sio = AsyncServer(
 
 # --- BEGIN SIGNALING HANDLERS ---
 
-# Helper to get sids (list) for a user id (string)
-def _get_user_sids(user_id: str):
-    # connected_users is imported in main.py: from messaging.handlers import connected_users
-    sids = connected_users.get(user_id)
-    if not sids:
-        return []
-    # ensure we return a list (could be set)
-    return list(sids)
-
 @sio.event
 async def register(sid, data):
     """
@@ -116,15 +192,10 @@ async def register(sid, data):
             logger.warning(f"register called without userId for sid {sid}")
             return
 
-        # Ensure connected_users[user_id] is a set
-        sids = connected_users.get(user_id)
-        if sids is None:
-            connected_users[user_id] = set()
-            sids = connected_users[user_id]
-        sids.add(sid)
+        await presence.add(user_id, sid)
 
         await sio.save_session(sid, {"userId": user_id})
-        await sio.enter_room(sid, f"user_{user_id}")
+        await sio.enter_room(sid, user_room(user_id))
         logger.info(f"[SIGNAL] registered user {user_id} -> sid {sid}")
     except Exception as e:
         logger.exception(f"[SIGNAL] register error: {e}")
@@ -141,11 +212,9 @@ async def call_request(sid, data):
         meta = data.get("meta", {})
 
         logger.info(f"[SIGNAL] call_request from {from_user} to {to_user}")
-        target_sids = _get_user_sids(to_user)
-        if target_sids:
-            for tsid in target_sids:
-                await sio.emit("incoming_call", {"fromUserId": from_user, "meta": meta}, to=tsid)
-            logger.info(f"[SIGNAL] incoming_call emitted to {len(target_sids)} sid(s) for {to_user}")
+        if await presence.is_online(to_user):
+            await sio.emit("incoming_call", {"fromUserId": from_user, "meta": meta}, room=user_room(to_user))
+            logger.info(f"[SIGNAL] incoming_call emitted to {to_user}")
         else:
             logger.info(f"[SIGNAL] callee {to_user} offline - cannot deliver incoming_call")
             # optional: persist missed call to DB for later
@@ -162,9 +231,7 @@ async def call_accept(sid, data):
         caller_id = data.get("fromUserId")
         callee_id = data.get("toUserId")
         logger.info(f"[SIGNAL] call_accept: callee {callee_id} accepted call from {caller_id}")
-        caller_sids = _get_user_sids(caller_id)
-        for csid in caller_sids:
-            await sio.emit("call_accepted", {"fromUserId": callee_id, "sid": sid}, to=csid)
+        await sio.emit("call_accepted", {"fromUserId": callee_id, "sid": sid}, room=user_room(caller_id))
     except Exception as e:
         logger.exception(f"[SIGNAL] call_accept error: {e}")
 
@@ -174,9 +241,7 @@ async def call_reject(sid, data):
         caller_id = data.get("fromUserId")
         callee_id = data.get("toUserId")
         logger.info(f"[SIGNAL] call_reject: callee {callee_id} rejected call from {caller_id}")
-        caller_sids = _get_user_sids(caller_id)
-        for csid in caller_sids:
-            await sio.emit("call_rejected", {"fromUserId": callee_id}, to=csid)
+        await sio.emit("call_rejected", {"fromUserId": callee_id}, room=user_room(caller_id))
     except Exception as e:
         logger.exception(f"[SIGNAL] call_reject error: {e}")
 
@@ -187,9 +252,7 @@ async def call_offer(sid, data):
     try:
         to_user = data.get("toUserId")
         logger.debug(f"[SIGNAL] call_offer from {data.get('fromUserId')} to {to_user}")
-        target_sids = _get_user_sids(to_user)
-        for tsid in target_sids:
-            await sio.emit("call_offer", data, to=tsid)
+        await sio.emit("call_offer", data, room=user_room(to_user))
     except Exception as e:
         logger.exception(f"[SIGNAL] call_offer error: {e}")
 
@@ -199,9 +262,7 @@ async def call_answer(sid, data):
     try:
         to_user = data.get("toUserId")
         logger.debug(f"[SIGNAL] call_answer from {data.get('fromUserId')} to {to_user}")
-        target_sids = _get_user_sids(to_user)
-        for tsid in target_sids:
-            await sio.emit("call_answer", data, to=tsid)
+        await sio.emit("call_answer", data, room=user_room(to_user))
     except Exception as e:
         logger.exception(f"[SIGNAL] call_answer error: {e}")
 
@@ -210,49 +271,50 @@ async def call_candidate(sid, data):
     try:
         to_user = data.get("toUserId")
         logger.debug(f"[SIGNAL] call_candidate forward to {to_user}")
-        target_sids = _get_user_sids(to_user)
-        for tsid in target_sids:
-            await sio.emit("call_candidate", data, to=tsid)
+        await sio.emit("call_candidate", data, room=user_room(to_user))
     except Exception as e:
         logger.exception(f"[SIGNAL] call_candidate error: {e}")
 
 @sio.event
 async def disconnect(sid):
-    # remove sid from connected_users mapping
+    # remove sid from the presence registry
     try:
         logger.info(f"[SIGNAL] disconnect: {sid}")
-        to_remove = []
-        for uid, sids in list(connected_users.items()):
-            if sid in sids:
-                sids.discard(sid)
-                logger.info(f"[SIGNAL] removed sid {sid} from user {uid}")
-                if not sids:
-                    # remove empty entry
-                    to_remove.append(uid)
-        for uid in to_remove:
-            connected_users.pop(uid, None)
-            logger.info(f"[SIGNAL] removed user {uid} from connected_users (no sids left)")
+        uid, went_offline = await presence.remove_sid(sid)
+        if uid is not None:
+            logger.info(f"[SIGNAL] removed sid {sid} from user {uid}")
+        if went_offline:
+            logger.info(f"[SIGNAL] removed user {uid} from presence (no sids left)")
     except Exception as e:
         logger.exception(f"[SIGNAL] disconnect error: {e}")
 
 # --- END SIGNALING HANDLERS ---
 
-# Serve uploaded files from /uploads
+# Serve uploaded files from /uploads. Uploads in progress are written to a
+# sibling directory that is not served and moved in once complete.
 uploads_dir = os.path.join(os.path.dirname(__file__), "uploads")
 os.makedirs(uploads_dir, exist_ok=True)
+upload_tmp_dir = os.path.join(os.path.dirname(__file__), "uploads_tmp")
+os.makedirs(upload_tmp_dir, exist_ok=True)
 fastapi_app.mount("/uploads", StaticFiles(directory=uploads_dir), name="uploads")
 
 # Mount Socket.IO to FastAPI - Create the ASGI app that will be exported
 app = socketio.ASGIApp(sio, fastapi_app)
 
 
+async def _upgrade_password_hash(email: str, password: str) -> None:
+    """Re-hash ``password`` with the current cost parameters and store it."""
+    try:
+        new_hash = await hash_password_async(password)
+        await repo.users.update_one({"email": email}, {"$set": {"password": new_hash}})
+        logger.info(f"Upgraded password hash for {email}")
+    except Exception as e:
+        logger.warning(f"Password hash upgrade failed for {email}: {e}")
+
+
 @fastapi_app.post("/api/auth/login", response_model=LoginResponse)
 async def login(payload: LoginRequest):
-    # If Atlas Data API is configured, use it instead of direct driver
-    if USE_DATA_API:
-        user = await data_find_one("users", {"email": payload.email})
-    else:
-        user = await users_collection.find_one({"email": payload.email})
+    user = await repo.users.find_one({"email": payload.email})
 
     if not user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
@@ -260,18 +322,24 @@ async def login(payload: LoginRequest):
     stored = user.get("password")
     valid = False
     try:
-        # If stored password is hashed, verify with passlib
+        # If stored password is hashed, verify with passlib (off the event loop)
         if isinstance(stored, str) and (stored.startswith("$2") or stored.startswith("$argon2")):
-            valid = verify_password(payload.password, stored)
+            valid = await verify_password_async(payload.password, stored)
+            if valid and needs_rehash(stored):
+                # Costs were raised (or the scheme deprecated) since this hash
+                # was made: upgrade it without holding up the login response
+                asyncio.create_task(_upgrade_password_hash(payload.email, payload.password))
         else:
             # legacy plaintext - compare and re-hash on success
             if stored == payload.password:
                 valid = True
                 try:
-                    new_hash = hash_password(payload.password)
-                    await users_collection.update_one({"email": payload.email}, {"$set": {"password": new_hash}})
+                    new_hash = await hash_password_async(payload.password)
+                    await repo.users.update_one({"email": payload.email}, {"$set": {"password": new_hash}})
                 except Exception:
                     pass
+    except HashPoolBusy:
+        raise HTTPException(status_code=503, detail="Server busy, please retry")
     except Exception:
         valid = False
 
@@ -294,11 +362,7 @@ async def register(payload: RegisterRequest):
     # Debugging: print incoming role and show that request reached the route
     # (This will only run for POST; OPTIONS is handled by CORSMiddleware.)
     logger.info(f"Register attempt: email={payload.email}, role={payload.role}")
-    # check existing user via Data API or driver
-    if USE_DATA_API:
-        existing = await data_find_one("users", {"email": payload.email})
-    else:
-        existing = await users_collection.find_one({"email": payload.email})
+    existing = await repo.users.find_one({"email": payload.email})
     if existing:
         raise HTTPException(status_code=409, detail="User already exists")
 
@@ -308,19 +372,23 @@ async def register(payload: RegisterRequest):
     # Generate full_name from email (can be updated later)
     full_name = payload.email.split('@')[0].replace('.', ' ').title()
     
+    try:
+        password_hash = await hash_password_async(payload.password)
+    except HashPoolBusy:
+        raise HTTPException(status_code=503, detail="Server busy, please retry")
+
     user_doc = {
         "email": payload.email,
-        "password": hash_password(payload.password),
+        "password": password_hash,
         "role": payload.role,
         "full_name": full_name,  # Generate from email
         "user_type": payload.role,  # Same as role
         "avatar_url": None,
         "created_at": datetime.utcnow().isoformat(),
     }
-    if USE_DATA_API:
-        await data_insert_one("users", user_doc)
-    else:
-        await users_collection.insert_one(user_doc)
+    await repo.users.insert_one(user_doc)
+    user_directory.add(user_doc)
+    user_profiles.invalidate(payload.email)
 
     if payload.role == "admin":
         msg = "Admin account created successfully"
@@ -335,49 +403,36 @@ async def register(payload: RegisterRequest):
 @fastapi_app.post("/api/appointments", response_model=AppointmentResponse)
 async def create_appointment(payload: AppointmentCreate):
     """Create a new appointment and save to MongoDB after checking availability."""
-    
-    # Parse the datetime to check for conflicts
-    appt_start = datetime.fromisoformat(payload.datetime.replace('Z', '+00:00'))
-    appt_end = appt_start + timedelta(minutes=payload.duration)
-    
-    # Extract date string for comparison (YYYY-MM-DD)
-    appt_date = appt_start.strftime("%Y-%m-%d")
-    
-    # Get all appointments for this doctor on the same date
-    existing_appts = await appointments_collection.find({
-        "doctor": payload.doctor,
-        "status": {"$ne": "cancelled"}
-    }).to_list(None)
-    
-    # Check for time overlap in Python (simpler and more reliable)
-    for existing in existing_appts:
-        existing_start = datetime.fromisoformat(existing["datetime"].replace('Z', '+00:00'))
-        existing_date = existing_start.strftime("%Y-%m-%d")
-        
-        # Only check if on the same date
-        if existing_date != appt_date:
-            continue
-        
-        existing_end = existing_start + timedelta(minutes=existing.get("duration", 60))
-        
-        # Check for overlap: new starts before existing ends AND new ends after existing starts
-        if appt_start < existing_end and appt_end > existing_start:
-            raise HTTPException(
-                status_code=409,
-                detail=f"Time slot conflict! Doctor {payload.doctor} is already booked from {existing_start.strftime('%H:%M')} to {existing_end.strftime('%H:%M')} on {appt_date}. Please choose another time."
-            )
-    
+    from scheduling import AppointmentConflict, BookingBusy, appointment_range, book_appointment, parse_appointment_datetime
+
+    try:
+        appt_start, appt_end = appointment_range(payload.datetime, payload.duration)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid appointment: {str(e)}")
+
     appointment_doc = {
         "doctor": payload.doctor,
         "datetime": payload.datetime,
+        "start": appt_start,
+        "end": appt_end,
         "purpose": payload.purpose,
         "client": payload.client,
         "duration": payload.duration,
         "status": "scheduled",
         "created_at": datetime.utcnow(),
     }
-    result = await appointments_collection.insert_one(appointment_doc)
-    appointment_doc["id"] = str(result.inserted_id)
+    try:
+        await book_appointment(appointment_doc)
+    except AppointmentConflict as conflict:
+        existing_start = parse_appointment_datetime(conflict.existing["datetime"])
+        existing_end = existing_start + timedelta(minutes=conflict.existing.get("duration", 60))
+        raise HTTPException(
+            status_code=409,
+            detail=f"Time slot conflict! Doctor {payload.doctor} is already booked from {existing_start.strftime('%H:%M')} to {existing_end.strftime('%H:%M')} on {existing_start.strftime('%Y-%m-%d')}. Please choose another time."
+        )
+    except BookingBusy as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    appointment_doc["id"] = str(appointment_doc["_id"])
     return AppointmentResponse(**appointment_doc)
 
 
@@ -388,7 +443,7 @@ async def get_appointments(doctor: str = None):
     if doctor:
         query["doctor"] = doctor
     
-    appointments = await appointments_collection.find(query).to_list(None)
+    appointments = await repo.appointments.find(query).to_list(None)
     return [
         {
             "id": str(appt["_id"]),
@@ -409,46 +464,75 @@ async def check_availability(doctor: str, datetime_str: str, duration: int = 60)
     Check if a doctor is available for a given time slot.
     Returns: { "available": true/false, "message": "..." }
     """
+    from scheduling import appointment_range, find_conflict, parse_appointment_datetime
+
     try:
-        appt_start = datetime.fromisoformat(datetime_str.replace('Z', '+00:00'))
-        appt_end = appt_start + timedelta(minutes=duration)
-        appt_date = appt_start.strftime("%Y-%m-%d")
-        
-        # Get all appointments for this doctor on the same date
-        existing_appts = await appointments_collection.find({
-            "doctor": doctor,
-            "status": {"$ne": "cancelled"}
-        }).to_list(None)
-        
-        # Check for time overlap in Python
-        for existing in existing_appts:
-            existing_start = datetime.fromisoformat(existing["datetime"].replace('Z', '+00:00'))
-            existing_date = existing_start.strftime("%Y-%m-%d")
-            
-            # Only check if on the same date
-            if existing_date != appt_date:
-                continue
-            
-            existing_end = existing_start + timedelta(minutes=existing.get("duration", 60))
-            
-            # Check for overlap
-            if appt_start < existing_end and appt_end > existing_start:
-                return {
-                    "available": False,
-                    "message": f"Doctor is busy from {existing_start.strftime('%H:%M')} to {existing_end.strftime('%H:%M')} on {appt_date}"
-                }
-        
-        return {"available": True, "message": "Time slot is available"}
+        appt_start, appt_end = appointment_range(datetime_str, duration)
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Invalid datetime format: {str(e)}")
 
+    existing = await find_conflict(doctor, appt_start, appt_end)
+    if existing:
+        existing_start = parse_appointment_datetime(existing["datetime"])
+        existing_end = existing_start + timedelta(minutes=existing.get("duration", 60))
+        return {
+            "available": False,
+            "message": f"Doctor is busy from {existing_start.strftime('%H:%M')} to {existing_end.strftime('%H:%M')} on {existing_start.strftime('%Y-%m-%d')}"
+        }
+
+    return {"available": True, "message": "Time slot is available"}
+
+
+@fastapi_app.get("/api/appointments/free-slots")
+async def get_free_slots(
+    doctor: list[str] = Query(...),
+    start_date: str = Query(...),
+    end_date: str | None = None,
+    slot_minutes: int = 60,
+    work_start: str = "09:00",
+    work_end: str = "17:00",
+    include_weekends: bool = False,
+):
+    """
+    Return every free slot for one or more doctors in a date range.
+
+    `doctor` may be repeated or comma-separated. Dates are YYYY-MM-DD and
+    working hours HH:MM (UTC). Returns: { "<doctor>": [{ "start", "end" }, ...] }
+    """
+    from datetime import date, time
+    from scheduling import MAX_APPOINTMENT_MINUTES, MAX_FREE_SLOT_DAYS, find_free_slots
+
+    doctors = [d.strip() for value in doctor for d in value.split(",") if d.strip()]
+    try:
+        first_day = date.fromisoformat(start_date)
+        last_day = date.fromisoformat(end_date) if end_date else first_day
+        day_start = time.fromisoformat(work_start)
+        day_end = time.fromisoformat(work_end)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid date or time format: {str(e)}")
+
+    if not doctors:
+        raise HTTPException(status_code=400, detail="At least one doctor is required")
+    if last_day < first_day or (last_day - first_day).days >= MAX_FREE_SLOT_DAYS:
+        raise HTTPException(status_code=400, detail=f"Date range must be 1-{MAX_FREE_SLOT_DAYS} days")
+    if day_end <= day_start:
+        raise HTTPException(status_code=400, detail="work_end must be after work_start")
+    if slot_minutes <= 0 or slot_minutes > MAX_APPOINTMENT_MINUTES:
+        raise HTTPException(status_code=400, detail="Invalid slot_minutes")
+
+    free = await find_free_slots(doctors, first_day, last_day, slot_minutes, day_start, day_end, include_weekends)
+    return {
+        doc: [{"start": start.isoformat() + "Z", "end": end.isoformat() + "Z"} for start, end in slots]
+        for doc, slots in free.items()
+    }
+
 
 @fastapi_app.delete("/api/appointments/{appointment_id}")
 async def delete_appointment(appointment_id: str):
     """Delete an appointment."""
     from bson.errors import InvalidId
     try:
-        result = await appointments_collection.delete_one({"_id": ObjectId(appointment_id)})
+        result = await repo.appointments.delete_one({"_id": ObjectId(appointment_id)})
         if result.deleted_count == 0:
             raise HTTPException(status_code=404, detail="Appointment not found")
         return SimpleMessage(message="Appointment deleted successfully")
@@ -456,6 +540,39 @@ async def delete_appointment(appointment_id: str):
         raise HTTPException(status_code=400, detail="Invalid appointment ID")
 
 
+async def _list_page(response: Response, collection, query: dict, sort_field: str, projection: dict,
+                     limit: int | None, cursor: str | None, include_total: bool) -> list:
+    """Run the shared paginated list query and expose paging metadata as headers.
+
+    List endpoints keep returning a bare JSON array; the cursor for the next
+    page is in `X-Next-Cursor` and, when requested, the total match count in
+    `X-Total-Count`. Without `limit` or `cursor` every match is returned, as
+    before paging existed, so callers that ignore the headers see all rows.
+    """
+    from pagination import InvalidCursor, paginate
+
+    try:
+        page = await paginate(
+            collection, query, sort_field,
+            projection=projection, limit=limit, cursor=cursor, include_total=include_total,
+        )
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    if page["next_cursor"]:
+        response.headers["X-Next-Cursor"] = page["next_cursor"]
+    if page["total"] is not None:
+        response.headers["X-Total-Count"] = str(page["total"])
+    return page["items"]
+
+
+def _list_filters(*filters) -> dict:
+    query = {}
+    for f in filters:
+        query.update(f)
+    return query
+
+
 @fastapi_app.post("/api/clients", response_model=ClientResponse)
 async def create_client(payload: ClientCreate):
     """Create a new client and save to MongoDB."""
@@ -468,14 +585,33 @@ async def create_client(payload: ClientCreate):
         "gender": payload.gender,
         "created_at": datetime.utcnow(),
     }
-    result = await clients_collection.insert_one(client_doc)
+    result = await repo.clients.insert_one(client_doc)
     client_doc["id"] = str(result.inserted_id)
     return ClientResponse(**client_doc)
 
 
 @fastapi_app.get("/api/clients")
-async def list_clients():
-    clients = await clients_collection.find({}).to_list(None)
+async def list_clients(
+    response: Response,
+    limit: int | None = None,
+    cursor: str | None = None,
+    created_from: str | None = None,
+    created_to: str | None = None,
+    include_total: bool = False,
+):
+    """List clients, newest first. Paged via `cursor` / `X-Next-Cursor`."""
+    from pagination import date_range_filter
+
+    try:
+        query = _list_filters(date_range_filter("created_at", created_from, created_to))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid date filter: {str(e)}")
+
+    clients = await _list_page(
+        response, repo.clients, query, "created_at",
+        {"first_name": 1, "last_name": 1, "email": 1, "phone": 1, "date_of_birth": 1, "gender": 1, "created_at": 1},
+        limit, cursor, include_total,
+    )
     return [
         {
             "id": str(c.get("_id")),
@@ -495,7 +631,7 @@ async def list_clients():
 async def get_client(client_id: str):
     from bson.errors import InvalidId
     try:
-        client = await clients_collection.find_one({"_id": ObjectId(client_id)})
+        client = await repo.clients.find_one({"_id": ObjectId(client_id)})
         if not client:
             raise HTTPException(status_code=404, detail="Client not found")
 
@@ -513,11 +649,36 @@ async def get_client(client_id: str):
 
 
 @fastapi_app.get("/api/patients")
-async def list_patients():
-    """Get patients from mbc_patients database."""
-    # Only return those that are "new" or "pending" usually, but for list let's return all and filter in frontend or add query param
-    # User requirement: "Approve/Reject" logic
-    patients = await patients_collection.find({}).sort("createdAt", -1).to_list(None)
+async def list_patients(
+    response: Response,
+    limit: int | None = None,
+    cursor: str | None = None,
+    status: str | None = None,
+    exclude_status: str | None = None,
+    created_from: str | None = None,
+    created_to: str | None = None,
+    include_total: bool = False,
+):
+    """Get patients from mbc_patients database, newest first.
+
+    `status` / `exclude_status` take comma-separated values, e.g.
+    `exclude_status=converted_to_patient,rejected` for the approval queue.
+    """
+    from pagination import date_range_filter, status_filter
+
+    try:
+        query = _list_filters(
+            status_filter("status", status, exclude_status),
+            date_range_filter("createdAt", created_from, created_to),
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid date filter: {str(e)}")
+
+    patients = await _list_page(
+        response, repo.patients, query, "createdAt",
+        {"name": 1, "email": 1, "phone": 1, "dob": 1, "status": 1, "createdAt": 1},
+        limit, cursor, include_total,
+    )
     return [
         {
             "id": str(p.get("_id")),
@@ -537,8 +698,8 @@ async def convert_external_patient(patient_id: str):
     """Convert an external patient (from patients DB) to an internal client."""
     from bson.errors import InvalidId
     try:
-        # Note: patients_collection is from db_patients (mbc_patients)
-        patient = await patients_collection.find_one({"_id": ObjectId(patient_id)})
+        # Note: repo.patients is from db_patients (mbc_patients)
+        patient = await repo.patients.find_one({"_id": ObjectId(patient_id)})
         if not patient:
             raise HTTPException(status_code=404, detail="Patient not found")
 
@@ -560,10 +721,10 @@ async def convert_external_patient(patient_id: str):
             "created_at": datetime.utcnow(),
             "source": "mbc_patients_db",
         }
-        client_result = await clients_collection.insert_one(client_doc)
+        client_result = await repo.clients.insert_one(client_doc)
 
         # Update patient status in external DB
-        await patients_collection.update_one(
+        await repo.patients.update_one(
             {"_id": ObjectId(patient_id)},
             {"$set": {"status": "converted_to_patient", "internal_client_id": str(client_result.inserted_id)}}
         )
@@ -577,7 +738,7 @@ async def convert_external_patient(patient_id: str):
 async def reject_external_patient(patient_id: str):
     from bson.errors import InvalidId
     try:
-        result = await patients_collection.update_one(
+        result = await repo.patients.update_one(
             {"_id": ObjectId(patient_id)},
             {"$set": {"status": "rejected"}}
         )
@@ -606,13 +767,12 @@ async def create_contact(payload: ContactSubmission):
         "created_at": datetime.utcnow(),
         "notes": None,
     }
-    result = await contacts_collection.insert_one(contact_doc)
+    result = await repo.contacts.insert_one(contact_doc)
     contact_doc["id"] = str(result.inserted_id)
     
     # Emit real-time update via Socket.IO
     try:
-        sio_server = sio_app
-        await sio_server.emit('new_contact', {
+        await sio.emit('new_contact', {
             'id': contact_doc['id'],
             'first_name': contact_doc['first_name'],
             'last_name': contact_doc['last_name'],
@@ -622,7 +782,7 @@ async def create_contact(payload: ContactSubmission):
             'message': contact_doc['message'],
             'status': contact_doc['status'],
             'created_at': contact_doc['created_at'].isoformat(),
-        }, to='admin', skip_sid=None)
+        }, room=ADMIN_ROOM)
     except Exception as e:
         print(f"[WARNING] Failed to emit contact notification via Socket.IO: {e}")
     
@@ -630,9 +790,35 @@ async def create_contact(payload: ContactSubmission):
 
 
 @fastapi_app.get("/api/contacts")
-async def list_contacts():
-    """Get all contact submissions."""
-    contacts = await contacts_collection.find({}).sort("created_at", -1).to_list(None)
+async def list_contacts(
+    response: Response,
+    limit: int | None = None,
+    cursor: str | None = None,
+    status: str | None = None,
+    exclude_status: str | None = None,
+    created_from: str | None = None,
+    created_to: str | None = None,
+    include_total: bool = False,
+):
+    """Get contact submissions, newest first. Paged via `cursor` / `X-Next-Cursor`."""
+    from pagination import date_range_filter, status_filter
+
+    try:
+        query = _list_filters(
+            status_filter("status", status, exclude_status),
+            date_range_filter("created_at", created_from, created_to),
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid date filter: {str(e)}")
+
+    contacts = await _list_page(
+        response, repo.contacts, query, "created_at",
+        {
+            "first_name": 1, "last_name": 1, "email": 1, "phone": 1, "reason": 1, "message": 1,
+            "preferred_contact_method": 1, "status": 1, "created_at": 1, "notes": 1,
+        },
+        limit, cursor, include_total,
+    )
     return [
         {
             "id": str(c.get("_id")),
@@ -656,7 +842,7 @@ async def get_contact(contact_id: str):
     """Get a specific contact submission."""
     from bson.errors import InvalidId
     try:
-        contact = await contacts_collection.find_one({"_id": ObjectId(contact_id)})
+        contact = await repo.contacts.find_one({"_id": ObjectId(contact_id)})
         if not contact:
             raise HTTPException(status_code=404, detail="Contact not found")
 
@@ -682,7 +868,7 @@ async def convert_contact_to_patient(contact_id: str):
     """Convert a contact submission to an actual patient/client."""
     from bson.errors import InvalidId
     try:
-        contact = await contacts_collection.find_one({"_id": ObjectId(contact_id)})
+        contact = await repo.contacts.find_one({"_id": ObjectId(contact_id)})
         if not contact:
             raise HTTPException(status_code=404, detail="Contact not found")
 
@@ -697,10 +883,10 @@ async def convert_contact_to_patient(contact_id: str):
             "created_at": datetime.utcnow(),
             "source": "contact_form",  # Track that this came from contact form
         }
-        client_result = await clients_collection.insert_one(client_doc)
+        client_result = await repo.clients.insert_one(client_doc)
         
         # Update contact status
-        await contacts_collection.update_one(
+        await repo.contacts.update_one(
             {"_id": ObjectId(contact_id)},
             {"$set": {"status": "converted_to_patient", "notes": f"Converted to patient {str(client_result.inserted_id)}"}}
         )
@@ -715,11 +901,11 @@ async def reject_contact(contact_id: str):
     """Reject a contact submission."""
     from bson.errors import InvalidId
     try:
-        contact = await contacts_collection.find_one({"_id": ObjectId(contact_id)})
+        contact = await repo.contacts.find_one({"_id": ObjectId(contact_id)})
         if not contact:
             raise HTTPException(status_code=404, detail="Contact not found")
         
-        await contacts_collection.update_one(
+        await repo.contacts.update_one(
             {"_id": ObjectId(contact_id)},
             {"$set": {"status": "rejected"}}
         )
@@ -743,19 +929,44 @@ async def create_note(payload: NoteCreate):
         "created_at": datetime.utcnow().isoformat() + "Z",
         "created_by": "Dr. Admin",
     }
-    result = await notes_collection.insert_one(note_doc)
+    result = await repo.notes.insert_one(note_doc)
     note_doc["id"] = str(result.inserted_id)
     return NoteResponse(**note_doc)
 
 
 @fastapi_app.get("/api/notes")
-async def get_notes(client_id: str = None):
-    """Get all notes or filter by client."""
+async def get_notes(
+    response: Response,
+    client_id: str = None,
+    limit: int | None = None,
+    cursor: str | None = None,
+    created_from: str | None = None,
+    created_to: str | None = None,
+    completed: bool | None = None,
+    include_total: bool = False,
+):
+    """Get notes, newest first, optionally filtered by client / completion / date."""
+    from pagination import date_range_filter
+
     query = {}
     if client_id:
         query["client_id"] = client_id
-    
-    notes = await notes_collection.find(query).sort("created_at", -1).to_list(None)
+    if completed is not None:
+        query["completed"] = True if completed else {"$ne": True}
+    try:
+        # Notes store created_at as an ISO string
+        query.update(date_range_filter("created_at", created_from, created_to, as_string=True))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid date filter: {str(e)}")
+
+    notes = await _list_page(
+        response, repo.notes, query, "created_at",
+        {
+            "note_type": 1, "content": 1, "client_id": 1, "reminder_date": 1, "reminder_time": 1,
+            "created_at": 1, "created_by": 1, "completed": 1,
+        },
+        limit, cursor, include_total,
+    )
     return [
         {
             "id": str(note["_id"]),
@@ -777,7 +988,7 @@ async def delete_note(note_id: str):
     """Delete a note."""
     from bson.errors import InvalidId
     try:
-        result = await notes_collection.delete_one({"_id": ObjectId(note_id)})
+        result = await repo.notes.delete_one({"_id": ObjectId(note_id)})
         if result.deleted_count == 0:
             raise HTTPException(status_code=404, detail="Note not found")
         return SimpleMessage(message="Note deleted successfully")
@@ -790,7 +1001,7 @@ async def complete_note(note_id: str):
     """Mark a note as completed."""
     from bson.errors import InvalidId
     try:
-        result = await notes_collection.update_one(
+        result = await repo.notes.update_one(
             {"_id": ObjectId(note_id)},
             {"$set": {"completed": True}}
         )
@@ -798,7 +1009,7 @@ async def complete_note(note_id: str):
             raise HTTPException(status_code=404, detail="Note not found")
         
         # Return updated note
-        note = await notes_collection.find_one({"_id": ObjectId(note_id)})
+        note = await repo.notes.find_one({"_id": ObjectId(note_id)})
         return {
             "id": str(note["_id"]),
             "note_type": note.get("note_type"),
@@ -818,27 +1029,29 @@ async def complete_note(note_id: str):
 
 @fastapi_app.get("/api/conversations")
 async def list_conversations(user_email: str):
-    """Get all conversations for a user."""
-    conversations = await conversations_collection.find(
-        {"participants": user_email}
-    ).sort("updated_at", -1).to_list(None)
-    
+    """Get all conversations for a user, with unread counts and last-message previews."""
+    from messaging.service import get_user_conversations, isoformat_z
+
+    conversations = await get_user_conversations(user_email)
+
     result = []
     for conv in conversations:
-        unread = await messages_collection.count_documents({
-            "conversation_id": conv["_id"],
-            "receiver_email": user_email,
-            "read": False
-        })
-        
+        last = conv.get("last_message")
         result.append({
             "id": str(conv["_id"]),
             "participants": conv.get("participants"),
             "type": conv.get("type"),
-            "created_at": conv.get("created_at"),
-            "updated_at": conv.get("updated_at"),
-            "last_message_at": conv.get("last_message_at"),
-            "unread_count": unread,
+            "name": conv.get("name"),
+            "created_at": isoformat_z(conv.get("created_at")),
+            "updated_at": isoformat_z(conv.get("updated_at")),
+            "last_message_at": isoformat_z(conv.get("last_message_at")),
+            "unread_count": conv.get("unread_count", 0),
+            "last_message": {
+                "id": str(last["_id"]),
+                "sender_email": last.get("sender_email"),
+                "content": last.get("content"),
+                "timestamp": isoformat_z(last.get("timestamp")),
+            } if last else None,
         })
     
     return result
@@ -855,28 +1068,30 @@ async def create_conversation(payload: dict):
         if not participants or not isinstance(participants, list) or len(participants) < 2:
             raise HTTPException(status_code=400, detail="participants must be an array with at least 2 emails")
 
-        # Normalize and ensure users exist
-        from messaging.service import get_or_create_conversation
+        from messaging.service import isoformat_z
 
         # For groups we'll create a new conversation document directly
-        now = datetime.utcnow().isoformat() + 'Z'
-        conv_doc = {
-            'participants': sorted(participants),
-            'type': payload.get('type', 'group'),
-            'name': payload.get('name'),
-            'created_at': now,
-            'updated_at': now,
-            'last_message_at': None,
-        }
-        result = await conversations_collection.insert_one(conv_doc)
+        now = datetime.utcnow()
+        async with change_seqs.reserve() as seq:
+            conv_doc = {
+                'participants': sorted(participants),
+                'type': payload.get('type', 'group'),
+                'name': payload.get('name'),
+                'created_at': now,
+                'updated_at': now,
+                'last_message_at': None,
+                'seq': seq,
+            }
+            result = await repo.conversations.insert_one(conv_doc)
         conv_doc['id'] = str(result.inserted_id)
+        await join_conversation_room(sio, conv_doc['id'], conv_doc['participants'])
         return {
             'id': str(result.inserted_id),
             'participants': conv_doc['participants'],
             'type': conv_doc['type'],
             'name': conv_doc.get('name'),
-            'created_at': conv_doc['created_at'],
-            'updated_at': conv_doc['updated_at'],
+            'created_at': isoformat_z(conv_doc['created_at']),
+            'updated_at': isoformat_z(conv_doc['updated_at']),
             'last_message_at': conv_doc['last_message_at'],
             'unread_count': 0,
         }
@@ -888,80 +1103,211 @@ async def create_conversation(payload: dict):
 
 
 @fastapi_app.get("/api/conversations/{conversation_id}/messages")
-async def get_conversation_messages(conversation_id: str, limit: int = 30, skip: int = 0):
-    """Get messages from a conversation with pagination."""
+async def get_conversation_messages(
+    conversation_id: str,
+    limit: int = 30,
+    before: str | None = None,
+    after: str | None = None,
+):
+    """Get a page of messages from a conversation.
+
+    Omit both cursors for the latest page. Pass `next_cursor` back as
+    `before` to scroll into older history, or `prev_cursor` as `after` to
+    fetch newer messages.
+    """
     from bson.errors import InvalidId
-    
+    from messaging.service import get_conversation_messages as get_page, isoformat_z
+    from pagination import InvalidCursor
+
+    if limit <= 0 or limit > 200:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 200")
+    if before and after:
+        raise HTTPException(status_code=400, detail="Use either before or after, not both")
+
     try:
-        messages = await messages_collection.find(
-            {"conversation_id": ObjectId(conversation_id)}
-        ).sort("timestamp", -1).skip(skip).limit(limit).to_list(None)
-        
-        # Reverse to show chronological order
-        messages.reverse()
-        
-        return [
+        page = await get_page(conversation_id, limit=limit, before=before, after=after)
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="Invalid conversation ID")
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    return {
+        "messages": [
             {
                 "id": str(msg["_id"]),
                 "conversation_id": conversation_id,
                 "sender_email": msg.get("sender_email"),
                 "receiver_email": msg.get("receiver_email"),
                 "content": msg.get("content"),
-                "timestamp": msg.get("timestamp"),
+                "timestamp": isoformat_z(msg.get("timestamp")),
                 "read": msg.get("read", False),
-                "read_at": msg.get("read_at"),
+                "read_at": isoformat_z(msg.get("read_at")),
+                **({"read_by": msg["read_by"]} if "read_by" in msg else {}),
             }
-            for msg in messages
-        ]
+            for msg in page["messages"]
+        ],
+        "next_cursor": page["next_cursor"],
+        "prev_cursor": page["prev_cursor"],
+    }
+
+
+@fastapi_app.get("/api/messages/search")
+async def search_messages(
+    q: str,
+    user_email: str,
+    conversation_id: str | None = None,
+    limit: int = Query(20, ge=1, le=50),
+    cursor: str | None = None,
+):
+    """Full-text search over the user's messages, best matches first.
+
+    Scope to one conversation with `conversation_id`; otherwise every
+    conversation the user takes part in is searched. Each result carries a
+    `snippet` and `highlights` ([start, end] offsets into the snippet).
+    Pass `next_cursor` back as `cursor` for the next page.
+    """
+    from bson.errors import InvalidId
+    from messaging.service import isoformat_z, search_messages as run_search
+    from pagination import InvalidCursor
+
+    if not q.strip():
+        raise HTTPException(status_code=400, detail="Search query is empty")
+
+    try:
+        page = await run_search(q, user_email, conversation_id=conversation_id, limit=limit, cursor=cursor)
     except InvalidId:
         raise HTTPException(status_code=400, detail="Invalid conversation ID")
+    except InvalidCursor:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+    return {
+        "results": [
+            {
+                "id": str(msg["_id"]),
+                "conversation_id": str(msg["conversation_id"]),
+                "sender_email": msg.get("sender_email"),
+                "receiver_email": msg.get("receiver_email"),
+                "timestamp": isoformat_z(msg.get("timestamp")),
+                "score": round(msg["score"], 4),
+                "snippet": msg["snippet"],
+                "highlights": msg["highlights"],
+            }
+            for msg in page["results"]
+        ],
+        "next_cursor": page["next_cursor"],
+    }
+
+
+@fastapi_app.get("/api/sync")
+async def sync(
+    user_email: str,
+    since: str | None = None,
+    limit: int = Query(500, ge=1, le=1000),
+):
+    """Changes in the user's conversations since a sync cursor.
+
+    Call without `since` to get the current cursor, then after every
+    reconnect (once the socket has rejoined) with the last `cursor` seen.
+    Returns new, edited and deleted messages, and conversations that are
+    new or whose `read_state` watermarks moved, in change order; repeat with the returned `cursor` while `has_more`.
+    Live events carry the same `seq`, so clients can also advance the
+    cursor from them.
+    """
+    from messaging.service import isoformat_z, sync_changes
+
+    try:
+        since_seq = int(since) if since is not None else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    changes = await sync_changes(user_email, since_seq, limit=limit)
+    return {
+        "messages": [
+            {
+                "id": str(msg["_id"]),
+                "conversation_id": str(msg["conversation_id"]),
+                "sender_email": msg.get("sender_email"),
+                "receiver_email": msg.get("receiver_email"),
+                "content": msg.get("content"),
+                "attachments": msg.get("attachments", []),
+                "timestamp": isoformat_z(msg.get("timestamp")),
+                "read": msg.get("read", False),
+                "read_at": isoformat_z(msg.get("read_at")),
+                **({"read_by": msg["read_by"]} if "read_by" in msg else {}),
+                "edited": msg.get("edited", False),
+                "edited_at": isoformat_z(msg.get("edited_at")),
+                "deleted": msg.get("deleted", False),
+                "deleted_at": isoformat_z(msg.get("deleted_at")),
+                "seq": msg["seq"],
+            }
+            for msg in changes["messages"]
+        ],
+        "conversations": [
+            {
+                "id": str(conv["_id"]),
+                "participants": conv.get("participants"),
+                "type": conv.get("type"),
+                "name": conv.get("name"),
+                "created_at": isoformat_z(conv.get("created_at")),
+                "updated_at": isoformat_z(conv.get("updated_at")),
+                "last_message_at": isoformat_z(conv.get("last_message_at")),
+                "read_state": [
+                    {
+                        "email": mark["email"],
+                        "message_id": str(mark["message_id"]),
+                        "read_at": isoformat_z(mark.get("at")),
+                    }
+                    for mark in (conv.get("read_state") or {}).values()
+                ],
+                "seq": conv.get("seq"),
+            }
+            for conv in changes["conversations"]
+        ],
+        "cursor": str(changes["cursor"]),
+        "has_more": changes["has_more"],
+    }
 
 
 @fastapi_app.put("/api/messages/{message_id}")
 async def edit_message(message_id: str, payload: dict):
     """Edit a message content. Expects { "content": "new text" }"""
     from bson.errors import InvalidId
+    from messaging.service import isoformat_z
     try:
         new_content = payload.get('content')
         if new_content is None:
             raise HTTPException(status_code=400, detail="content required")
 
-        msg = await messages_collection.find_one({"_id": ObjectId(message_id)})
+        msg = await repo.messages.find_one({"_id": ObjectId(message_id)})
         if not msg:
             raise HTTPException(status_code=404, detail="Message not found")
 
-        now = datetime.utcnow().isoformat() + 'Z'
-        await messages_collection.update_one({"_id": ObjectId(message_id)}, {"$set": {"content": new_content, "edited": True, "edited_at": now}})
+        now = datetime.utcnow()
+        async with change_seqs.reserve() as seq:
+            await repo.messages.update_one(
+                {"_id": ObjectId(message_id)},
+                {"$set": {"content": new_content, "edited": True, "edited_at": now, "seq": seq}},
+            )
 
         # prepare response
-        updated = await messages_collection.find_one({"_id": ObjectId(message_id)})
+        updated = await repo.messages.find_one({"_id": ObjectId(message_id)})
         response = {
             "id": str(updated["_id"]),
             "conversation_id": str(updated.get("conversation_id")),
             "sender_email": updated.get("sender_email"),
             "receiver_email": updated.get("receiver_email"),
             "content": updated.get("content"),
-            "timestamp": updated.get("timestamp"),
+            "timestamp": isoformat_z(updated.get("timestamp")),
             "edited": updated.get("edited", False),
-            "edited_at": updated.get("edited_at"),
+            "edited_at": isoformat_z(updated.get("edited_at")),
+            "seq": updated.get("seq"),
         }
 
-        # broadcast to participants if online
+        # broadcast to every participant's open tabs via the conversation room
         try:
-            conv = await conversations_collection.find_one({"_id": ObjectId(updated.get('conversation_id'))})
-            if conv:
-                participants = conv.get('participants', [])
-                for p in participants:
-                    sids = connected_users.get(p)
-                    if sids:
-                        for sid in list(sids):
-                            try:
-                                await sio.emit('message_edited', response, to=sid)
-                            except Exception:
-                                try:
-                                    sids.discard(sid)
-                                except Exception:
-                                    pass
+            await sio.emit('message_edited', response, room=conversation_room(updated.get('conversation_id')))
         except Exception:
             logger.exception('Error broadcasting message_edited')
 
@@ -974,32 +1320,30 @@ async def edit_message(message_id: str, payload: dict):
 async def delete_message(message_id: str):
     """Soft-delete a message by setting deleted flag."""
     from bson.errors import InvalidId
+    from messaging.service import isoformat_z
     try:
-        msg = await messages_collection.find_one({"_id": ObjectId(message_id)})
+        msg = await repo.messages.find_one({"_id": ObjectId(message_id)})
         if not msg:
             raise HTTPException(status_code=404, detail="Message not found")
 
-        now = datetime.utcnow().isoformat() + 'Z'
-        await messages_collection.update_one({"_id": ObjectId(message_id)}, {"$set": {"deleted": True, "deleted_at": now, "content": ''}})
+        now = datetime.utcnow()
+        async with change_seqs.reserve() as seq:
+            await repo.messages.update_one(
+                {"_id": ObjectId(message_id)},
+                {"$set": {"deleted": True, "deleted_at": now, "content": '', "seq": seq}},
+            )
 
-        response = {"id": message_id, "deleted": True, "deleted_at": now}
+        response = {
+            "id": message_id,
+            "conversation_id": str(msg.get("conversation_id")),
+            "deleted": True,
+            "deleted_at": isoformat_z(now),
+            "seq": seq,
+        }
 
-        # broadcast deletion to participants
+        # broadcast to every participant's open tabs via the conversation room
         try:
-            conv = await conversations_collection.find_one({"_id": ObjectId(msg.get('conversation_id'))})
-            if conv:
-                participants = conv.get('participants', [])
-                for p in participants:
-                    sids = connected_users.get(p)
-                    if sids:
-                        for sid in list(sids):
-                            try:
-                                await sio.emit('message_deleted', response, to=sid)
-                            except Exception:
-                                try:
-                                    sids.discard(sid)
-                                except Exception:
-                                    pass
+            await sio.emit('message_deleted', response, room=conversation_room(msg.get('conversation_id')))
         except Exception:
             logger.exception('Error broadcasting message_deleted')
 
@@ -1017,22 +1361,23 @@ async def send_message(payload: MessageCreate):
         sender_email = payload.sender_email
         receiver_email = payload.receiver_email
         content = payload.content.strip()
+        conversation_id = payload.conversation_id
         
-        if not sender_email or not receiver_email or not content:
+        if not sender_email or not (receiver_email or conversation_id) or not content:
             raise HTTPException(status_code=400, detail="Missing required fields")
         
         if sender_email == receiver_email:
             raise HTTPException(status_code=400, detail="Cannot send message to yourself")
         
-        # Get or create conversation
-        conversation_id = payload.conversation_id
+        # Get or create conversation (groups have no single receiver)
+        from messaging.service import resolve_recipient
+        conv, receiver_email = await resolve_recipient(sender_email, receiver_email, conversation_id)
         if not conversation_id:
-            from messaging.service import get_or_create_conversation
-            conv = await get_or_create_conversation(sender_email, receiver_email)
             conversation_id = str(conv["_id"])
+            await join_conversation_room(sio, conversation_id, conv["participants"])
         
         # Save message (with optional attachments)
-        from messaging.service import save_message as save_msg
+        from messaging.service import save_message as save_msg, isoformat_z
         attachments = payload.attachments if hasattr(payload, 'attachments') else None
         message = await save_msg(
             conversation_id=conversation_id,
@@ -1042,105 +1387,174 @@ async def send_message(payload: MessageCreate):
             attachments=attachments,
         )
         
-        logger.info(f"[REST API] Message saved: {sender_email} → {receiver_email}: {content[:50]}")
+        logger.info(f"[REST API] Message saved: {sender_email} → {receiver_email or conversation_id}: {content[:50]}")
         
-        return {
+        response = {
             "id": str(message["_id"]),
             "conversation_id": conversation_id,
             "sender_email": sender_email,
             "receiver_email": receiver_email,
             "content": content,
-            "timestamp": message["timestamp"],
+            "timestamp": isoformat_z(message["timestamp"]),
             "attachments": message.get("attachments", []),
             "read": False,
+            "seq": message.get("seq"),
         }
+        if receiver_email is None:
+            # Group message: delivered once through the conversation room
+            await sio.emit("receive_message", response, room=conversation_room(conversation_id))
+        return response
+    except HTTPException:
+        raise
     except InvalidId:
         raise HTTPException(status_code=400, detail="Invalid conversation ID")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except IngestBusy:
+        raise HTTPException(status_code=503, detail="Server busy, please retry")
     except Exception as e:
         logger.exception(f"[REST API] Error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @fastapi_app.post("/api/messages/{message_id}/read")
-async def mark_message_read(message_id: str):
-    """Mark a message as read."""
+async def mark_message_read(message_id: str, user_email: str | None = None):
+    """Mark a message, and everything before it in its conversation, as read.
+
+    `user_email` is the reader; it defaults to the receiver and is required
+    for group messages.
+    """
     from bson.errors import InvalidId
-    from messaging.service import mark_message_as_read
+    from messaging.service import ReaderRequired, mark_message_as_read, isoformat_z, read_receipt_payload
     
     try:
-        message = await mark_message_as_read(message_id)
-        return {
-            "id": str(message["_id"]),
-            "read": True,
-            "read_at": message.get("read_at"),
-        }
+        message, watermark = await mark_message_as_read(message_id, user_email)
     except InvalidId:
         raise HTTPException(status_code=400, detail="Invalid message ID")
-    except ValueError:
-        raise HTTPException(status_code=404, detail="Message not found")
+    except ReaderRequired as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    
+    if watermark:
+        await sio.emit(
+            "message_read_receipt",
+            read_receipt_payload(watermark),
+            room=conversation_room(watermark["conversation_id"]),
+        )
+    response = {
+        "id": str(message["_id"]),
+        "read": message.get("read", False),
+        "read_at": isoformat_z(message.get("read_at")),
+    }
+    if "read_by" in message:
+        response["read_by"] = message["read_by"]
+    return response
 
 
-@fastapi_app.post("/api/uploads")
-async def upload_file(file: UploadFile = File(...)):
-    """Simple file upload endpoint. Accepts multipart/form-data with a file field named 'file'.
-    Saves the file to the backend uploads directory and returns metadata including a public URL.
+@fastapi_app.post("/api/conversations/{conversation_id}/read")
+async def mark_conversation_read(conversation_id: str, payload: dict):
+    """Mark a conversation read up to a message (default: the latest).
+
+    Expected payload: { "user_email": "a@example.com", "up_to": "<message id>" }
+    One write moves the reader's watermark and one `message_read_receipt`
+    goes to the conversation; `read` is false if nothing new was read.
     """
-    from fastapi import UploadFile, File
+    from bson.errors import InvalidId
+    from messaging.service import mark_conversation_read as mark_read, read_receipt_payload
+
+    user_email = payload.get("user_email")
+    if not user_email:
+        raise HTTPException(status_code=400, detail="user_email required")
+
     try:
-        if file is None:
-            # FastAPI will normally validate; return error
-            raise HTTPException(status_code=400, detail="No file provided")
-
-        # sanitize and generate unique filename
-        import uuid
-        orig_name = file.filename
-        ext = os.path.splitext(orig_name)[1]
-        safe_name = f"{uuid.uuid4().hex}{ext}"
-        dest_path = os.path.join(uploads_dir, safe_name)
-
-        content = await file.read()
-
-        # Server-side validation: max size and allowed mime types
-        # Allow larger uploads for recordings; 50 MB default for demo
-        MAX_BYTES = 50 * 1024 * 1024  # 50 MB limit
-        allowed_mimes = [
-            "image/png",
-            "image/jpeg",
-            "image/jpg",
-            "image/gif",
-            "application/pdf",
-            "text/plain",
-            "application/msword",
-            "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-            # allow common webm/mp4 recording formats for call recordings
-            "video/webm",
-            "audio/webm",
-            "video/mp4",
-            "audio/mp4",
-        ]
+        watermark = await mark_read(conversation_id, user_email, up_to=payload.get("up_to"))
+    except InvalidId:
+        raise HTTPException(status_code=400, detail="Invalid conversation or message ID")
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
 
-        if len(content) > MAX_BYTES:
-            raise HTTPException(status_code=413, detail="File too large (max 10MB)")
+    if not watermark:
+        return {"conversation_id": conversation_id, "read": False}
+    receipt = read_receipt_payload(watermark)
+    await sio.emit("message_read_receipt", receipt, room=conversation_room(watermark["conversation_id"]))
+    return {**receipt, "read": True}
 
-        mime = getattr(file, 'content_type', 'application/octet-stream')
-        if mime not in allowed_mimes:
-            raise HTTPException(status_code=400, detail=f"Unsupported file type: {mime}")
 
-        with open(dest_path, "wb") as dest:
-            dest.write(content)
+@fastapi_app.post("/api/uploads")
+async def upload_file(file: UploadFile = File(...)):
+    """Simple file upload endpoint. Accepts multipart/form-data with a file field named 'file'.
+    Saves the file to the backend uploads directory and returns metadata including a public URL.
 
-        url = f"/uploads/{safe_name}"
-        return {
-            "filename": orig_name,
-            "url": url,
-            "size": len(content),
-            "mime": mime,
-        }
+    UploadSizeLimitMiddleware rejects oversized bodies before they are
+    parsed. The file is then copied in fixed-size chunks with async file I/O
+    to a temporary file outside the served directory, and only appears under
+    its public name once fully written (atomic rename).
+    """
+    import uuid
+    import aiofiles
+    import aiofiles.os
+
+    if file is None:
+        # FastAPI will normally validate; return error
+        raise HTTPException(status_code=400, detail="No file provided")
+
+    # Validate the declared type before reading any of the body
+    mime = getattr(file, 'content_type', None) or 'application/octet-stream'
+    if mime not in ALLOWED_UPLOAD_MIMES:
+        raise HTTPException(status_code=400, detail=f"Unsupported file type: {mime}")
+
+    # sanitize and generate unique filename
+    orig_name = file.filename
+    ext = os.path.splitext(orig_name or "")[1]
+    safe_name = f"{uuid.uuid4().hex}{ext}"
+    dest_path = os.path.join(uploads_dir, safe_name)
+    tmp_path = os.path.join(upload_tmp_dir, f"{safe_name}.part")
+
+    size = 0
+    try:
+        async with aiofiles.open(tmp_path, "wb") as dest:
+            while True:
+                chunk = await file.read(UPLOAD_CHUNK_BYTES)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > MAX_UPLOAD_BYTES:
+                    raise HTTPException(
+                        status_code=413,
+                        detail=f"File too large (max {MAX_UPLOAD_BYTES // (1024 * 1024)}MB)",
+                    )
+                await dest.write(chunk)
+
+        await aiofiles.os.replace(tmp_path, dest_path)
     except HTTPException:
+        await _discard_partial_upload(tmp_path)
         raise
     except Exception as e:
+        await _discard_partial_upload(tmp_path)
         logger.exception(f"[UPLOAD] Error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    finally:
+        await file.close()
+
+    url = f"/uploads/{safe_name}"
+    return {
+        "filename": orig_name,
+        "url": url,
+        "size": size,
+        "mime": mime,
+    }
+
+
+async def _discard_partial_upload(path: str):
+    import aiofiles.os
+
+    try:
+        await aiofiles.os.remove(path)
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning(f"[UPLOAD] Could not remove partial upload {path}: {e}")
 
 
 @fastapi_app.get("/api/users/search")
@@ -1149,19 +1563,14 @@ async def search_users(q: str):
     if not q or len(q) < 2:
         raise HTTPException(status_code=400, detail="Query too short")
     
-    # Search all users (both admin and doctor roles)
-    users = await users_collection.find({
-        "$or": [
-            {"email": {"$regex": q, "$options": "i"}},
-            {"full_name": {"$regex": q, "$options": "i"}},
-        ]
-    }).limit(10).to_list(None)
+    # Search all users (both admin and doctor roles) in the in-memory directory
+    users = await user_directory.search(q, limit=10)
     
     return [
         {
-            "email": user.get("email"),
-            "full_name": user.get("full_name", user.get("email").split("@")[0]),
-            "role": user.get("role"),
+            "email": user["email"],
+            "full_name": user["full_name"],
+            "role": user["role"],
         }
         for user in users
     ]
@@ -1172,7 +1581,7 @@ async def get_recent_users(limit: int = 10):
     """Get recently registered users."""
     try:
         # Get all recent registrations (all roles)
-        recent = await users_collection.find({}).sort("_id", -1).limit(limit).to_list(None)
+        recent = await repo.users.find({}).sort("_id", -1).limit(limit).to_list(None)
         
         return [
             {
@@ -1192,19 +1601,38 @@ async def get_recent_users(limit: int = 10):
 @fastapi_app.get("/api/messages/unread-count")
 async def get_unread_count(user_email: str):
     """Get total unread message count for a user."""
-    count = await messages_collection.count_documents({
-        "receiver_email": user_email,
-        "read": False
-    })
+    from messaging.service import get_unread_message_count
+
+    count = await get_unread_message_count(user_email)
     return {"unread_count": count}
 
 
 # Setup WebSocket handlers
 @fastapi_app.on_event("startup")
 async def startup_event():
-    """Initialize WebSocket handlers on startup."""
+    """Initialize WebSocket handlers and database indexes on startup."""
     await setup_websocket_handlers(sio)
     logger.info("[INFO] WebSocket handlers initialized")
+    await presence.start()
+    await repo.start()
+    logger.info(f"[INFO] Database backend: {repo.backend} (transactions: {repo.supports_transactions})")
+    await user_directory.start()
+    await message_ingest.start()
+    if repo.backend == "motor":
+        from indexes import ensure_indexes
+        await ensure_indexes()
+
+
+@fastapi_app.on_event("shutdown")
+async def shutdown_event():
+    """Release this worker's presence entries and close pooled API connections."""
+    await presence.close()
+    await user_directory.close()
+    # Write queued messages and pending conversation bumps while the database is still reachable
+    await message_ingest.close()
+    await conversation_bumps.close()
+    await change_seqs.close()
+    await repo.close()
 
 
 @fastapi_app.get("/api/debug/connected-users")
@@ -1215,11 +1643,29 @@ async def debug_connected_users():
     development only and secure or remove it in production.
     """
     try:
-        from messaging.handlers import connected_users
-
-        # Convert sets to lists for JSON serialization
-        return {email: list(sids) for email, sids in connected_users.items()}
+        return await presence.snapshot()
     except Exception as e:
-        logger.exception(f"[DEBUG] Error returning connected_users: {e}")
+        logger.exception(f"[DEBUG] Error returning presence snapshot: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+
+@fastapi_app.get("/api/debug/hash-pool")
+async def debug_hash_pool():
+    """Dev-only endpoint: password hashing pool load and queue-time metrics."""
+    return hash_pool_stats()
+
+
+@fastapi_app.get("/api/debug/message-ingest")
+async def debug_message_ingest():
+    """Dev-only endpoint: message ingestion queue depth and batch metrics."""
+    return {
+        **message_ingest.snapshot(),
+        "conversation_bumps": conversation_bumps.stats,
+        "change_seqs": change_seqs.snapshot(),
+    }
+
+
+@fastapi_app.get("/api/debug/user-cache")
+async def debug_user_cache():
+    """Dev-only endpoint: user profile cache hit/miss metrics."""
+    return user_profiles.snapshot()
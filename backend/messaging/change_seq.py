@@ -0,0 +1,258 @@
+"""
+Change sequence numbers for delta sync.
+
+Every change a client may have missed (new, edited, deleted or read
+messages, new conversations) stamps its document with ``seq`` from one
+global counter. Reconnecting clients ask for everything above the last
+``seq`` they saw (see ``messaging.service.sync_changes``).
+
+A number is reserved before the write that carries it commits, so a higher
+``seq`` can become visible before a lower one. Each worker therefore keeps a
+*floor* - the lowest ``seq`` it may still commit - next to the counter, set
+in the same write that reserves the numbers, and ``committed()`` only
+reports numbers below every live floor. Sync never moves a cursor past a
+change that is still in flight.
+
+Reservations that arrive while the counter is being written are merged into
+the next write (one range split between them), so a worker keeps at most one
+counter update in flight however many changes it is making. Finished writes
+wake a publisher that moves the floor up, at most once per
+``CHANGE_SEQ_PUBLISH_MS``, and removes it when the worker goes idle. A worker
+reads its own floor from memory; floors not refreshed for
+``CHANGE_SEQ_FLOOR_TTL_S`` (a worker that died) are ignored.
+"""
+import asyncio
+import logging
+import os
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from repository import repo
+
+logger = logging.getLogger("mbc")
+
+CHANGE_SEQ_ID = "changes"
+CHANGE_SEQ_PUBLISH_MS = int(os.getenv("CHANGE_SEQ_PUBLISH_MS", "50"))
+CHANGE_SEQ_FLOOR_TTL_S = int(os.getenv("CHANGE_SEQ_FLOOR_TTL_S", "30"))
+
+
+class ChangeSequence:
+    def __init__(self, publish_ms: int = CHANGE_SEQ_PUBLISH_MS, floor_ttl_s: int = CHANGE_SEQ_FLOOR_TTL_S):
+        self.interval = publish_ms / 1000
+        self.floor_ttl = timedelta(seconds=floor_ttl_s)
+        self.instance = uuid.uuid4().hex
+        self._waiting = []  # (count, future) merged into the next counter write
+        self._in_flight = set()  # first number of each reserved, unreleased range
+        self._published = None  # floor currently stored for this worker, if any
+        self._published_at = None
+        self._advancing = False  # a counter write is out; its numbers are not in _in_flight yet
+        self._write_lock = asyncio.Lock()
+        self._released = asyncio.Event()
+        self._task = None
+        self._closed = False
+        self.stats = {"reserved": 0, "counter_writes": 0, "publishes": 0}
+
+    @property
+    def _floor_key(self) -> str:
+        return f"floors.{self.instance}"
+
+    @asynccontextmanager
+    async def reserve(self, count: int = 1):
+        """
+        Reserve ``count`` consecutive numbers and yield the highest.
+
+        Perform the write that carries them inside the block: the numbers
+        stay in flight (holding back ``committed()``) until it exits.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.append((count, future))
+        try:
+            async with self._write_lock:
+                if not future.done():
+                    advance = asyncio.ensure_future(self._advance())
+                    try:
+                        await asyncio.shield(advance)
+                    except asyncio.CancelledError:
+                        # Other requests share this counter write: finish it
+                        # before another one may start
+                        await asyncio.wait([advance])
+                        raise
+                    except Exception:
+                        pass  # every request in the batch, this one too, gets it from its future
+            first = future.result()
+        except asyncio.CancelledError:
+            self._abandon(future)
+            raise
+        try:
+            yield first + count - 1
+        finally:
+            self._in_flight.discard(first)
+            self._released.set()
+
+    def _abandon(self, future: asyncio.Future) -> None:
+        """Forget a reservation whose caller was cancelled, so it cannot pin the floor."""
+        self._waiting = [(count, f) for count, f in self._waiting if f is not future]
+
+        def release(f: asyncio.Future) -> None:
+            if not f.cancelled() and f.exception() is None:
+                self._in_flight.discard(f.result())
+                self._released.set()
+
+        # It may already belong to a counter write that has not finished
+        future.add_done_callback(release)
+
+    async def _advance(self) -> None:
+        """Reserve one range for every waiting request, moving our floor in the same write."""
+        batch, self._waiting = self._waiting, []
+        total = sum(count for count, _ in batch)
+        now = datetime.utcnow()
+        pending = min(self._in_flight) if self._in_flight else None
+
+        # Left set if the write is cancelled: committed() then just stays
+        # behind our stored floor, which is safe
+        self._advancing = True
+        try:
+            if repo.backend == "motor":
+                head = {"$ifNull": ["$seq", 0]}
+                floor = {"$add": [head, 1]}
+                if pending is not None:
+                    floor = {"$min": [pending, floor]}
+                doc = await repo.counters.find_one_and_update(
+                    {"_id": CHANGE_SEQ_ID},
+                    [{"$set": {"seq": {"$add": [head, total]}, self._floor_key: {"floor": floor, "at": now}}}],
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER,
+                )
+                end = doc["seq"]
+                await self._prune(doc, now)
+            else:
+                end = await self._advance_cas(total, pending, now)
+        except Exception as e:
+            self._advancing = False
+            for _, future in batch:
+                future.set_exception(e)
+            raise
+
+        first = end - total + 1
+        self._published = min(first, pending) if pending is not None else first
+        self._published_at = now
+        self.stats["counter_writes"] += 1
+        self.stats["reserved"] += total
+        for count, future in batch:
+            # Registered before anyone can publish a floor above them
+            self._in_flight.add(first)
+            future.set_result(first)
+            first += count
+        self._advancing = False
+        if self._task is None and not self._closed:
+            self._task = asyncio.get_running_loop().create_task(self._publish_loop())
+
+    async def _advance_cas(self, total: int, pending: int | None, now: datetime) -> int:
+        # The Data API has no atomic find-and-modify: compare-and-set instead
+        while True:
+            doc = await repo.counters.find_one({"_id": CHANGE_SEQ_ID})
+            head = (doc or {}).get("seq", 0)
+            floor = {"floor": min(head + 1, pending) if pending is not None else head + 1, "at": now}
+            if doc is None:
+                try:
+                    await repo.counters.insert_one(
+                        {"_id": CHANGE_SEQ_ID, "seq": head + total, "floors": {self.instance: floor}}
+                    )
+                    return head + total
+                except DuplicateKeyError:
+                    continue
+            res = await repo.counters.update_one(
+                {"_id": CHANGE_SEQ_ID, "seq": head},
+                {"$set": {"seq": head + total, self._floor_key: floor}},
+            )
+            if res.matched_count:
+                await self._prune(doc, now)
+                return head + total
+
+    async def _prune(self, doc: dict, now: datetime) -> None:
+        """Drop floors left behind by workers that stopped without removing them."""
+        cutoff = now - self.floor_ttl
+        for instance, mark in (doc.get("floors") or {}).items():
+            if instance != self.instance and mark.get("at") and mark["at"] < cutoff:
+                await repo.counters.update_one(
+                    {"_id": CHANGE_SEQ_ID, f"floors.{instance}.at": mark["at"]},
+                    {"$unset": {f"floors.{instance}": ""}},
+                )
+
+    async def _publish(self) -> None:
+        async with self._write_lock:
+            if self._in_flight:
+                floor = min(self._in_flight)
+                fresh = datetime.utcnow() - self._published_at < self.floor_ttl / 3
+                if floor == self._published and fresh:
+                    return
+                now = datetime.utcnow()
+                await repo.counters.update_one(
+                    {"_id": CHANGE_SEQ_ID}, {"$set": {self._floor_key: {"floor": floor, "at": now}}}
+                )
+                self._published, self._published_at = floor, now
+            else:
+                if self._published is None:
+                    return
+                await repo.counters.update_one({"_id": CHANGE_SEQ_ID}, {"$unset": {self._floor_key: ""}})
+                self._published = None
+            self.stats["publishes"] += 1
+
+    async def _publish_loop(self) -> None:
+        refresh = self.floor_ttl.total_seconds() / 3
+        try:
+            while self._published is not None and not self._closed:
+                try:
+                    await asyncio.wait_for(self._released.wait(), refresh)
+                except asyncio.TimeoutError:
+                    pass
+                self._released.clear()
+                try:
+                    await self._publish()
+                except Exception as e:
+                    logger.error(f"[CHANGE-SEQ] Publishing floor failed: {e}")
+                await asyncio.sleep(self.interval)
+        finally:
+            self._task = None
+
+    async def committed(self) -> int:
+        """Highest ``seq`` below which every change has been written (or abandoned)."""
+        doc = await repo.counters.find_one({"_id": CHANGE_SEQ_ID})
+        if doc is None:
+            return 0
+        cutoff = datetime.utcnow() - self.floor_ttl
+        # Our own floor is known exactly from memory, without waiting for it
+        # to be published - except while a counter write is out: until it
+        # returns, the numbers it reserved are only in the floor stored with them
+        own = self._advancing
+        floors = [
+            mark["floor"] for instance, mark in (doc.get("floors") or {}).items()
+            if (instance != self.instance or own) and mark.get("at") and mark["at"] >= cutoff
+        ]
+        if self._in_flight:
+            floors.append(min(self._in_flight))
+        return min([doc.get("seq", 0)] + [floor - 1 for floor in floors])
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "in_flight": len(self._in_flight), "floor": self._published}
+
+    async def close(self) -> None:
+        """Stop publishing and remove this worker's floor."""
+        self._closed = True
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        async with self._write_lock:
+            if self._published is not None:
+                try:
+                    await repo.counters.update_one({"_id": CHANGE_SEQ_ID}, {"$unset": {self._floor_key: ""}})
+                except Exception as e:
+                    logger.error(f"[CHANGE-SEQ] Could not remove floor at shutdown: {e}")
+                self._published = None
+
+
+change_seqs = ChangeSequence()
@@ -2,20 +2,22 @@
 WebSocket event handlers for real-time messaging
 """
 from socketio import AsyncServer
-from database import users_collection
+from user_cache import user_profiles
 from jwt_utils import verify_token
 from messaging.service import (
-    get_or_create_conversation,
+    resolve_recipient,
     save_message,
+    mark_conversation_read,
     mark_message_as_read,
+    read_receipt_payload,
+    isoformat_z,
 )
+from messaging.ingest import IngestBusy
+from messaging.presence import presence
+from messaging.rooms import conversation_room, join_conversation_room, join_user_rooms, user_room
 import logging
 
 
-# Track connected users: { user_email: set(sid, ...) }
-connected_users = {}
-
-
 async def setup_websocket_handlers(sio: AsyncServer):
     """
     Register all WebSocket event handlers.
@@ -31,59 +33,33 @@ async def setup_websocket_handlers(sio: AsyncServer):
     async def on_connect(sid, environ):
         logger.info(f"[WebSocket] User connected: {sid}")
 
-    async def safe_emit(event: str, data: dict, email: str = None, sids: set = None):
-        """Emit `event` to the provided set of `sids` (or the sids for `email`).
+    async def safe_emit(event: str, data: dict, email: str = None):
+        """Emit `event` to every open tab of `email` through their user room.
 
-        This helper wraps emits in try/except and removes stale sids from the
-        `connected_users` mapping if an emit fails.
+        The server manager encodes the packet once and fans it out, so the
+        cost no longer grows with a per-sid Python loop.
         """
-        if sids is None:
-            if not email:
-                return
-            sids = connected_users.get(email)
-            if not sids:
-                return
-
-        # iterate over a copy since we may remove items
-        for rsid in list(sids):
-            try:
-                await sio.emit(event, data, to=rsid)
-            except Exception as e:
-                logger.warning(f"[WebSocket] Cannot send to sid {rsid}: {e}")
-                try:
-                    sids.discard(rsid)
-                except Exception:
-                    pass
-
-        # if we were emitting by email and the set became empty, remove mapping
-        if email and (not sids or len(sids) == 0):
-            if email in connected_users:
-                try:
-                    del connected_users[email]
-                except Exception:
-                    pass
+        if not email:
+            return
+        try:
+            await sio.emit(event, data, room=user_room(email))
+        except Exception as e:
+            logger.warning(f"[WebSocket] Cannot send {event} to {email}: {e}")
     
     @sio.on("disconnect")
     async def on_disconnect(sid):
-        # Remove SID from any user entry that contains it
-        removed_emails = []
-        for email, sids in list(connected_users.items()):
-            if sid in sids:
-                sids.discard(sid)
-                if len(sids) == 0:
-                    # no more connections for user
-                    del connected_users[email]
-                    removed_emails.append(email)
-
-        # Broadcast offline status for users that lost their last connection
-        for email in removed_emails:
+        user_email, went_offline = await presence.remove_sid(sid)
+
+        # Broadcast offline status if that was the user's last connection
+        if went_offline:
             try:
-                await sio.emit("user_offline", {"email": email})
+                await sio.emit("user_offline", {"email": user_email})
             except Exception as e:
-                logger.error(f"[WebSocket] Error emitting user_offline for {email}: {e}")
+                logger.error(f"[WebSocket] Error emitting user_offline for {user_email}: {e}")
 
         logger.info(f"[WebSocket] User disconnected: {sid}")
-        logger.info(f"[WebSocket] Remaining users: {list(connected_users.keys())}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"[WebSocket] Remaining users: {await presence.users()}")
     
     @sio.on("user_joined")
     async def on_user_joined(sid, data):
@@ -111,18 +87,16 @@ async def setup_websocket_handlers(sio: AsyncServer):
             await sio.emit("error", {"message": "Email required"}, to=sid)
             return
 
-        # Verify user exists
-        user = await users_collection.find_one({"email": user_email})
+        # Verify user exists (cached: reconnect storms reuse one lookup per user)
+        user = await user_profiles.get(user_email)
         if not user:
             await sio.emit("error", {"message": "User not found"}, to=sid)
             return
         
-        # Store connection (support multiple tabs per user)
-        s = connected_users.get(user_email)
-        if not s:
-            s = set()
-            connected_users[user_email] = s
-        s.add(sid)
+        # Store connection (support multiple tabs per user) and join the
+        # user, role and conversation rooms used for delivery
+        await presence.add(user_email, sid)
+        await join_user_rooms(sio, sid, user_email, user.get("role"))
 
         # Broadcast online status
         try:
@@ -143,7 +117,7 @@ async def setup_websocket_handlers(sio: AsyncServer):
         Args:
             sid: Socket session ID
             data: {
-                "receiver_email": "doctor@example.com",
+                "receiver_email": "doctor@example.com",  # omit for group conversations
                 "content": "Hello!",
                 "conversation_id": "optional_conv_id"
             }
@@ -152,7 +126,6 @@ async def setup_websocket_handlers(sio: AsyncServer):
             logger.debug(f"[on_send_message] Received from {sid}")
             logger.debug(f"[on_send_message] Data: {data}")
             
-            sender_email = None
             receiver_email = data.get("receiver_email")
             content = data.get("content", "").strip()
             conversation_id = data.get("conversation_id")
@@ -162,28 +135,25 @@ async def setup_websocket_handlers(sio: AsyncServer):
             logger.debug(f"[on_send_message] conversation_id: {conversation_id}")
             
             # Find sender by SID
-            for email, sids in connected_users.items():
-                if sid in sids:
-                    sender_email = email
-                    break
+            sender_email = await presence.user_for(sid)
             
             logger.debug(f"[on_send_message] sender_email: {sender_email}")
-            logger.debug(f"[on_send_message] connected_users: {connected_users}")
             
             if not sender_email:
                 logger.warning("[on_send_message] ERROR: User not identified")
                 await sio.emit("error", {"message": "User not identified"}, to=sid)
                 return
             
-            if not receiver_email or not content:
+            if not (receiver_email or conversation_id) or not content:
                 logger.warning("[on_send_message] ERROR: Invalid message data")
                 await sio.emit("error", {"message": "Invalid message data"}, to=sid)
                 return
             
-            # Get or create conversation
+            # Get or create conversation (groups have no single receiver)
+            conv, receiver_email = await resolve_recipient(sender_email, receiver_email, conversation_id)
             if not conversation_id:
-                conv = await get_or_create_conversation(sender_email, receiver_email)
                 conversation_id = str(conv["_id"])
+                await join_conversation_room(sio, conversation_id, conv["participants"])
             
             # Save message
             message = await save_message(
@@ -200,20 +170,26 @@ async def setup_websocket_handlers(sio: AsyncServer):
                 "sender_email": sender_email,
                 "receiver_email": receiver_email,
                 "content": content,
-                "timestamp": message["timestamp"],
+                "timestamp": isoformat_z(message["timestamp"]),
                 "read": False,
+                "seq": message.get("seq"),
             }
             
             # Send confirmation to sender
             await sio.emit("message_sent_confirmed", message_data, to=sid)
 
-            # Send message to receiver if online (to all open tabs) using safe_emit
-            receiver_sids = connected_users.get(receiver_email)
-            if receiver_sids:
-                await safe_emit("receive_message", message_data, sids=receiver_sids, email=receiver_email)
+            if receiver_email:
+                # Send message to all of the receiver's open tabs
+                await safe_emit("receive_message", message_data, email=receiver_email)
+            else:
+                # One emit to the conversation room reaches every member's tabs
+                await sio.emit("receive_message", message_data, room=conversation_room(conversation_id), skip_sid=sid)
             
-            logger.info(f"[Message] {sender_email} → {receiver_email}: {content[:50]}")
+            logger.info(f"[Message] {sender_email} → {receiver_email or conversation_id}: {content[:50]}")
         
+        except IngestBusy:
+            logger.warning(f"[on_send_message] Ingestion queue full, rejecting message from {sid}")
+            await sio.emit("error", {"message": "Server busy, please retry"}, to=sid)
         except Exception as e:
             logger.exception(f"[Error] send_message: {str(e)}")
             await sio.emit("error", {"message": str(e)}, to=sid)
@@ -234,24 +210,30 @@ async def setup_websocket_handlers(sio: AsyncServer):
         is_typing = data.get("is_typing", False)
         
         # Find sender
-        sender_email = None
-        for email, sids in connected_users.items():
-            if sid in sids:
-                sender_email = email
-                break
+        sender_email = await presence.user_for(sid)
         
         if not sender_email or not receiver_email:
             return
         
         # Send to receiver if online (support multiple tabs)
-        receiver_sids = connected_users.get(receiver_email)
-        if receiver_sids:
-            await safe_emit("user_typing", {"sender_email": sender_email, "is_typing": is_typing}, sids=receiver_sids, email=receiver_email)
+        await safe_emit("user_typing", {"sender_email": sender_email, "is_typing": is_typing}, email=receiver_email)
+    
+    async def emit_read_receipt(watermark: dict):
+        """One receipt per watermark move, to every participant's open tabs."""
+        try:
+            await sio.emit(
+                "message_read_receipt",
+                read_receipt_payload(watermark),
+                room=conversation_room(watermark["conversation_id"]),
+            )
+        except Exception as e:
+            logger.warning(f"[WebSocket] Cannot send read receipt: {e}")
     
     @sio.on("mark_message_read")
     async def on_mark_message_read(sid, data):
         """
-        Mark a message as read and broadcast read receipt.
+        Mark a message (and everything before it) as read and broadcast the
+        read receipt.
         
         Args:
             sid: Socket session ID
@@ -260,30 +242,44 @@ async def setup_websocket_handlers(sio: AsyncServer):
         try:
             message_id = data.get("message_id")
             
-            if not message_id:
+            reader_email = await presence.user_for(sid)
+            if not message_id or not reader_email:
                 return
             
-            # Mark as read
-            message = await mark_message_as_read(message_id)
+            _, watermark = await mark_message_as_read(message_id, reader_email)
             
-            # Find sender and receiver
-            sender_email = message.get("sender_email")
-            receiver_email = None
-            for email, sids in connected_users.items():
-                if sid in sids:
-                    receiver_email = email
-                    break
-
-            if not sender_email or not receiver_email:
-                return
-
-            # Send read receipt to sender if online (all sender tabs)
-            sender_sids = connected_users.get(sender_email)
-            if sender_sids:
-                await safe_emit("message_read_receipt", {"message_id": message_id, "read_at": message["read_at"]}, sids=sender_sids, email=sender_email)
+            # Already covered by an earlier receipt: nothing to broadcast
+            if watermark:
+                await emit_read_receipt(watermark)
         
         except Exception as e:
             logger.exception(f"[Error] mark_message_read: {str(e)}")
+    
+    @sio.on("mark_conversation_read")
+    async def on_mark_conversation_read(sid, data):
+        """
+        Mark a whole conversation as read in one write and send one receipt.
+        
+        Args:
+            sid: Socket session ID
+            data: {
+                "conversation_id": "conv_123",
+                "up_to": "msg_456"   # optional, defaults to the latest message
+            }
+        """
+        try:
+            conversation_id = data.get("conversation_id")
+            reader_email = await presence.user_for(sid)
+            
+            if not conversation_id or not reader_email:
+                return
+            
+            watermark = await mark_conversation_read(conversation_id, reader_email, up_to=data.get("up_to"))
+            if watermark:
+                await emit_read_receipt(watermark)
+        
+        except Exception as e:
+            logger.exception(f"[Error] mark_conversation_read: {str(e)}")
 
     # ---------- CALL / WEBRTC signalling handlers ----------
     @sio.on("call.invite")
@@ -294,11 +290,7 @@ async def setup_websocket_handlers(sio: AsyncServer):
         """
         try:
             # find sender
-            sender_email = None
-            for email, sids in connected_users.items():
-                if sid in sids:
-                    sender_email = email
-                    break
+            sender_email = await presence.user_for(sid)
 
             to = data.get("to")
             conv = data.get("conversation_id")
@@ -310,8 +302,6 @@ async def setup_websocket_handlers(sio: AsyncServer):
 
             payload = {"from": sender_email, "conversation_id": conv, "meta": meta}
             logger.info(f"[Call] invite from {sender_email} -> {to} (conv={conv}) payload={payload}")
-            sids = connected_users.get(to)
-            logger.info(f"[Call] target sids for {to}: {sids}")
             await safe_emit("call.invite", payload, email=to)
             logger.info(f"[Call] invite forwarded from {sender_email} to {to} (conv={conv})")
         except Exception as e:
@@ -325,11 +315,7 @@ async def setup_websocket_handlers(sio: AsyncServer):
         data: { "to": "callee@example.com", "sdp": {...}, "conversation_id": "..." }
         """
         try:
-            sender_email = None
-            for email, sids in connected_users.items():
-                if sid in sids:
-                    sender_email = email
-                    break
+            sender_email = await presence.user_for(sid)
 
             to = data.get("to")
             sdp = data.get("sdp")
@@ -341,14 +327,9 @@ async def setup_websocket_handlers(sio: AsyncServer):
 
             logger.info(f"[Call] offer from {sender_email} -> {to} (conv={conv}) sdp_keys={list(sdp.keys()) if isinstance(sdp, dict) else 'sdp_present'}")
             # Debug: snapshot connected users mapping to verify target SIDs
-            try:
-                snapshot = {k: list(v) for k, v in connected_users.items()}
-                logger.debug(f"[Call] connected_users snapshot: {snapshot}")
-            except Exception:
-                logger.debug(f"[Call] connected_users keys: {list(connected_users.keys())}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"[Call] target sids for {to}: {await presence.sids_for(to)}")
 
-            sids = connected_users.get(to)
-            logger.info(f"[Call] target sids for {to}: {sids}")
             await safe_emit("call.offer", {"from": sender_email, "sdp": sdp, "conversation_id": conv}, email=to)
             logger.info(f"[Call] offer forwarded from {sender_email} to {to}")
         except Exception as e:
@@ -362,11 +343,7 @@ async def setup_websocket_handlers(sio: AsyncServer):
         data: { "to": "caller@example.com", "sdp": {...}, "conversation_id": "..." }
         """
         try:
-            sender_email = None
-            for email, sids in connected_users.items():
-                if sid in sids:
-                    sender_email = email
-                    break
+            sender_email = await presence.user_for(sid)
 
             to = data.get("to")
             sdp = data.get("sdp")
@@ -377,8 +354,6 @@ async def setup_websocket_handlers(sio: AsyncServer):
                 return
 
             logger.info(f"[Call] answer from {sender_email} -> {to} (conv={conv})")
-            sids = connected_users.get(to)
-            logger.info(f"[Call] target sids for {to}: {sids}")
             await safe_emit("call.answer", {"from": sender_email, "sdp": sdp, "conversation_id": conv}, email=to)
             logger.info(f"[Call] answer forwarded from {sender_email} to {to}")
         except Exception as e:
@@ -392,11 +367,7 @@ async def setup_websocket_handlers(sio: AsyncServer):
         data: { "to": "peer@example.com", "candidate": {...}, "conversation_id": "..." }
         """
         try:
-            sender_email = None
-            for email, sids in connected_users.items():
-                if sid in sids:
-                    sender_email = email
-                    break
+            sender_email = await presence.user_for(sid)
 
             to = data.get("to")
             candidate = data.get("candidate")
@@ -407,8 +378,6 @@ async def setup_websocket_handlers(sio: AsyncServer):
                 return
 
             logger.info(f"[Call] ice from {sender_email} -> {to} (conv={conv}) candidate_keys={list(candidate.keys()) if isinstance(candidate, dict) else 'candidate_present'}")
-            sids = connected_users.get(to)
-            logger.info(f"[Call] target sids for {to}: {sids}")
             await safe_emit("call.ice", {"from": sender_email, "candidate": candidate, "conversation_id": conv}, email=to)
             logger.info(f"[Call] ice forwarded from {sender_email} to {to}")
         except Exception as e:
@@ -422,11 +391,7 @@ async def setup_websocket_handlers(sio: AsyncServer):
         data: { "to": "peer@example.com", "conversation_id": "...", "reason": "user_hangup" }
         """
         try:
-            sender_email = None
-            for email, sids in connected_users.items():
-                if sid in sids:
-                    sender_email = email
-                    break
+            sender_email = await presence.user_for(sid)
 
             to = data.get("to")
             conv = data.get("conversation_id")
@@ -0,0 +1,174 @@
+"""
+Group-commit ingestion queue for new messages.
+
+``save_message`` hands each message document to ``MessageIngestQueue.submit``
+and awaits it. Workers take the first queued message, keep gathering for up
+to ``MESSAGE_INGEST_WINDOW_MS`` (or ``MESSAGE_INGEST_MAX_BATCH`` messages)
+and write the whole batch with one ``insert_many`` plus one unread-counter
+bulk write. Each ``submit`` resolves only once its batch has been written,
+so a sender's ``message_sent_confirmed`` still means "stored".
+
+The queue is bounded by ``MESSAGE_INGEST_MAX_PENDING``; when it is full,
+``submit`` waits up to ``MESSAGE_INGEST_ENQUEUE_TIMEOUT_MS`` for room and
+then raises ``IngestBusy`` (answered as 503 / a socket error). A window of
+0 disables batching and every message is written on its own.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+
+logger = logging.getLogger("mbc")
+
+MESSAGE_INGEST_WINDOW_MS = float(os.getenv("MESSAGE_INGEST_WINDOW_MS", "5"))
+MESSAGE_INGEST_MAX_BATCH = int(os.getenv("MESSAGE_INGEST_MAX_BATCH", "200"))
+MESSAGE_INGEST_MAX_PENDING = int(os.getenv("MESSAGE_INGEST_MAX_PENDING", "2000"))
+MESSAGE_INGEST_WORKERS = int(os.getenv("MESSAGE_INGEST_WORKERS", "2"))
+MESSAGE_INGEST_ENQUEUE_TIMEOUT_MS = float(os.getenv("MESSAGE_INGEST_ENQUEUE_TIMEOUT_MS", "1000"))
+
+
+class IngestBusy(Exception):
+    """Raised when the ingestion queue stays full; callers should answer 503."""
+
+
+def _percentile(samples: list, pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * pct))], 2)
+
+
+class MessageIngestQueue:
+    """
+    Batches message inserts.
+
+    ``writer`` is an async callable taking a list of message documents and
+    returning one entry per document: None when it was stored, or the
+    exception that kept it from being stored.
+    """
+
+    def __init__(
+        self,
+        writer,
+        window_ms: float = MESSAGE_INGEST_WINDOW_MS,
+        max_batch: int = MESSAGE_INGEST_MAX_BATCH,
+        max_pending: int = MESSAGE_INGEST_MAX_PENDING,
+        workers: int = MESSAGE_INGEST_WORKERS,
+        enqueue_timeout_ms: float = MESSAGE_INGEST_ENQUEUE_TIMEOUT_MS,
+    ):
+        self.writer = writer
+        self.window = window_ms / 1000
+        self.max_batch = max(1, max_batch)
+        self.max_pending = max_pending
+        self.workers = max(1, workers)
+        self.enqueue_timeout = enqueue_timeout_ms / 1000
+        self._queue = None
+        self._tasks = []
+        self._batch_sizes = deque(maxlen=1000)
+        self._commit_ms = deque(maxlen=1000)
+        self.stats = {"messages": 0, "batches": 0, "failed": 0, "rejected": 0}
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    async def submit(self, message_doc: dict) -> dict:
+        """Queue ``message_doc`` and return it once its batch is stored."""
+        if self.window <= 0 or not self.running:
+            # Batching disabled, or called outside the app (scripts, tools)
+            error = (await self.writer([message_doc]))[0]
+            if error is not None:
+                raise error
+            return message_doc
+
+        future = asyncio.get_running_loop().create_future()
+        try:
+            await asyncio.wait_for(self._queue.put((message_doc, future)), self.enqueue_timeout)
+        except asyncio.TimeoutError:
+            self.stats["rejected"] += 1
+            raise IngestBusy("message ingestion queue is full")
+        # A cancelled sender must not cancel the write the batch already owns
+        await asyncio.shield(future)
+        return message_doc
+
+    async def _gather(self) -> list:
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.window
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _commit(self, batch: list) -> None:
+        started = time.perf_counter()
+        docs = [doc for doc, _ in batch]
+        try:
+            errors = await self.writer(docs)
+        except Exception as e:
+            logger.error(f"[INGEST] Batch of {len(docs)} message(s) failed: {e}")
+            errors = [e] * len(docs)
+        self._commit_ms.append((time.perf_counter() - started) * 1000)
+        self._batch_sizes.append(len(docs))
+        self.stats["batches"] += 1
+        for (_, future), error in zip(batch, errors):
+            if error is None:
+                self.stats["messages"] += 1
+                if not future.done():
+                    future.set_result(None)
+            else:
+                self.stats["failed"] += 1
+                if not future.done():
+                    future.set_exception(error)
+
+    async def _worker(self) -> None:
+        while True:
+            batch = await self._gather()
+            try:
+                await self._commit(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def start(self) -> None:
+        if self.running or self.window <= 0:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_pending)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def close(self, timeout: float = 10.0) -> None:
+        """Write everything already queued, then stop the workers."""
+        if not self.running:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"[INGEST] {self._queue.qsize()} queued message(s) not written before shutdown")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def snapshot(self) -> dict:
+        sizes = list(self._batch_sizes)
+        commits = list(self._commit_ms)
+        return {
+            **self.stats,
+            "window_ms": self.window * 1000,
+            "max_batch": self.max_batch,
+            "max_pending": self.max_pending,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "avg_batch_size": round(sum(sizes) / len(sizes), 2) if sizes else None,
+            "commit_ms": {"p50": _percentile(commits, 0.5), "p95": _percentile(commits, 0.95), "max": _percentile(commits, 1.0)},
+        }
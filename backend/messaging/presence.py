@@ -0,0 +1,329 @@
+"""
+Presence registry - tracks which Socket.IO sessions belong to which user.
+
+Keeps both directions (user -> sids and sid -> user) so that resolving the
+sender of an event, or cleaning up on disconnect, is a dict lookup instead of
+a scan over every connected user.
+
+Two backends share the same async API:
+
+- ``PresenceRegistry``: in-process dicts; correct for a single worker and
+  for tests that run several Socket.IO servers in one process.
+- ``RedisPresence``: shared across worker processes through any
+  Redis-protocol server, so a sid connected to worker A is visible when
+  worker B needs to deliver to that user.
+
+``create_presence()`` picks the backend from ``PRESENCE_URL`` (falling back
+to ``SOCKETIO_MESSAGE_QUEUE``); a ``redis://``/``rediss://`` URL selects
+Redis, anything else the in-process registry.
+
+Redis entries expire after ``PRESENCE_TTL_SECONDS`` unless the worker that
+owns them keeps refreshing them, so a worker that dies without running its
+shutdown hook does not leave its users online forever.
+"""
+import asyncio
+import logging
+import os
+import uuid
+
+logger = logging.getLogger("mbc")
+
+PRESENCE_TTL_SECONDS = int(os.getenv("PRESENCE_TTL_SECONDS", "60"))
+
+
+class PresenceRegistry:
+    """Bidirectional user <-> sid index for connected sockets (in-process)."""
+
+    def __init__(self):
+        self._sids_by_user = {}
+        self._user_by_sid = {}
+
+    async def add(self, user: str, sid: str) -> bool:
+        """
+        Associate ``sid`` with ``user``.
+
+        A sid belongs to at most one user; re-registering it under another
+        user moves it.
+
+        Returns:
+            True if this is the user's first connection (they just came online)
+        """
+        previous = self._user_by_sid.get(sid)
+        if previous == user:
+            return False
+        if previous is not None:
+            await self.remove_sid(sid)
+
+        sids = self._sids_by_user.get(user)
+        first = not sids
+        if sids is None:
+            sids = self._sids_by_user[user] = set()
+        sids.add(sid)
+        self._user_by_sid[sid] = user
+        return first
+
+    async def remove_sid(self, sid: str) -> tuple:
+        """
+        Forget ``sid``.
+
+        Returns:
+            (user, went_offline) - user is None if the sid was unknown;
+            went_offline is True if that was the user's last connection
+        """
+        user = self._user_by_sid.pop(sid, None)
+        if user is None:
+            return None, False
+
+        sids = self._sids_by_user.get(user)
+        if sids is not None:
+            sids.discard(sid)
+            if not sids:
+                del self._sids_by_user[user]
+                return user, True
+        return user, False
+
+    async def user_for(self, sid: str) -> str | None:
+        """Return the user owning ``sid``, or None if it never identified."""
+        return self._user_by_sid.get(sid)
+
+    async def sids_for(self, user: str) -> set:
+        """Return a copy of the sids currently open for ``user``."""
+        return set(self._sids_by_user.get(user, ()))
+
+    async def is_online(self, user: str) -> bool:
+        return user in self._sids_by_user
+
+    async def users(self) -> list:
+        return list(self._sids_by_user.keys())
+
+    async def snapshot(self) -> dict:
+        """JSON-friendly copy of the user -> sids mapping (for debugging)."""
+        return {user: list(sids) for user, sids in self._sids_by_user.items()}
+
+    async def start(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        self._sids_by_user.clear()
+        self._user_by_sid.clear()
+
+
+_ADD_SCRIPT = """
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[3])
+local added = redis.call('SADD', KEYS[2], ARGV[2])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+redis.call('SADD', KEYS[3], ARGV[1])
+redis.call('SADD', KEYS[4], ARGV[2])
+if added == 1 and redis.call('SCARD', KEYS[2]) == 1 then
+    return 1
+end
+return 0
+"""
+
+# KEYS[4] is the user the caller expects the sid to belong to; if the sid
+# has moved to someone else since, nothing changes and the caller retries
+_REMOVE_SCRIPT = """
+local user = redis.call('GET', KEYS[1])
+if not user then
+    redis.call('SREM', KEYS[3], ARGV[1])
+    return {}
+end
+if user ~= ARGV[2] then
+    return {user, -1}
+end
+redis.call('SREM', KEYS[3], ARGV[1])
+redis.call('DEL', KEYS[1])
+redis.call('SREM', KEYS[4], ARGV[1])
+if redis.call('SCARD', KEYS[4]) == 0 then
+    redis.call('SREM', KEYS[2], user)
+    return {user, 1}
+end
+return {user, 0}
+"""
+
+
+class RedisPresence:
+    """
+    Presence shared between worker processes through a Redis-protocol server.
+
+    Each mutation is a single Lua script so the two directions never drift
+    apart. Sids owned by this worker are also cached locally, which keeps
+    ``user_for`` (called on every inbound event) free of network round trips.
+    Sids are tracked per worker instance and released by ``close()`` at
+    shutdown.
+
+    While running, a heartbeat refreshes the TTL on this worker's keys and an
+    ``alive`` marker every ``ttl / 3`` seconds, and reaps the sids of any
+    instance whose marker has expired.
+    """
+
+    def __init__(self, url: str, prefix: str = "presence", ttl: int = PRESENCE_TTL_SECONDS):
+        try:
+            import redis.asyncio as aioredis
+        except ImportError as e:
+            raise RuntimeError(
+                "Redis presence requires the 'redis' package (pip install redis)"
+            ) from e
+
+        self._redis = aioredis.from_url(url, decode_responses=True)
+        # Hash tag: every presence key lands in one Redis Cluster slot, as
+        # the multi-key scripts require
+        self._prefix = f"{{{prefix}}}"
+        self._instance_id = uuid.uuid4().hex
+        self._ttl = max(3, ttl)
+        self._local = {}
+        self._heartbeat_task = None
+        self._add = self._redis.register_script(_ADD_SCRIPT)
+        self._remove = self._redis.register_script(_REMOVE_SCRIPT)
+
+    def _sid_key(self, sid: str) -> str:
+        return f"{self._prefix}:sid:{sid}"
+
+    def _user_key(self, user: str) -> str:
+        return f"{self._prefix}:user:{user}"
+
+    @property
+    def _users_key(self) -> str:
+        return f"{self._prefix}:users"
+
+    @property
+    def _instances_key(self) -> str:
+        return f"{self._prefix}:instances"
+
+    def _owned_key(self, instance_id: str) -> str:
+        return f"{self._prefix}:instance:{instance_id}"
+
+    def _alive_key(self, instance_id: str) -> str:
+        return f"{self._prefix}:alive:{instance_id}"
+
+    @property
+    def _instance_key(self) -> str:
+        return self._owned_key(self._instance_id)
+
+    async def add(self, user: str, sid: str) -> bool:
+        previous = await self.user_for(sid)
+        if previous == user:
+            return False
+        if previous is not None:
+            await self.remove_sid(sid)
+
+        first = await self._add(
+            keys=[self._sid_key(sid), self._user_key(user), self._users_key, self._instance_key],
+            args=[user, sid, self._ttl],
+        )
+        self._local[sid] = user
+        return bool(first)
+
+    async def remove_sid(self, sid: str, instance_id: str | None = None) -> tuple:
+        owned_key = self._owned_key(instance_id or self._instance_id)
+        user = self._local.pop(sid, None) or await self._redis.get(self._sid_key(sid))
+        if user is None:
+            await self._redis.srem(owned_key, sid)
+            return None, False
+        while True:
+            # Every key the script touches is declared, as Redis Cluster requires
+            result = await self._remove(
+                keys=[self._sid_key(sid), self._users_key, owned_key, self._user_key(user)],
+                args=[sid, user],
+            )
+            if not result:
+                return None, False
+            if int(result[1]) >= 0:
+                return result[0], bool(int(result[1]))
+            user = result[0]
+
+    async def user_for(self, sid: str) -> str | None:
+        user = self._local.get(sid)
+        if user is None:
+            user = await self._redis.get(self._sid_key(sid))
+        return user
+
+    async def sids_for(self, user: str) -> set:
+        return set(await self._redis.smembers(self._user_key(user)))
+
+    async def is_online(self, user: str) -> bool:
+        return bool(await self._redis.exists(self._user_key(user)))
+
+    async def users(self) -> list:
+        users = list(await self._redis.smembers(self._users_key))
+        if not users:
+            return []
+        pipe = self._redis.pipeline(transaction=False)
+        for user in users:
+            pipe.exists(self._user_key(user))
+        live = await pipe.execute()
+        # A user's sid set expired with its worker; drop the stale index entry
+        stale = [user for user, exists in zip(users, live) if not exists]
+        if stale:
+            await self._redis.srem(self._users_key, *stale)
+        return [user for user, exists in zip(users, live) if exists]
+
+    async def snapshot(self) -> dict:
+        users = await self.users()
+        if not users:
+            return {}
+        pipe = self._redis.pipeline(transaction=False)
+        for user in users:
+            pipe.smembers(self._user_key(user))
+        return {user: list(sids) for user, sids in zip(users, await pipe.execute())}
+
+    async def _refresh(self) -> None:
+        pipe = self._redis.pipeline(transaction=False)
+        pipe.set(self._alive_key(self._instance_id), 1, ex=self._ttl)
+        pipe.sadd(self._instances_key, self._instance_id)
+        for sid, user in list(self._local.items()):
+            pipe.expire(self._sid_key(sid), self._ttl)
+            pipe.expire(self._user_key(user), self._ttl)
+        await pipe.execute()
+
+    async def _reap(self) -> None:
+        """Remove the sids of instances that stopped refreshing their marker."""
+        for instance_id in await self._redis.smembers(self._instances_key):
+            if instance_id == self._instance_id or await self._redis.exists(self._alive_key(instance_id)):
+                continue
+            sids = await self._redis.smembers(self._owned_key(instance_id))
+            for sid in sids:
+                await self.remove_sid(sid, instance_id)
+            await self._redis.delete(self._owned_key(instance_id))
+            await self._redis.srem(self._instances_key, instance_id)
+            if sids:
+                logger.info(f"[PRESENCE] Reaped {len(sids)} sid(s) of expired instance {instance_id}")
+
+    async def _heartbeat(self) -> None:
+        while True:
+            try:
+                await self._refresh()
+                await self._reap()
+            except Exception as e:
+                logger.error(f"[PRESENCE] Heartbeat failed: {e}")
+            await asyncio.sleep(self._ttl / 3)
+
+    async def start(self) -> None:
+        if self._heartbeat_task is None:
+            self._heartbeat_task = asyncio.create_task(self._heartbeat())
+
+    async def close(self) -> None:
+        """Release every sid this worker registered, then close the connection."""
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+            await asyncio.gather(self._heartbeat_task, return_exceptions=True)
+            self._heartbeat_task = None
+        for sid in await self._redis.smembers(self._instance_key):
+            await self.remove_sid(sid)
+        await self._redis.delete(self._instance_key, self._alive_key(self._instance_id))
+        await self._redis.srem(self._instances_key, self._instance_id)
+        await self._redis.aclose()
+
+
+def create_presence(url: str | None = None):
+    """Build the presence backend configured by ``url`` or the environment."""
+    if url is None:
+        url = os.getenv("PRESENCE_URL") or os.getenv("SOCKETIO_MESSAGE_QUEUE") or ""
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisPresence(url)
+    return PresenceRegistry()
+
+
+# Shared registry used by both the messaging handlers and the signaling
+# handlers in main.py
+presence = create_presence()
@@ -0,0 +1,61 @@
+"""
+Socket.IO client managers for running the backend on several workers.
+
+``create_client_manager()`` reads ``SOCKETIO_MESSAGE_QUEUE``:
+
+- unset / empty: ``None`` - the default single-process manager.
+- ``redis://...`` / ``rediss://...``: ``socketio.AsyncRedisManager``; every
+  worker subscribes to the same channel so emits to a room or sid reach
+  sockets held by any worker.
+- ``memory://``: ``LocalPubSubManager`` - same protocol over an in-process
+  bus, so tests can run several ``AsyncServer`` instances side by side and
+  exercise cross-server delivery without a Redis server.
+"""
+import asyncio
+import json
+import os
+
+import socketio
+from socketio.async_pubsub_manager import AsyncPubSubManager
+
+
+class LocalPubSubManager(AsyncPubSubManager):
+    """AsyncPubSubManager backed by an in-process broadcast bus.
+
+    Messages are JSON-encoded on publish, exactly like the Redis manager, so
+    anything that would fail to cross a real message queue fails here too.
+    """
+
+    name = "localpubsub"
+    _subscribers = {}
+
+    def __init__(self, channel: str = "socketio", write_only: bool = False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self._queue = asyncio.Queue()
+        if not write_only:
+            self._subscribers.setdefault(channel, set()).add(self._queue)
+
+    async def _publish(self, data):
+        payload = json.dumps(data)
+        for queue in list(self._subscribers.get(self.channel, ())):
+            queue.put_nowait(payload)
+
+    async def _listen(self):
+        while True:
+            yield await self._queue.get()
+
+    def unsubscribe(self) -> None:
+        self._subscribers.get(self.channel, set()).discard(self._queue)
+
+
+def create_client_manager(url: str | None = None, channel: str = "mbc-socketio"):
+    """Return the client manager configured by ``url`` or the environment."""
+    if url is None:
+        url = os.getenv("SOCKETIO_MESSAGE_QUEUE", "")
+    if not url:
+        return None
+    if url.startswith("memory://"):
+        return LocalPubSubManager(channel=channel)
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return socketio.AsyncRedisManager(url, channel=channel)
+    raise ValueError(f"Unsupported SOCKETIO_MESSAGE_QUEUE: {url}")
@@ -0,0 +1,42 @@
+"""
+Socket.IO room naming and membership helpers.
+
+Every identified socket joins ``user_<email>``; sockets of conversation
+participants also join ``conv_<conversation_id>``. Delivering to a room lets
+the server manager encode each event once and fan it out (across workers too,
+when a message queue is configured), instead of emitting once per sid.
+"""
+from repository import repo
+from messaging.presence import presence
+
+
+ADMIN_ROOM = "admin"
+
+
+def user_room(user: str) -> str:
+    return f"user_{user}"
+
+
+def conversation_room(conversation_id) -> str:
+    return f"conv_{conversation_id}"
+
+
+async def join_user_rooms(sio, sid: str, user_email: str, role: str | None = None) -> None:
+    """Join ``sid`` to its user room, role room and all its conversation rooms."""
+    await sio.enter_room(sid, user_room(user_email))
+    if role == "admin":
+        await sio.enter_room(sid, ADMIN_ROOM)
+
+    conversations = await repo.conversations.find(
+        {"participants": user_email}, {"_id": 1}
+    ).to_list(None)
+    for conv in conversations:
+        await sio.enter_room(sid, conversation_room(conv["_id"]))
+
+
+async def join_conversation_room(sio, conversation_id, participants: list) -> None:
+    """Join every open socket of ``participants`` to a (new) conversation room."""
+    room = conversation_room(conversation_id)
+    for participant in participants:
+        for sid in await presence.sids_for(participant):
+            await sio.enter_room(sid, room)
@@ -1,36 +1,129 @@
 """
 Messaging service - handles message creation, retrieval, and conversation management
 """
+import hashlib
+import logging
+import os
+import re
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from bson import ObjectId
-from database import messages_collection, conversations_collection, users_collection
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, WriteError
+from pagination import cursor_for, keyset_filter
+from repository import repo
+from user_cache import user_profiles
+from messaging.change_seq import change_seqs
+from messaging.ingest import MessageIngestQueue
+from messaging.write_behind import conversation_bumps
+
+logger = logging.getLogger("mbc")
+
+
+# Messages carry a BSON date in ``expires_at``; the TTL index registered in
+# indexes.py removes them once that moment passes.
+MESSAGE_RETENTION_DAYS = 90
+
+# How save_message keeps conversations current:
+#   transaction - message insert and conversation bump commit together
+#                 (needs a replica set)
+#   coalesce    - insert now, conversation bump written behind in batches
+#                 (see messaging/write_behind.py)
+#   auto        - transaction when the repository supports it, else coalesce
+# An explicit "transaction" on a backend without transactions falls back to
+# coalesce (with a warning) rather than failing every send.
+MESSAGE_WRITE_MODE = os.getenv("MESSAGE_WRITE_MODE", "auto")
+_write_mode_fallback_logged = False
+
+
+def isoformat_z(value):
+    """
+    Render a stored timestamp for API/socket payloads.
+    
+    Timestamps are stored as naive UTC datetimes; legacy documents that have
+    not been migrated yet still hold ISO strings and are passed through.
+    """
+    if isinstance(value, datetime):
+        return value.isoformat() + "Z"
+    return value
+
+
+# Change sequence numbers (``seq``) for delta sync come from
+# messaging/change_seq.py.
+SYNC_PAGE_SIZE = 500
+
+
+# Direct conversations are keyed by a hash of their sorted participants,
+# backed by a unique index, so concurrent first messages converge on one
+# document. Known pairs are remembered in-process to skip the round trip.
+DIRECT_CONVERSATION_CACHE_SIZE = 10000
+_direct_conversations = OrderedDict()
+_conversations_by_id = OrderedDict()
+
+
+def participants_key(participants: list) -> str:
+    """Canonical key for a set of participants (order-insensitive)."""
+    return hashlib.sha256("\n".join(sorted(participants)).encode("utf-8")).hexdigest()
+
+
+def _remember_conversation(key: str, conv: dict) -> None:
+    _direct_conversations[key] = _remember_by_id(conv)
+    _direct_conversations.move_to_end(key)
+    while len(_direct_conversations) > DIRECT_CONVERSATION_CACHE_SIZE:
+        _direct_conversations.popitem(last=False)
+
+
+def _remember_by_id(conv: dict) -> dict:
+    entry = {"_id": conv["_id"], "participants": conv["participants"], "type": conv.get("type")}
+    _conversations_by_id[conv["_id"]] = entry
+    _conversations_by_id.move_to_end(conv["_id"])
+    while len(_conversations_by_id) > DIRECT_CONVERSATION_CACHE_SIZE:
+        _conversations_by_id.popitem(last=False)
+    return entry
+
+
+async def get_conversation(conversation_id) -> dict | None:
+    """
+    ``_id``, ``participants`` and ``type`` of a conversation, or None.
+    
+    Membership never changes after creation, so lookups are cached in-process.
+    """
+    conv_oid = ObjectId(conversation_id)
+    cached = _conversations_by_id.get(conv_oid)
+    if cached is not None:
+        _conversations_by_id.move_to_end(conv_oid)
+        return cached
+    conv = await repo.conversations.find_one({"_id": conv_oid}, {"participants": 1, "type": 1})
+    return _remember_by_id(conv) if conv else None
 
 
 async def get_or_create_conversation(user1_email: str, user2_email: str) -> dict:
     """
     Get existing conversation between two users or create new one.
     
+    A single upsert on ``participants_key`` either returns the existing
+    conversation or creates it, so two simultaneous first messages can never
+    produce duplicates. Pairs already seen by this process are answered from
+    memory.
+    
     Args:
         user1_email: Email of first user
         user2_email: Email of second user
     
     Returns:
-        Conversation document
+        Conversation document (at least ``_id``, ``participants``, ``type``)
     """
     # Normalize: always order participants alphabetically for consistency
     participants = sorted([user1_email, user2_email])
+    key = participants_key(participants)
     
-    # Find existing conversation
-    existing = await conversations_collection.find_one({
-        "participants": participants
-    })
-    
-    if existing:
-        return existing
+    cached = _direct_conversations.get(key)
+    if cached is not None:
+        _direct_conversations.move_to_end(key)
+        return cached
     
     # Determine conversation type
-    user1 = await users_collection.find_one({"email": user1_email})
-    user2 = await users_collection.find_one({"email": user2_email})
+    user1, user2 = await user_profiles.get_many([user1_email, user2_email])
     
     if not user1 or not user2:
         raise ValueError("One or both users not found")
@@ -45,43 +138,89 @@ async def get_or_create_conversation(user1_email: str, user2_email: str) -> dict
     else:
         conv_type = "admin-doctor"
     
-    # Create new conversation
-    now = datetime.utcnow().isoformat() + "Z"
-    conv_doc = {
-        "participants": participants,
-        "type": conv_type,
-        "created_at": now,
-        "updated_at": now,
-        "last_message_at": None,
-    }
+    now = datetime.utcnow()
+    async with change_seqs.reserve() as seq:
+        upsert = {
+            "$setOnInsert": {
+                "participants": participants,
+                "type": conv_type,
+                "created_at": now,
+                "updated_at": now,
+                "last_message_at": None,
+                "seq": seq,
+            }
+        }
+        try:
+            conv = await repo.conversations.find_one_and_update(
+                {"participants_key": key}, upsert, upsert=True, return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # Lost an insert race the server did not retry itself; the winner exists now
+            conv = await repo.conversations.find_one({"participants_key": key})
+    
+    _remember_conversation(key, conv)
+    return conv
+
+
+async def resolve_recipient(sender_email: str, receiver_email: str | None, conversation_id: str | None) -> tuple:
+    """
+    Work out where a new message goes.
     
-    result = await conversations_collection.insert_one(conv_doc)
-    conv_doc["_id"] = result.inserted_id
+    With ``conversation_id`` the sender must be a participant; group
+    conversations have no single receiver. Without one, the direct
+    conversation with ``receiver_email`` is found or created.
     
-    return conv_doc
+    Returns:
+        (conversation, receiver_email or None for groups)
+    """
+    if not conversation_id:
+        if not receiver_email:
+            raise ValueError("receiver_email or conversation_id required")
+        return await get_or_create_conversation(sender_email, receiver_email), receiver_email
+    
+    conv = await get_conversation(conversation_id)
+    if conv is None or sender_email not in conv["participants"]:
+        raise ValueError("Conversation not found")
+    if conv.get("type") == "group":
+        return conv, None
+    if not receiver_email:
+        receiver_email = next((p for p in conv["participants"] if p != sender_email), None)
+    if receiver_email not in conv["participants"]:
+        raise ValueError("Receiver is not in this conversation")
+    return conv, receiver_email
 
 
 async def save_message(
     conversation_id: str,
     sender_email: str,
-    receiver_email: str,
+    receiver_email: str | None,
     content: str,
     attachments: list | None = None
 ) -> dict:
     """
     Save a message to database.
     
+    Group messages have no ``receiver_email``: they are stored once and the
+    recipients are the conversation's participants.
+    
+    The message goes through the group-commit ingestion queue and this
+    returns once its batch is stored. Depending on ``MESSAGE_WRITE_MODE`` the
+    conversation's ``last_message_at`` / ``updated_at`` are either updated in
+    the same transaction as the insert or bumped by the write-behind
+    coalescer within a short window. Raises ``IngestBusy`` when the queue is
+    full.
+    
     Args:
         conversation_id: ID of conversation
         sender_email: Email of sender
-        receiver_email: Email of receiver
+        receiver_email: Email of receiver (None for group conversations)
         content: Message content
     
     Returns:
         Saved message document
     """
     now = datetime.utcnow()
-    expires_at = now + timedelta(days=90)  # Auto-delete after 90 days
+    expires_at = now + timedelta(days=MESSAGE_RETENTION_DAYS)
     
     message_doc = {
         "conversation_id": ObjectId(conversation_id),
@@ -89,146 +228,693 @@ async def save_message(
         "receiver_email": receiver_email,
         "content": content,
         "attachments": attachments or [],
-        "timestamp": now.isoformat() + "Z",
+        "timestamp": now,
         "read": False,
         "read_at": None,
-        "expires_at": expires_at.isoformat() + "Z",  # TTL index will handle deletion
+        "expires_at": expires_at,  # TTL index handles deletion
     }
     
-    result = await messages_collection.insert_one(message_doc)
-    message_doc["_id"] = result.inserted_id
+    return await message_ingest.submit(message_doc)
+
+
+async def write_messages(message_docs: list) -> list:
+    """
+    Store a batch of new messages with one insert.
     
-    # Update conversation's last_message_at
-    await conversations_collection.update_one(
-        {"_id": ObjectId(conversation_id)},
-        {
-            "$set": {
-                "last_message_at": now.isoformat() + "Z",
-                "updated_at": now.isoformat() + "Z",
-            }
-        }
-    )
+    Used by the ingestion queue (messaging/ingest.py). In transaction mode the
+    batch commits atomically with its conversation bumps;
+    a document the insert rejects aborts the transaction, which is then
+    retried without it. Otherwise conversation bumps are written behind.
+    
+    Returns:
+        One entry per document: None if stored, else the exception that
+        prevented it (the rest of the batch is unaffected)
+    """
+    errors = [None] * len(message_docs)
+    
+    if _message_write_mode() == "transaction":
+        pending = list(range(len(message_docs)))
+        while pending:
+            batch = [message_docs[i] for i in pending]
+            
+            async def _txn(session):
+                await _insert_messages(batch, session=session)
+                await repo.conversations.bulk_write(
+                    [
+                        UpdateOne({"_id": conv_id}, {"$max": {"last_message_at": at, "updated_at": at}})
+                        for conv_id, at in _latest_by_conversation(_direct(batch)).items()
+                    ],
+                    ordered=False,
+                    session=session,
+                )
+            
+            try:
+                # The numbers stay in flight until the transaction has committed
+                async with change_seqs.reserve(len(batch)) as last:
+                    _stamp_seqs(batch, last)
+                    async with await repo.start_session() as session:
+                        await session.with_transaction(_txn)
+                break
+            except BulkWriteError as e:
+                rejected = {pending[err["index"]]: err for err in e.details.get("writeErrors", [])}
+                if not rejected:
+                    raise
+                for i, err in rejected.items():
+                    errors[i] = _write_error(err)
+                pending = [i for i in pending if i not in rejected]
+        return errors
+    
+    async with change_seqs.reserve(len(message_docs)) as last:
+        _stamp_seqs(message_docs, last)
+        errors = await _insert_messages(message_docs)
+    stored = [doc for doc, error in zip(message_docs, errors) if error is None]
+    for conv_id, at in _latest_by_conversation(_direct(stored)).items():
+        conversation_bumps.bump(conv_id, at)
+    return errors
+
+
+def _write_error(err: dict) -> WriteError:
+    return WriteError(err.get("errmsg", "insert failed"), err.get("code"), err)
+
+
+def _stamp_seqs(message_docs: list, last: int) -> None:
+    for i, doc in enumerate(message_docs):
+        # seq moves on every later change; pos keeps the insert order and
+        # is what read watermarks point at
+        doc["seq"] = doc["pos"] = last - len(message_docs) + 1 + i
+        doc.setdefault("_id", ObjectId())
+
+
+async def _insert_messages(message_docs: list, session=None) -> list:
+    """
+    Insert a batch stamped by ``_stamp_seqs``, then number the group
+    messages that were stored.
     
-    return message_doc
+    Numbering after the insert means a rejected document never takes a
+    group ``index``; a gap would otherwise count as unread for every member
+    until they read past it. Inside a transaction any write error is raised
+    (the transaction is aborted anyway).
+    
+    Returns:
+        One entry per document: None if stored, else its WriteError
+    """
+    errors = [None] * len(message_docs)
+    try:
+        await repo.messages.insert_many(message_docs, ordered=False, session=session)
+    except BulkWriteError as e:
+        if session is not None:
+            raise
+        # Unordered insert: everything without a write error was stored
+        for err in e.details.get("writeErrors", []):
+            errors[err["index"]] = _write_error(err)
+    stored = [doc for doc, error in zip(message_docs, errors) if error is None]
+    await _number_group_messages([d for d in stored if d.get("receiver_email") is None], session=session)
+    return errors
+
+
+def _direct(message_docs: list) -> list:
+    """Direct messages; group conversations are advanced by _number_group_messages."""
+    return [doc for doc in message_docs if doc.get("receiver_email") is not None]
+
+
+async def _number_group_messages(message_docs: list, session=None) -> None:
+    """
+    Give stored group messages consecutive per-conversation ``index`` values.
+    
+    One conditional write per conversation and batch moves ``last_index``,
+    ``last_message_at``/``updated_at`` and each sender's own read watermark,
+    whatever the group size: unread counts are ``last_index`` minus the
+    member's watermark index, so no per-member state is touched per message.
+    The indexes are then written to the messages in one bulk write.
+    """
+    by_conversation = {}
+    for doc in message_docs:
+        by_conversation.setdefault(doc["conversation_id"], []).append(doc)
+    
+    numbered = []
+    for conversation_id, docs in by_conversation.items():
+        latest = max(doc["timestamp"] for doc in docs)
+        while True:
+            conv = await repo.conversations.find_one({"_id": conversation_id}, {"last_index": 1}, session=session)
+            if conv is None:
+                logger.warning(f"[MESSAGING] Conversation {conversation_id} vanished; {len(docs)} message(s) left unnumbered")
+                break
+            current = conv.get("last_index", 0)
+            changes = {"last_index": current + len(docs)}
+            for i, doc in enumerate(docs, 1):
+                doc["index"] = current + i
+                # Sending implies having read the thread up to one's own message
+                changes[f"read_state.{member_key(doc['sender_email'])}"] = {
+                    "email": doc["sender_email"],
+                    "pos": doc["pos"],
+                    "index": doc["index"],
+                    "message_id": doc["_id"],
+                    "at": doc["timestamp"],
+                }
+            # Compare-and-set on last_index: concurrent batches retry
+            # instead of reusing indexes (the Data API has no atomic
+            # find-and-modify to reserve them with)
+            res = await repo.conversations.update_one(
+                {"_id": conversation_id, "last_index": current if "last_index" in conv else {"$exists": False}},
+                {"$set": changes, "$max": {"last_message_at": latest, "updated_at": latest}},
+                session=session,
+            )
+            if res.matched_count:
+                numbered.extend(docs)
+                break
+    
+    if numbered:
+        await repo.messages.bulk_write(
+            [UpdateOne({"_id": doc["_id"]}, {"$set": {"index": doc["index"]}}) for doc in numbered],
+            ordered=False,
+            session=session,
+        )
+
+
+def _latest_by_conversation(message_docs: list) -> dict:
+    latest = {}
+    for doc in message_docs:
+        conv_id = doc["conversation_id"]
+        if conv_id not in latest or doc["timestamp"] > latest[conv_id]:
+            latest[conv_id] = doc["timestamp"]
+    return latest
+
+
+message_ingest = MessageIngestQueue(write_messages)
 
 
 async def get_conversation_messages(
     conversation_id: str,
     limit: int = 30,
-    skip: int = 0
-) -> list:
+    before: str | None = None,
+    after: str | None = None,
+) -> dict:
     """
-    Get messages from a conversation with pagination.
+    Get one page of messages from a conversation using keyset pagination.
+    
+    Pages are seeked through the (conversation_id, timestamp, _id) index, so
+    latency stays flat however far back the client scrolls.
     
     Args:
         conversation_id: ID of conversation
         limit: Number of messages to return
-        skip: Number of messages to skip (for pagination)
+        before: Cursor - return messages older than this point
+        after: Cursor - return messages newer than this point
     
     Returns:
-        List of message documents
+        { "messages": [...oldest first], "next_cursor": cursor for older
+          messages or None, "prev_cursor": cursor for newer messages or None }
+    """
+    query = {"conversation_id": ObjectId(conversation_id)}
+    direction = 1 if after else -1
+    if after:
+        query.update(keyset_filter("timestamp", after, 1))
+    elif before:
+        query.update(keyset_filter("timestamp", before, -1))
+    
+    # Fetch one extra document to learn whether another page exists
+    page = await repo.messages.find(query).sort(
+        [("timestamp", direction), ("_id", direction)]
+    ).limit(limit + 1).to_list(None)
+    has_more = len(page) > limit
+    page = page[:limit]
+    
+    if direction < 0:
+        # Reverse to show chronological order (oldest first)
+        page.reverse()
+        has_older, has_newer = has_more, bool(before)
+    else:
+        has_older, has_newer = True, has_more
+    
+    conversation = await repo.conversations.find_one({"_id": query["conversation_id"]}, READ_STATE_PROJECTION)
+    apply_read_state(page, conversation)
+    
+    return {
+        "messages": page,
+        "next_cursor": cursor_for(page[0], "timestamp") if page and has_older else None,
+        "prev_cursor": cursor_for(page[-1], "timestamp") if page and has_newer else None,
+    }
+
+
+def member_key(email: str) -> str:
+    """Field-name-safe key for a participant in ``read_state`` (emails contain dots)."""
+    return hashlib.sha256(email.encode("utf-8")).hexdigest()[:16]
+
+
+def read_watermark(conversation: dict | None, email: str) -> dict | None:
+    """The participant's read watermark: ``{email, pos, message_id, at}`` or None."""
+    return ((conversation or {}).get("read_state") or {}).get(member_key(email or ""))
+
+
+READ_STATE_PROJECTION = {"read_state": 1, "participants": 1, "type": 1}
+
+
+def apply_read_state(messages: list, conversation: dict | None) -> list:
+    """
+    Set ``read``/``read_at`` on messages from their receiver's watermark.
+    
+    Messages stored before watermarks existed have no ``pos``; they keep
+    their own ``read`` flag until the receiver's first watermark covers them.
+    Group messages get ``read_by`` (members other than the sender whose
+    watermark covers them) and are ``read`` once every other member has.
     """
-    messages = await messages_collection.find(
-        {"conversation_id": ObjectId(conversation_id)}
-    ).sort("timestamp", -1).skip(skip).limit(limit).to_list(None)
+    conversation = conversation or {}
+    marks = list((conversation.get("read_state") or {}).values())
+    for msg in messages:
+        if msg.get("receiver_email") is None and conversation.get("type") == "group":
+            sender = msg.get("sender_email")
+            others = [email for email in conversation.get("participants", []) if email != sender]
+            msg["read_by"] = [
+                mark["email"] for mark in marks
+                if mark["email"] != sender and msg.get("index", 0) <= mark.get("index", 0)
+            ]
+            msg["read"] = bool(others) and len(msg["read_by"]) >= len(others)
+            continue
+        if msg.get("read"):
+            continue
+        mark = read_watermark(conversation, msg.get("receiver_email"))
+        if mark and msg.get("pos", 0) <= mark["pos"]:
+            msg["read"] = True
+            msg["read_at"] = mark.get("at")
+    return messages
+
+
+async def mark_conversation_read(conversation_id: str, reader_email: str, up_to: str | None = None) -> dict | None:
+    """
+    Move the reader's watermark in a conversation forward.
+    
+    Everything up to ``up_to`` (default: the latest message) becomes read
+    with a single conversation write, however many messages that covers.
+    The watermark never moves back, so repeated or out-of-order receipts are
+    no-ops. Unread counts are derived from the watermark itself (see
+    ``_direct_unread_counts``), so nothing else is written.
     
-    # Reverse to show chronological order (oldest first)
-    return list(reversed(messages))
+    Args:
+        conversation_id: ID of conversation
+        reader_email: Participant who read the messages
+        up_to: ID of the last message read
+    
+    Returns:
+        The new watermark (with ``conversation_id`` and ``seq``) to send as a
+        read receipt, or None if nothing new was read
+    """
+    conv_oid = ObjectId(conversation_id)
+    conversation = await get_conversation(conv_oid)
+    if conversation is None:
+        raise ValueError("Conversation not found")
+    # Group watermarks follow the per-conversation index, direct ones pos
+    is_group = conversation.get("type") == "group"
+    field = "index" if is_group else "pos"
+    
+    if up_to:
+        target = await repo.messages.find_one({"_id": ObjectId(up_to), "conversation_id": conv_oid}, {"pos": 1, "index": 1})
+        if not target:
+            raise ValueError("Message not found")
+    else:
+        latest = await repo.messages.find(
+            {"conversation_id": conv_oid}, {"pos": 1, "index": 1}
+        ).sort(field, -1).limit(1).to_list(None)
+        if not latest:
+            return None
+        target = latest[0]
+    
+    position = target.get(field, 0)
+    key = member_key(reader_email)
+    watermark = {"email": reader_email, "pos": target.get("pos", 0), "message_id": target["_id"], "at": datetime.utcnow()}
+    if is_group:
+        watermark["index"] = position
+    async with change_seqs.reserve() as seq:
+        res = await repo.conversations.update_one(
+            {
+                "_id": conv_oid,
+                "participants": reader_email,
+                "$or": [{f"read_state.{key}": {"$exists": False}}, {f"read_state.{key}.{field}": {"$lt": position}}],
+            },
+            {"$set": {f"read_state.{key}": watermark, "seq": seq}},
+        )
+    if not res.matched_count:
+        return None
+    return {**watermark, "conversation_id": conv_oid, "seq": seq}
 
 
-async def mark_message_as_read(message_id: str) -> dict:
+class ReaderRequired(ValueError):
+    """Raised when a group message is marked read without saying who read it."""
+
+
+async def mark_message_as_read(message_id: str, reader_email: str | None = None) -> tuple:
     """
-    Mark a message as read.
+    Mark a message, and everything before it, as read by its receiver.
     
     Args:
         message_id: ID of message
+        reader_email: Who read it; defaults to the receiver (required for
+            group messages, which have none)
     
     Returns:
-        Updated message document
+        (message document with ``read``/``read_at`` filled in, watermark from
+        ``mark_conversation_read`` or None if it was already read)
     """
-    now = datetime.utcnow().isoformat() + "Z"
+    message = await repo.messages.find_one({"_id": ObjectId(message_id)})
+    if not message:
+        raise ValueError("Message not found")
     
-    result = await messages_collection.update_one(
-        {"_id": ObjectId(message_id)},
-        {
-            "$set": {
-                "read": True,
-                "read_at": now,
-            }
-        }
-    )
+    watermark = None
+    reader_email = reader_email or message.get("receiver_email")
+    if not reader_email:
+        raise ReaderRequired("user_email required for group messages")
+    if reader_email != message.get("sender_email") and not message.get("read"):
+        watermark = await mark_conversation_read(str(message["conversation_id"]), reader_email, up_to=message_id)
+    conversation = await repo.conversations.find_one({"_id": message["conversation_id"]}, READ_STATE_PROJECTION)
+    apply_read_state([message], conversation)
+    return message, watermark
+
+
+def read_receipt_payload(watermark: dict) -> dict:
+    """``message_read_receipt`` body: everything up to ``message_id`` is read."""
+    return {
+        "conversation_id": str(watermark["conversation_id"]),
+        "reader_email": watermark["email"],
+        "message_id": str(watermark["message_id"]),
+        "read_at": isoformat_z(watermark["at"]),
+        "seq": watermark["seq"],
+    }
+
+
+def _message_write_mode() -> str:
+    global _write_mode_fallback_logged
+    if MESSAGE_WRITE_MODE == "auto":
+        return "transaction" if repo.supports_transactions else "coalesce"
+    if MESSAGE_WRITE_MODE == "transaction" and not repo.supports_transactions:
+        if not _write_mode_fallback_logged:
+            _write_mode_fallback_logged = True
+            logger.warning(
+                f"[MESSAGING] MESSAGE_WRITE_MODE=transaction but the {repo.backend} backend "
+                "has no transactions; using coalesce"
+            )
+        return "coalesce"
+    return MESSAGE_WRITE_MODE
+
+
+def _group_unread_expr(user_email: str) -> dict:
+    """Unread messages for ``user_email`` in a group: ``last_index`` past their watermark."""
+    return {
+        "$max": [
+            0,
+            {
+                "$subtract": [
+                    {"$ifNull": ["$last_index", 0]},
+                    {"$ifNull": [f"$read_state.{member_key(user_email)}.index", 0]},
+                ]
+            },
+        ]
+    }
+
+
+async def _direct_unread_counts(user_email: str, conversations: list) -> dict:
+    """
+    Unread messages for ``user_email`` per direct conversation, from their watermarks.
     
-    if result.matched_count == 0:
-        raise ValueError("Message not found")
+    One aggregation however many conversations: each ``$or`` branch is a
+    range on the (conversation_id, pos) index starting at the member's
+    watermark, so the cost follows the unread messages rather than the
+    history. Before a member has a watermark, messages still flagged unread
+    count.
     
-    # Get updated message
-    message = await messages_collection.find_one({"_id": ObjectId(message_id)})
-    return message
+    Returns:
+        { conversation_id: count } for conversations with unread messages
+    """
+    branches = []
+    for conv in conversations:
+        if conv.get("type") == "group":
+            continue
+        mark = read_watermark(conv, user_email)
+        if mark:
+            branches.append({"conversation_id": conv["_id"], "pos": {"$gt": mark["pos"]}})
+        else:
+            branches.append({"conversation_id": conv["_id"], "read": False})
+    if not branches:
+        return {}
+    rows = await repo.messages.aggregate([
+        {"$match": {"receiver_email": user_email, "$or": branches}},
+        {"$group": {"_id": "$conversation_id", "n": {"$sum": 1}}},
+    ]).to_list(None)
+    return {row["_id"]: row["n"] for row in rows}
+
+
+def _conversation_list_pipeline(user_email: str, preview_chars: int = 120) -> list:
+    """
+    Build the aggregation that lists a user's conversations together with
+    their group unread count and a preview of the last message.
+
+    Group unread counts come from the member's watermark and the preview
+    from ``messages``; the lookup is an equality join on ``conversation_id``
+    so it is served by an index. Direct unread counts are filled in by
+    ``get_user_conversations``.
+    """
+    return [
+        {"$match": {"participants": user_email}},
+        {"$sort": {"updated_at": -1}},
+        {
+            "$lookup": {
+                "from": "messages",
+                "localField": "_id",
+                "foreignField": "conversation_id",
+                "pipeline": [
+                    {"$sort": {"timestamp": -1}},
+                    {"$limit": 1},
+                    {
+                        "$project": {
+                            "_id": 1,
+                            "sender_email": 1,
+                            "timestamp": 1,
+                            "content": {"$substrCP": ["$content", 0, preview_chars]},
+                        }
+                    },
+                ],
+                "as": "_last",
+            }
+        },
+        {
+            "$addFields": {
+                "unread_count": {
+                    "$cond": [{"$eq": ["$type", "group"]}, _group_unread_expr(user_email), 0]
+                },
+                "last_message": {"$first": "$_last"},
+            }
+        },
+        {"$project": {"_last": 0}},
+    ]
 
 
 async def get_user_conversations(user_email: str) -> list:
     """
     Get all conversations for a user, sorted by most recent.
     
+    The last-message preview and group unread counts are resolved in one
+    aggregation and direct unread counts in a second one, so the whole list
+    costs two round trips regardless of how many conversations the user has.
+    
     Args:
         user_email: Email of user
     
     Returns:
-        List of conversation documents with unread counts
+        List of conversation documents with ``unread_count`` and
+        ``last_message`` (or None for empty conversations)
     """
-    conversations = await conversations_collection.find(
-        {"participants": user_email}
-    ).sort("updated_at", -1).to_list(None)
-    
-    # Count unread messages for each conversation
+    conversations = await repo.conversations.aggregate(
+        _conversation_list_pipeline(user_email)
+    ).to_list(None)
+    direct = await _direct_unread_counts(user_email, conversations)
     for conv in conversations:
-        unread = await messages_collection.count_documents({
-            "conversation_id": conv["_id"],
-            "receiver_email": user_email,
-            "read": False
-        })
-        conv["unread_count"] = unread
-    
+        if conv.get("type") != "group":
+            conv["unread_count"] = direct.get(conv["_id"], 0)
     return conversations
 
 
+async def sync_changes(user_email: str, since: int | None = None, limit: int = SYNC_PAGE_SIZE) -> dict:
+    """
+    Everything that changed in the user's conversations after ``since``.
+    
+    Messages come from one query on the (conversation_id, seq) index, in
+    ``seq`` order, so a reconnect costs what changed rather than what exists.
+    Edited and deleted (soft-deleted, content blanked) messages are returned
+    in their current state; read progress arrives as changed conversations
+    carrying their ``read_state`` watermarks. Without ``since`` nothing is returned
+    and the cursor is the current head, to start syncing from now.
+    
+    Only changes up to ``change_seqs.committed()`` are returned: a change
+    whose number was taken but whose write has not landed yet holds the
+    cursor back instead of being skipped.
+    
+    Returns:
+        { "messages": [...], "conversations": [...new or changed],
+          "cursor": pass back as ``since``, "has_more": another page waits }
+    """
+    committed = await change_seqs.committed()
+    if since is None:
+        return {"messages": [], "conversations": [], "cursor": committed, "has_more": False}
+    
+    conversations = await repo.conversations.find({"participants": user_email}).to_list(None)
+    messages = await repo.messages.find(
+        {"conversation_id": {"$in": [c["_id"] for c in conversations]}, "seq": {"$gt": since, "$lte": committed}}
+    ).sort("seq", 1).limit(limit + 1).to_list(None)
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    by_id = {c["_id"]: c for c in conversations}
+    for msg in messages:
+        apply_read_state([msg], by_id.get(msg["conversation_id"]))
+    
+    cursor = messages[-1]["seq"] if has_more else max(since, committed)
+    changed = [c for c in conversations if since < c.get("seq", 0) <= cursor]
+    return {"messages": messages, "conversations": changed, "cursor": cursor, "has_more": has_more}
+
+
+SEARCH_SNIPPET_CHARS = 160
+MAX_SEARCH_PAGE = 50
+
+
+def _search_terms(query: str) -> list:
+    """
+    Split a text-search query into the words worth highlighting.
+
+    Quoted phrases count as single terms and negated terms ("-word") are
+    dropped, mirroring how ``$text`` reads the query.
+    """
+    terms = [phrase for phrase in re.findall(r'"([^"]+)"', query)]
+    for word in re.sub(r'"[^"]*"', " ", query).split():
+        if not word.startswith("-"):
+            terms.append(word)
+    return [t.lower() for t in terms if t.strip()]
+
+
+def _term_pattern(term: str) -> str:
+    """
+    Regex for a term and its regular inflections (search matches on stems).
+
+    A suffix is only stripped when at least four letters of stem remain, and
+    only -s/-es/-ed/-ing are added back, so "notes" highlights "note" and
+    "notes" but not "not", "nothing" or "notify".
+    """
+    stem = re.sub(r"(?<=\w{4})(ing|ed|es|s)$", "", term)
+    return r"\b" + re.escape(stem) + r"(?:s|es|ed|ing)?\b"
+
+
+def build_snippet(content: str, query: str, width: int = SEARCH_SNIPPET_CHARS) -> dict:
+    """
+    Cut a window of ``content`` around the first matching term.
+
+    Returns:
+        { "snippet": str, "highlights": [[start, end], ...] } - highlight
+        offsets index into the snippet, so clients can mark matches without
+        rendering any HTML from the server
+    """
+    content = content or ""
+    terms = _search_terms(query)
+    if not terms:
+        return {"snippet": content[:width], "highlights": []}
+    pattern = re.compile("|".join(_term_pattern(t) for t in terms), re.IGNORECASE)
+
+    first = pattern.search(content)
+    start = 0
+    if first and len(content) > width:
+        start = max(0, min(first.start() - width // 4, len(content) - width))
+    end = min(len(content), start + width)
+    snippet = content[start:end]
+
+    prefix = "…" if start > 0 else ""
+    suffix = "…" if end < len(content) else ""
+    highlights = [
+        [m.start() + len(prefix), m.end() + len(prefix)]
+        for m in pattern.finditer(snippet)
+    ]
+    return {"snippet": prefix + snippet + suffix, "highlights": highlights}
+
+
 async def search_messages(
-    conversation_id: str,
-    query: str
-) -> list:
+    query: str,
+    user_email: str,
+    conversation_id: str | None = None,
+    limit: int = 20,
+    cursor: str | None = None,
+) -> dict:
     """
-    Search messages in a conversation.
+    Full-text search over messages the user can see, best matches first.
+    
+    Served by the ``content_text`` text index: only messages containing a
+    query term are scored, so cost follows the number of matches rather than
+    the size of the history. Pages are keyset-paginated on (score, _id).
     
     Args:
-        conversation_id: ID of conversation
-        query: Search query
+        query: Search words; "quoted phrases" and -exclusions are supported
+        user_email: Searching user; results are limited to their conversations
+        conversation_id: Restrict to one conversation (must be a participant)
+        limit: Page size
+        cursor: ``next_cursor`` from the previous page
     
     Returns:
-        List of matching messages
+        { "results": [message docs with ``score``, ``snippet``,
+          ``highlights``], "next_cursor": str | None }
     """
-    messages = await messages_collection.find(
-        {
-            "conversation_id": ObjectId(conversation_id),
-            "content": {"$regex": query, "$options": "i"}
-        }
-    ).sort("timestamp", -1).to_list(None)
-    
-    return messages
+    if conversation_id:
+        conv = await repo.conversations.find_one(
+            {"_id": ObjectId(conversation_id), "participants": user_email}, {"_id": 1}
+        )
+        if not conv:
+            raise ValueError("Conversation not found")
+        scope = conv["_id"]
+    else:
+        convs = await repo.conversations.find({"participants": user_email}, {"_id": 1}).to_list(None)
+        if not convs:
+            return {"results": [], "next_cursor": None}
+        scope = {"$in": [c["_id"] for c in convs]}
+    
+    limit = max(1, min(limit, MAX_SEARCH_PAGE))
+    pipeline = [
+        {"$match": {"$text": {"$search": query}, "conversation_id": scope, "deleted": {"$ne": True}}},
+        {"$addFields": {"score": {"$meta": "textScore"}}},
+    ]
+    if cursor:
+        pipeline.append({"$match": keyset_filter("score", cursor, -1)})
+    pipeline += [
+        {"$sort": {"score": -1, "_id": -1}},
+        {"$limit": limit + 1},
+        {"$project": {"expires_at": 0}},
+    ]
+    
+    results = await repo.messages.aggregate(pipeline).to_list(None)
+    has_more = len(results) > limit
+    results = results[:limit]
+    for msg in results:
+        msg.update(build_snippet(msg.get("content"), query))
+    
+    return {
+        "results": results,
+        "next_cursor": cursor_for(results[-1], "score") if has_more else None,
+    }
 
 
 async def get_unread_message_count(user_email: str) -> int:
     """
     Get total unread message count for a user.
     
+    Derived from the user's read watermarks: groups from ``last_index`` and
+    direct conversations from the messages past the watermark (see
+    ``_direct_unread_counts``), so it counts unread messages rather than
+    the whole history.
+    
     Args:
         user_email: Email of user
     
     Returns:
         Number of unread messages
     """
-    count = await messages_collection.count_documents({
-        "receiver_email": user_email,
-        "read": False
-    })
-    
-    return count
+    conversations = await repo.conversations.aggregate([
+        {"$match": {"participants": user_email}},
+        {"$project": {
+            "type": 1,
+            "read_state": 1,
+            "n": {"$cond": [{"$eq": ["$type", "group"]}, _group_unread_expr(user_email), 0]},
+        }},
+    ]).to_list(None)
+    direct = await _direct_unread_counts(user_email, conversations)
+    return sum(conv.get("n") or 0 for conv in conversations) + sum(direct.values())
@@ -0,0 +1,86 @@
+"""
+Write-behind coalescing of conversation activity bumps.
+
+Every saved message moves its conversation's ``last_message_at`` and
+``updated_at`` forward. Instead of one ``update_one`` per message, bumps are
+collected for ``CONVERSATION_BUMP_WINDOW_MS`` and flushed as one unordered
+bulk write with a single ``$max`` per conversation. A busy thread therefore
+costs one conversation write per window, and because ``$max`` only moves
+forward, a late or retried flush can never move a conversation back in time.
+
+Failed flushes are merged back into the pending set and retried on the next
+window; ``close()`` flushes whatever is left at shutdown.
+"""
+import asyncio
+import logging
+import os
+
+from pymongo import UpdateOne
+
+from repository import repo
+
+logger = logging.getLogger("mbc")
+
+CONVERSATION_BUMP_WINDOW_MS = int(os.getenv("CONVERSATION_BUMP_WINDOW_MS", "250"))
+
+
+class ConversationBumpCoalescer:
+    def __init__(self, window_ms: int = CONVERSATION_BUMP_WINDOW_MS):
+        self.window = window_ms / 1000
+        self._pending = {}  # conversation ObjectId -> latest activity datetime
+        self._task = None
+        self._closed = False
+        self.stats = {"bumps": 0, "flushes": 0, "writes": 0, "failures": 0}
+
+    def bump(self, conversation_id, at) -> None:
+        """Record activity at ``at``; written within one window."""
+        self.stats["bumps"] += 1
+        previous = self._pending.get(conversation_id)
+        if previous is None or at > previous:
+            self._pending[conversation_id] = at
+        if self._task is None and not self._closed:
+            self._task = asyncio.get_running_loop().create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        try:
+            await asyncio.sleep(self.window)
+            await self.flush()
+        finally:
+            self._task = None
+            if self._pending and not self._closed:
+                # Bumps that arrived while flushing (or a failed batch)
+                self._task = asyncio.get_running_loop().create_task(self._flush_later())
+
+    async def flush(self) -> int:
+        """Write all pending bumps now; returns the number of conversations written."""
+        if not self._pending:
+            return 0
+        pending, self._pending = self._pending, {}
+        ops = [
+            UpdateOne({"_id": conversation_id}, {"$max": {"last_message_at": at, "updated_at": at}})
+            for conversation_id, at in pending.items()
+        ]
+        try:
+            await repo.conversations.bulk_write(ops, ordered=False)
+        except Exception as e:
+            self.stats["failures"] += 1
+            logger.error(f"[WRITE-BEHIND] Conversation bump flush failed ({len(ops)} pending): {e}")
+            for conversation_id, at in pending.items():
+                previous = self._pending.get(conversation_id)
+                if previous is None or at > previous:
+                    self._pending[conversation_id] = at
+            return 0
+        self.stats["flushes"] += 1
+        self.stats["writes"] += len(ops)
+        return len(ops)
+
+    async def close(self) -> None:
+        self._closed = True
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+
+# Shared coalescer used by messaging.service.save_message
+conversation_bumps = ConversationBumpCoalescer()
@@ -0,0 +1,137 @@
+"""
+Keyset (cursor) pagination helpers.
+
+A cursor is an opaque, URL-safe token encoding the sort key of the last
+document a client has seen plus its ``_id`` as a tie-breaker. Filtering on
+``(sort_key, _id)`` past that point lets Mongo seek straight to the next page
+through a compound index, so page N costs the same as page 1 (unlike
+``skip``, which walks every skipped document).
+
+``paginate()`` is the shared list helper used by the REST list endpoints:
+filter, project, sort, page and optionally count in one place.
+"""
+import base64
+from datetime import datetime, timedelta, timezone
+
+from bson import json_util
+
+
+class InvalidCursor(ValueError):
+    """Raised when a client sends a cursor that cannot be decoded."""
+
+
+def encode_cursor(sort_value, doc_id) -> str:
+    raw = json_util.dumps([sort_value, doc_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """Return ``(sort_value, _id)`` from a cursor produced by ``encode_cursor``."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        sort_value, doc_id = json_util.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        return sort_value, doc_id
+    except Exception as e:
+        raise InvalidCursor("Invalid cursor") from e
+
+
+def keyset_filter(field: str, cursor: str, direction: int) -> dict:
+    """
+    Filter matching documents strictly after ``cursor`` when walking ``field``
+    in ``direction`` (1 ascending, -1 descending), ``_id`` breaking ties.
+    """
+    sort_value, doc_id = decode_cursor(cursor)
+    op = "$gt" if direction > 0 else "$lt"
+    return {
+        "$or": [
+            {field: {op: sort_value}},
+            {field: sort_value, "_id": {op: doc_id}},
+        ]
+    }
+
+
+def cursor_for(doc: dict, field: str) -> str:
+    return encode_cursor(doc.get(field), doc["_id"])
+
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+
+def date_range_filter(field: str, date_from: str | None, date_to: str | None, as_string: bool = False) -> dict:
+    """
+    Filter ``field`` to [date_from, date_to] given ISO date/datetime strings.
+
+    ``as_string`` compares against ISO strings, for collections that store
+    their timestamps as text (lexicographic order matches time order).
+    """
+    bounds = {}
+    for op, value in (("$gte", date_from), ("$lte", date_to)):
+        if not value:
+            continue
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+        if op == "$lte" and len(value) == 10:
+            # A bare date as upper bound means "through the end of that day"
+            parsed = parsed + timedelta(days=1) - timedelta(microseconds=1)
+        bounds[op] = parsed.isoformat() if as_string else parsed
+    return {field: bounds} if bounds else {}
+
+
+def status_filter(field: str, status: str | None, exclude_status: str | None) -> dict:
+    """Filter on comma-separated ``status`` values to include and/or exclude."""
+    cond = {}
+    if status:
+        cond["$in"] = [s.strip() for s in status.split(",") if s.strip()]
+    if exclude_status:
+        cond["$nin"] = [s.strip() for s in exclude_status.split(",") if s.strip()]
+    return {field: cond} if cond else {}
+
+
+async def paginate(
+    collection,
+    query: dict,
+    sort_field: str,
+    *,
+    projection: dict | None = None,
+    limit: int | None = DEFAULT_PAGE_SIZE,
+    cursor: str | None = None,
+    direction: int = -1,
+    include_total: bool = False,
+) -> dict:
+    """
+    Fetch one keyset page of ``collection`` sorted by ``(sort_field, _id)``.
+
+    ``limit=None`` without a ``cursor`` returns every match in one page, for
+    callers that predate paging; with a cursor it means the default size.
+
+    Returns:
+        { "items": [...], "next_cursor": str | None, "total": int | None }
+        ``total`` counts every document matching ``query`` and is only
+        computed when ``include_total`` is set.
+    """
+    if limit is None and not cursor:
+        docs = await collection.find(query, projection).sort(
+            [(sort_field, direction), ("_id", direction)]
+        ).to_list(None)
+        total = len(docs) if include_total else None
+        return {"items": docs, "next_cursor": None, "total": total}
+
+    limit = max(1, min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE))
+    page_query = query
+    if cursor:
+        page_query = {"$and": [query, keyset_filter(sort_field, cursor, direction)]} if query else keyset_filter(sort_field, cursor, direction)
+
+    docs = await collection.find(page_query, projection).sort(
+        [(sort_field, direction), ("_id", direction)]
+    ).limit(limit + 1).to_list(None)
+    has_more = len(docs) > limit
+    docs = docs[:limit]
+
+    total = await collection.count_documents(query) if include_total else None
+    return {
+        "items": docs,
+        "next_cursor": cursor_for(docs[-1], sort_field) if has_more else None,
+        "total": total,
+    }
@@ -0,0 +1,298 @@
+"""
+Repository layer - the single way the API and messaging code reach MongoDB.
+
+``repo`` exposes one attribute per collection (``repo.users``,
+``repo.messages``, ...). Each speaks the subset of the Motor collection API
+the backend uses: ``find_one``, ``find(...).sort().skip().limit().to_list()``,
+``insert_one``/``insert_many``, ``update_one``/``update_many``,
+``delete_one``/``delete_many``, ``count_documents``, ``aggregate``,
+``find_one_and_update`` and ``bulk_write`` of ``UpdateOne`` requests.
+
+Two implementations:
+
+- ``MotorRepository``: the Motor collections themselves, over pooled driver
+  connections. Supports multi-document transactions when the server is a
+  replica set or sharded cluster (checked by ``start()``).
+- ``DataAPIRepository``: the same calls translated to Atlas Data API actions
+  over HTTPS (see data_api.py), for serverless hosts that cannot keep driver
+  connections open. No transactions; ``find_one_and_update`` and
+  ``bulk_write`` are emulated with conditional per-document writes.
+
+``create_repository()`` picks the backend from ``DB_BACKEND`` (``motor`` or
+``data_api``), defaulting to the Data API when it is configured.
+"""
+import logging
+import os
+from dataclasses import dataclass, field
+
+import httpx
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+import data_api
+
+logger = logging.getLogger("mbc")
+
+# collection attribute -> (database, collection name)
+COLLECTIONS = {
+    "users": ("mbc", "users"),
+    "appointments": ("mbc", "appointments"),
+    "appointment_locks": ("mbc", "appointment_locks"),
+    "clients": ("mbc", "clients"),
+    "notes": ("mbc", "notes"),
+    "messages": ("mbc", "messages"),
+    "conversations": ("mbc", "conversations"),
+    "contacts": ("mbc", "contacts"),
+    "counters": ("mbc", "counters"),
+    "patients": ("mbc_patients", "patients"),
+}
+
+# The Data API's ``find`` returns at most 1000 documents unless told otherwise;
+# ``to_list(None)`` should mean "everything", as it does with Motor.
+DATA_API_FIND_LIMIT = 50000
+
+
+@dataclass
+class WriteResult:
+    """Duck-typed stand-in for pymongo's Insert/Update/Delete/BulkWrite results."""
+
+    inserted_id: object = None
+    inserted_ids: list = field(default_factory=list)
+    matched_count: int = 0
+    modified_count: int = 0
+    deleted_count: int = 0
+    upserted_id: object = None
+    acknowledged: bool = True
+
+
+class DataAPICursor:
+    """Lazy ``find`` cursor; the request is sent by ``to_list`` or iteration."""
+
+    def __init__(self, collection: "DataAPICollection", filter: dict | None, projection: dict | None):
+        self._collection = collection
+        self._filter = filter or {}
+        self._projection = projection
+        self._sort = None
+        self._skip = None
+        self._limit = None
+
+    def sort(self, key_or_list, direction: int | None = None) -> "DataAPICursor":
+        keys = [(key_or_list, direction or 1)] if isinstance(key_or_list, str) else key_or_list
+        self._sort = dict(keys)
+        return self
+
+    def skip(self, n: int) -> "DataAPICursor":
+        self._skip = n or None
+        return self
+
+    def limit(self, n: int) -> "DataAPICursor":
+        self._limit = n or None
+        return self
+
+    async def to_list(self, length: int | None = None) -> list:
+        limit = min(x for x in (self._limit, length, DATA_API_FIND_LIMIT) if x)
+        return await self._collection._call(
+            data_api.find, self._filter, projection=self._projection,
+            sort=self._sort, limit=limit, skip=self._skip,
+        )
+
+    async def __aiter__(self):
+        for doc in await self.to_list(None):
+            yield doc
+
+
+class DataAPIAggregation:
+    def __init__(self, collection: "DataAPICollection", pipeline: list):
+        self._collection = collection
+        self._pipeline = pipeline
+
+    async def to_list(self, length: int | None = None) -> list:
+        docs = await self._collection._call(data_api.aggregate, self._pipeline)
+        return docs[:length] if length else docs
+
+    async def __aiter__(self):
+        for doc in await self.to_list(None):
+            yield doc
+
+
+class DataAPICollection:
+    """Motor-compatible collection backed by Atlas Data API actions.
+
+    ``session`` arguments are accepted and ignored: the Data API has no
+    transactions. Inserts assign ``_id`` client-side, like the driver does,
+    so callers can rely on ``document["_id"]`` after ``insert_one``.
+    """
+
+    def __init__(self, database: str, name: str):
+        self.database = database
+        self.name = name
+
+    async def _call(self, action, *args, **kwargs):
+        try:
+            return await action(self.name, *args, database=self.database, **kwargs)
+        except httpx.HTTPStatusError as e:
+            if "duplicate key" in e.response.text.lower():
+                raise DuplicateKeyError(e.response.text) from e
+            raise
+
+    async def find_one(self, filter: dict | None = None, projection: dict | None = None, session=None, **kwargs):
+        return await self._call(data_api.find_one, filter or {}, projection=projection)
+
+    def find(self, filter: dict | None = None, projection: dict | None = None, session=None, **kwargs) -> DataAPICursor:
+        return DataAPICursor(self, filter, projection)
+
+    async def insert_one(self, document: dict, session=None, **kwargs) -> WriteResult:
+        document.setdefault("_id", ObjectId())
+        await self._call(data_api.insert_one, document)
+        return WriteResult(inserted_id=document["_id"])
+
+    async def insert_many(self, documents: list, ordered: bool = True, session=None, **kwargs) -> WriteResult:
+        for document in documents:
+            document.setdefault("_id", ObjectId())
+        await self._call(data_api.insert_many, documents)
+        return WriteResult(inserted_ids=[d["_id"] for d in documents])
+
+    async def update_one(self, filter: dict, update: dict, upsert: bool = False, session=None, **kwargs) -> WriteResult:
+        res = await self._call(data_api.update_one, filter, update, upsert=upsert)
+        return _update_result(res)
+
+    async def update_many(self, filter: dict, update: dict, upsert: bool = False, session=None, **kwargs) -> WriteResult:
+        res = await self._call(data_api.update_many, filter, update, upsert=upsert)
+        return _update_result(res)
+
+    async def delete_one(self, filter: dict, session=None, **kwargs) -> WriteResult:
+        res = await self._call(data_api.delete_one, filter)
+        return WriteResult(deleted_count=res.get("deletedCount", 0))
+
+    async def delete_many(self, filter: dict, session=None, **kwargs) -> WriteResult:
+        res = await self._call(data_api.delete_many, filter)
+        return WriteResult(deleted_count=res.get("deletedCount", 0))
+
+    async def count_documents(self, filter: dict, session=None, **kwargs) -> int:
+        rows = await self._call(data_api.aggregate, [{"$match": filter}, {"$count": "n"}])
+        return rows[0]["n"] if rows else 0
+
+    def aggregate(self, pipeline: list, session=None, **kwargs) -> DataAPIAggregation:
+        return DataAPIAggregation(self, pipeline)
+
+    async def find_one_and_update(
+        self,
+        filter: dict,
+        update: dict,
+        projection: dict | None = None,
+        return_document=ReturnDocument.BEFORE,
+        upsert: bool = False,
+        session=None,
+        **kwargs,
+    ):
+        """
+        Emulated as find, then an update conditioned on both the original
+        filter and the found ``_id``. If another writer changes the document
+        in between so it no longer matches, this returns None as though it
+        had never matched - the conditional write is never applied twice.
+        """
+        before = await self.find_one(filter)
+        if before is None:
+            if not upsert:
+                return None
+            res = await self.update_one(filter, update, upsert=True)
+            if return_document != ReturnDocument.AFTER:
+                return None
+            if res.upserted_id is not None:
+                return await self.find_one({"_id": res.upserted_id}, projection)
+            # A concurrent writer created the match first and our upsert updated it
+            return await self.find_one(filter, projection)
+
+        res = await self.update_one({"$and": [filter, {"_id": before["_id"]}]}, update)
+        if not res.matched_count:
+            return None
+        if return_document == ReturnDocument.AFTER:
+            return await self.find_one({"_id": before["_id"]}, projection)
+        return before
+
+    async def bulk_write(self, requests: list, ordered: bool = True, session=None, **kwargs) -> WriteResult:
+        """Apply ``UpdateOne`` requests one by one (the Data API has no bulk action)."""
+        total = WriteResult()
+        for op in requests:
+            res = await self.update_one(op._filter, op._doc, upsert=op._upsert)
+            total.matched_count += res.matched_count
+            total.modified_count += res.modified_count
+        return total
+
+
+def _update_result(res: dict) -> WriteResult:
+    return WriteResult(
+        matched_count=res.get("matchedCount", 0),
+        modified_count=res.get("modifiedCount", 0),
+        upserted_id=res.get("upsertedId"),
+    )
+
+
+class MotorRepository:
+    """Direct driver access: each attribute is the Motor collection itself."""
+
+    backend = "motor"
+    supports_transactions = True
+
+    def __init__(self):
+        # Imported here so Data API deployments never need MONGO_URI
+        import database
+
+        self.client = database.client
+        for attr, (db_name, name) in COLLECTIONS.items():
+            setattr(self, attr, self.client.get_database(db_name)[name])
+
+    def start_session(self):
+        return self.client.start_session()
+
+    async def start(self) -> None:
+        """Check whether the server can run transactions (a standalone mongod cannot)."""
+        try:
+            hello = await self.client.admin.command("hello")
+        except Exception as e:
+            logger.warning(f"[REPO] Could not check server topology, assuming transactions: {e}")
+            return
+        self.supports_transactions = bool(hello.get("setName")) or hello.get("msg") == "isdbgrid"
+        if not self.supports_transactions:
+            logger.info("[REPO] Standalone MongoDB server: transactions disabled")
+
+    async def close(self) -> None:
+        self.client.close()
+
+
+class DataAPIRepository:
+    """Every collection goes through the pooled Atlas Data API client."""
+
+    backend = "data_api"
+    supports_transactions = False
+
+    def __init__(self):
+        if not data_api.USE_DATA_API:
+            raise RuntimeError("DB_BACKEND=data_api needs ATLAS_DATA_API_URL and ATLAS_DATA_API_KEY")
+        for attr, (db_name, name) in COLLECTIONS.items():
+            setattr(self, attr, DataAPICollection(db_name, name))
+
+    def start_session(self):
+        raise NotImplementedError("The Atlas Data API does not support transactions")
+
+    async def start(self) -> None:
+        await data_api.start()
+
+    async def close(self) -> None:
+        await data_api.close()
+
+
+def create_repository(backend: str | None = None):
+    """Build the repository for ``backend`` or the ``DB_BACKEND`` setting."""
+    if backend is None:
+        backend = os.getenv("DB_BACKEND") or ("data_api" if data_api.USE_DATA_API else "motor")
+    if backend == "motor":
+        return MotorRepository()
+    if backend == "data_api":
+        return DataAPIRepository()
+    raise ValueError(f"Unsupported DB_BACKEND: {backend}")
+
+
+# Shared repository used by the API routes, messaging service and scheduling
+repo = create_repository()
@@ -0,0 +1,231 @@
+"""
+Appointment scheduling helpers - range-indexed conflict detection and
+atomic booking.
+
+Appointments keep the client-supplied ``datetime`` string for the API and
+also store ``start``/``end`` as naive UTC datetimes. Conflict checks are a
+single range query on ``(doctor, start, end)``; because every appointment is
+at most ``MAX_APPOINTMENT_MINUTES`` long, the ``start`` lower bound keeps the
+scan limited to the requested window instead of the doctor's whole history.
+"""
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import date, datetime, time, timedelta, timezone
+
+from pymongo.errors import DuplicateKeyError
+
+from repository import repo
+
+
+MAX_APPOINTMENT_MINUTES = 24 * 60
+MAX_FREE_SLOT_DAYS = 31
+BOOKING_LOCK_SECONDS = 10
+BOOKING_LOCK_ATTEMPTS = 20
+
+
+class AppointmentConflict(Exception):
+    """Raised when a requested slot overlaps an existing appointment."""
+
+    def __init__(self, existing: dict):
+        self.existing = existing
+        super().__init__("Time slot conflict")
+
+
+class BookingBusy(Exception):
+    """Raised when a doctor's booking lock could not be acquired in time."""
+
+    def __init__(self, doctor: str):
+        self.doctor = doctor
+        super().__init__(f"Calendar for {doctor} is busy, please retry")
+
+
+def parse_appointment_datetime(value: str) -> datetime:
+    """
+    Parse an ISO datetime string into a naive UTC datetime.
+
+    Naive inputs are taken as already being UTC, matching how they were
+    compared before ranges were stored.
+    """
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def appointment_range(value: str, duration: int) -> tuple:
+    """Return the (start, end) datetimes for an appointment string and duration."""
+    if duration <= 0 or duration > MAX_APPOINTMENT_MINUTES:
+        raise ValueError(f"duration must be between 1 and {MAX_APPOINTMENT_MINUTES} minutes")
+    start = parse_appointment_datetime(value)
+    return start, start + timedelta(minutes=duration)
+
+
+def overlap_query(doctor: str, start: datetime, end: datetime) -> dict:
+    """Mongo filter for non-cancelled appointments of ``doctor`` overlapping [start, end)."""
+    return {
+        "doctor": doctor,
+        "start": {"$lt": end, "$gt": start - timedelta(minutes=MAX_APPOINTMENT_MINUTES)},
+        "end": {"$gt": start},
+        "status": {"$ne": "cancelled"},
+    }
+
+
+async def find_conflict(doctor: str, start: datetime, end: datetime, session=None) -> dict | None:
+    """Return one appointment overlapping [start, end) for ``doctor``, or None."""
+    return await repo.appointments.find_one(
+        overlap_query(doctor, start, end),
+        {"datetime": 1, "start": 1, "end": 1, "duration": 1},
+        session=session,
+    )
+
+
+async def book_appointment(appointment_doc: dict) -> dict:
+    """
+    Insert ``appointment_doc`` if its [start, end) range is free.
+
+    With the driver, the overlap check and the insert run in one transaction
+    that also bumps a per-doctor lock document. Two concurrent bookings for
+    the same doctor therefore write-conflict, and the loser is retried by
+    ``with_transaction`` and sees the winner's appointment. Backends without
+    transactions serialize bookings through ``_doctor_mutex`` instead.
+    Raises ``AppointmentConflict`` (or ``BookingBusy`` if the mutex stays held).
+    """
+    doctor = appointment_doc["doctor"]
+
+    if not repo.supports_transactions:
+        async with _doctor_mutex(doctor):
+            existing = await find_conflict(doctor, appointment_doc["start"], appointment_doc["end"])
+            if existing:
+                raise AppointmentConflict(existing)
+            await repo.appointments.insert_one(appointment_doc)
+        return appointment_doc
+
+    async def _txn(session):
+        await repo.appointment_locks.update_one(
+            {"_id": doctor},
+            {"$inc": {"version": 1}},
+            upsert=True,
+            session=session,
+        )
+        existing = await find_conflict(doctor, appointment_doc["start"], appointment_doc["end"], session=session)
+        if existing:
+            raise AppointmentConflict(existing)
+        result = await repo.appointments.insert_one(appointment_doc, session=session)
+        appointment_doc["_id"] = result.inserted_id
+
+    async with await repo.start_session() as session:
+        await session.with_transaction(_txn)
+
+    return appointment_doc
+
+
+@asynccontextmanager
+async def _doctor_mutex(doctor: str):
+    """
+    Hold an exclusive per-doctor booking lock without transactions.
+
+    The lock is a document with a fixed ``_id``: inserting it succeeds for
+    exactly one caller and everyone else gets a duplicate key error and
+    retries. It carries an expiry so a worker that dies mid-booking cannot
+    block the doctor's calendar for longer than ``BOOKING_LOCK_SECONDS``.
+    """
+    lock_id = f"booking:{doctor}"
+    for attempt in range(BOOKING_LOCK_ATTEMPTS):
+        now = datetime.utcnow()
+        try:
+            await repo.appointment_locks.insert_one({
+                "_id": lock_id,
+                "expires_at": now + timedelta(seconds=BOOKING_LOCK_SECONDS),
+            })
+            break
+        except DuplicateKeyError:
+            # Clear a lock abandoned by a crashed worker, then try again
+            await repo.appointment_locks.delete_one({"_id": lock_id, "expires_at": {"$lt": now}})
+            await asyncio.sleep(0.05 * (attempt + 1))
+    else:
+        raise BookingBusy(doctor)
+
+    try:
+        yield
+    finally:
+        await repo.appointment_locks.delete_one({"_id": lock_id})
+
+
+def working_windows(start_day: date, end_day: date, work_start: time, work_end: time, include_weekends: bool = False) -> list:
+    """Return the [start, end) working windows for each day in the inclusive range."""
+    windows = []
+    day = start_day
+    while day <= end_day:
+        if include_weekends or day.weekday() < 5:
+            windows.append((datetime.combine(day, work_start), datetime.combine(day, work_end)))
+        day += timedelta(days=1)
+    return windows
+
+
+def sweep_free_slots(busy: list, windows: list, slot_minutes: int) -> list:
+    """
+    Return the free (start, end) slots of ``slot_minutes`` inside ``windows``.
+
+    ``busy`` and ``windows`` must both be sorted by start. Slots are aligned
+    to a grid anchored at each window start, so a slot interrupted by an
+    appointment resumes at the next grid point after it. The sweep is a
+    single merge pass: O(len(busy) + len(windows) + slots).
+    """
+    slot = timedelta(minutes=slot_minutes)
+    slots = []
+    i = 0
+    for window_start, window_end in windows:
+        # Skip appointments that ended before this window
+        while i < len(busy) and busy[i][1] <= window_start:
+            i += 1
+
+        cursor = window_start
+        j = i
+        while cursor + slot <= window_end:
+            # Advance past appointments ending at or before the cursor
+            while j < len(busy) and busy[j][1] <= cursor:
+                j += 1
+            if j < len(busy) and busy[j][0] < cursor + slot:
+                # Overlaps the next appointment: jump to the first grid point after it
+                steps = -(-(busy[j][1] - window_start) // slot)
+                cursor = window_start + steps * slot
+                continue
+            slots.append((cursor, cursor + slot))
+            cursor += slot
+    return slots
+
+
+async def find_free_slots(
+    doctors: list,
+    start_day: date,
+    end_day: date,
+    slot_minutes: int,
+    work_start: time,
+    work_end: time,
+    include_weekends: bool = False,
+) -> dict:
+    """
+    Compute free slots for several doctors over a date range.
+
+    All appointments are fetched with one range query sorted by
+    ``(doctor, start)`` and then swept per doctor in memory.
+    """
+    windows = working_windows(start_day, end_day, work_start, work_end, include_weekends)
+    if not windows:
+        return {doctor: [] for doctor in doctors}
+
+    range_start, range_end = windows[0][0], windows[-1][1]
+    query = overlap_query(doctors[0], range_start, range_end)
+    query["doctor"] = {"$in": doctors}
+    appointments = await repo.appointments.find(
+        query, {"doctor": 1, "start": 1, "end": 1}
+    ).sort([("doctor", 1), ("start", 1)]).to_list(None)
+
+    busy_by_doctor = {doctor: [] for doctor in doctors}
+    for appt in appointments:
+        busy_by_doctor[appt["doctor"]].append((appt["start"], appt["end"]))
+
+    return {
+        doctor: sweep_free_slots(busy, windows, slot_minutes)
+        for doctor, busy in busy_by_doctor.items()
+    }
@@ -93,7 +93,7 @@ class UserProfile(BaseModel):
 
 class MessageCreate(BaseModel):
     sender_email: str  # Email of the person sending (from localStorage)
-    receiver_email: str
+    receiver_email: str | None = None  # Omit for group conversations
     content: str
     conversation_id: str | None = None  # If None, create new conversation
     attachments: list[dict] | None = None
@@ -119,6 +119,7 @@ class ConversationResponse(BaseModel):
     updated_at: str
     last_message_at: str | None = None
     unread_count: int = 0
+    last_message: dict | None = None
 
 
 class ConversationDetailResponse(BaseModel):
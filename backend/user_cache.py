@@ -0,0 +1,109 @@
+"""
+Async LRU + TTL cache of user profiles.
+
+Socket joins and conversation creation only need a user's role and name, so
+they read through this cache instead of querying ``users`` every time.
+Concurrent misses for the same email share one in-flight query
+(single-flight), which keeps a reconnect storm after a deploy down to one
+lookup per user rather than one per socket.
+
+Entries expire after ``USER_CACHE_TTL_SECONDS`` (unknown users after
+``USER_CACHE_NEGATIVE_TTL_SECONDS``); ``invalidate()`` drops one immediately
+and is called wherever this process creates or changes a user. Passwords
+are never cached.
+"""
+import asyncio
+import os
+import time
+from collections import OrderedDict
+
+from repository import repo
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "5000"))
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "300"))
+USER_CACHE_NEGATIVE_TTL_SECONDS = float(os.getenv("USER_CACHE_NEGATIVE_TTL_SECONDS", "5"))
+
+PROFILE_PROJECTION = {"password": 0}
+
+
+class UserProfileCache:
+    def __init__(self, maxsize: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL_SECONDS,
+                 negative_ttl: float = USER_CACHE_NEGATIVE_TTL_SECONDS):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries = OrderedDict()  # email -> (expires_at, profile | None)
+        self._inflight = {}  # email -> Future shared by concurrent misses
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "evictions": 0, "invalidations": 0}
+
+    async def get(self, email: str) -> dict | None:
+        """Return the profile for ``email`` (None if no such user)."""
+        entry = self._entries.get(email)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._entries.move_to_end(email)
+                self.stats["hits"] += 1
+                return entry[1]
+            del self._entries[email]
+
+        pending = self._inflight.get(email)
+        if pending is not None:
+            self.stats["coalesced"] += 1
+            return await asyncio.shield(pending)
+
+        self.stats["misses"] += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[email] = future
+        try:
+            profile = await repo.users.find_one({"email": email}, PROFILE_PROJECTION)
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # waiters re-raise it; don't warn when there are none
+            raise
+        finally:
+            if self._inflight.get(email) is future:
+                del self._inflight[email]
+                stale = False
+            else:
+                # Invalidated while loading: hand the result to current
+                # waiters but don't cache what may already be outdated
+                stale = True
+
+        if not stale:
+            self._store(email, profile)
+        future.set_result(profile)
+        return profile
+
+    async def get_many(self, emails: list) -> list:
+        return list(await asyncio.gather(*(self.get(email) for email in emails)))
+
+    def _store(self, email: str, profile: dict | None) -> None:
+        ttl = self.ttl if profile is not None else self.negative_ttl
+        self._entries[email] = (time.monotonic() + ttl, profile)
+        self._entries.move_to_end(email)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def invalidate(self, email: str) -> None:
+        """Forget ``email`` after the user was created or changed."""
+        self._entries.pop(email, None)
+        self._inflight.pop(email, None)
+        self.stats["invalidations"] += 1
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._inflight.clear()
+
+    def snapshot(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["misses"] + self.stats["coalesced"]
+        return {
+            **self.stats,
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hit_ratio": round((self.stats["hits"] + self.stats["coalesced"]) / lookups, 4) if lookups else None,
+        }
+
+
+# Shared cache used by the socket handlers and the messaging service
+user_profiles = UserProfileCache()
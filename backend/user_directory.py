@@ -0,0 +1,195 @@
+"""
+In-memory user directory for search autocomplete.
+
+Holds ``email``, ``full_name`` and ``role`` for every user, with a sorted
+token index so a prefix lookup is a binary search plus a short scan instead
+of a regex over the users collection. Tokens are the full email, the full
+name, and their word parts (so "smith", "gmail" and "dr.jo" all match).
+
+The directory is loaded at startup and updated in place on register. Other
+workers' registrations arrive through a periodic reload, and a query that
+finds nothing locally falls back to an anchored Mongo lookup whose results
+are added to the directory.
+"""
+import asyncio
+import bisect
+import logging
+import os
+import re
+import time
+
+from repository import repo
+
+logger = logging.getLogger("mbc")
+
+USER_DIRECTORY_REFRESH_SECONDS = int(os.getenv("USER_DIRECTORY_REFRESH_SECONDS", "300"))
+# How long a query that found nobody in Mongo either is answered from memory
+NEGATIVE_CACHE_SECONDS = 30
+
+_TOKEN_SPLIT = re.compile(r"[\s@._+\-]+")
+
+
+def _entry(user: dict) -> dict:
+    email = user.get("email") or ""
+    return {
+        "email": email,
+        "full_name": user.get("full_name") or email.split("@")[0],
+        "role": user.get("role"),
+    }
+
+
+def _tokens(entry: dict) -> set:
+    email = entry["email"].lower()
+    name = (entry["full_name"] or "").lower()
+    tokens = {email, name}
+    tokens.update(_TOKEN_SPLIT.split(email))
+    tokens.update(_TOKEN_SPLIT.split(name))
+    tokens.discard("")
+    return tokens
+
+
+def _rank(entry: dict, q: str) -> tuple:
+    """Lower sorts first: exact email, email prefix, name prefix, then word matches."""
+    email = entry["email"].lower()
+    name = (entry["full_name"] or "").lower()
+    if email == q:
+        tier = 0
+    elif email.startswith(q):
+        tier = 1
+    elif name.startswith(q):
+        tier = 2
+    else:
+        tier = 3
+    return (tier, len(name), name, email)
+
+
+class UserDirectory:
+    """Prefix-searchable snapshot of the users collection."""
+
+    def __init__(self):
+        self._entries = {}
+        self._index = []  # sorted (token, email) pairs
+        self._loaded_at = None
+        self._refresh_task = None
+        self._not_found = {}  # query -> monotonic expiry
+        self.stats = {"hits": 0, "misses": 0, "fallback_found": 0}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded_at is not None
+
+    async def load(self) -> None:
+        """(Re)build the directory from the users collection."""
+        users = await repo.users.find({}, {"email": 1, "full_name": 1, "role": 1}).to_list(None)
+        entries = {}
+        index = []
+        for user in users:
+            entry = _entry(user)
+            if not entry["email"]:
+                continue
+            entries[entry["email"]] = entry
+            index.extend((token, entry["email"]) for token in _tokens(entry))
+        index.sort()
+        self._entries, self._index = entries, index
+        self._not_found.clear()
+        self._loaded_at = time.time()
+        logger.info(f"[DIRECTORY] Loaded {len(entries)} user(s)")
+
+    def add(self, user: dict) -> None:
+        """Insert or replace one user (call after register or profile changes)."""
+        entry = _entry(user)
+        if not entry["email"]:
+            return
+        self.remove(entry["email"])
+        self._not_found.clear()
+        self._entries[entry["email"]] = entry
+        for token in _tokens(entry):
+            bisect.insort(self._index, (token, entry["email"]))
+
+    def remove(self, email: str) -> None:
+        entry = self._entries.pop(email, None)
+        if entry is None:
+            return
+        for token in _tokens(entry):
+            i = bisect.bisect_left(self._index, (token, email))
+            if i < len(self._index) and self._index[i] == (token, email):
+                del self._index[i]
+
+    def lookup(self, q: str, limit: int = 10) -> list:
+        """Return up to ``limit`` entries with a token starting with ``q``, best first."""
+        q = q.strip().lower()
+        if not q:
+            return []
+        matched = set()
+        i = bisect.bisect_left(self._index, (q,))
+        while i < len(self._index) and self._index[i][0].startswith(q):
+            matched.add(self._index[i][1])
+            i += 1
+        entries = [self._entries[email] for email in matched]
+        entries.sort(key=lambda e: _rank(e, q))
+        return entries[:limit]
+
+    async def search(self, q: str, limit: int = 10) -> list:
+        """
+        Prefix search served from memory. Mongo is only consulted when the
+        directory has nothing for ``q`` (not loaded yet, or a user that was
+        registered on another worker since the last reload).
+        """
+        results = self.lookup(q, limit) if self.loaded else []
+        if results:
+            self.stats["hits"] += 1
+            return results
+
+        key = q.strip().lower()
+        now = time.monotonic()
+        if self._not_found.get(key, 0) > now:
+            self.stats["hits"] += 1
+            return []
+
+        self.stats["misses"] += 1
+        pattern = "^" + re.escape(q.strip())
+        users = await repo.users.find(
+            {"$or": [
+                {"email": {"$regex": pattern, "$options": "i"}},
+                {"full_name": {"$regex": pattern, "$options": "i"}},
+            ]},
+            {"email": 1, "full_name": 1, "role": 1},
+        ).limit(limit).to_list(None)
+        for user in users:
+            self.add(user)
+        self.stats["fallback_found"] += len(users)
+        if not users:
+            if len(self._not_found) > 1000:
+                self._not_found.clear()
+            self._not_found[key] = now + NEGATIVE_CACHE_SECONDS
+        return self.lookup(q, limit) if users else []
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            await asyncio.sleep(USER_DIRECTORY_REFRESH_SECONDS)
+            try:
+                await self.load()
+            except Exception as e:
+                logger.warning(f"[DIRECTORY] Reload failed, keeping previous snapshot: {e}")
+
+    async def start(self) -> None:
+        """Load the directory and schedule periodic reloads."""
+        try:
+            await self.load()
+        except Exception as e:
+            # Search still works through the Mongo fallback until a reload succeeds
+            logger.error(f"[DIRECTORY] Initial load failed: {e}")
+        if self._refresh_task is None and USER_DIRECTORY_REFRESH_SECONDS > 0:
+            self._refresh_task = asyncio.create_task(self._refresh_loop())
+
+    async def close(self) -> None:
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+
+
+# Shared directory used by user search and kept current by register
+user_directory = UserDirectory()
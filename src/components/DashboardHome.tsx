@@ -334,10 +334,9 @@ export function DashboardHome({ onNavigate }: DashboardHomeProps) {
       
       try {
         // Fetch all clients
-        const clientRes = await fetch(apiUrl('/api/clients'));
+        const clientRes = await fetch(apiUrl('/api/clients?limit=1&include_total=true'));
         if (clientRes.ok) {
-          const clients = await clientRes.json();
-          setTotalClients(clients.length);
+          setTotalClients(Number(clientRes.headers.get('X-Total-Count') || 0));
         }
 
         // Fetch all appointments
@@ -384,7 +383,7 @@ export function DashboardHome({ onNavigate }: DashboardHomeProps) {
         }
 
         // Fetch all notes
-        const notesRes = await fetch(apiUrl('/api/notes'));
+        const notesRes = await fetch(apiUrl('/api/notes?completed=false'));
         if (notesRes.ok) {
           const notes = await notesRes.json();
           
@@ -45,8 +45,8 @@ export function NewPatientRegistrations() {
       
       // Fetch ONLY from contacts and patients (Strict separation from Auth/Users)
       const [contactsRes, patientsRes] = await Promise.all([
-        fetch(apiUrl('/api/contacts')).catch(() => null),
-        fetch(apiUrl('/api/patients')).catch(() => null),
+        fetch(apiUrl('/api/contacts?exclude_status=converted_to_patient,rejected')).catch(() => null),
+        fetch(apiUrl('/api/patients?exclude_status=converted_to_patient,rejected')).catch(() => null),
       ]);
 
       const allRegistrations: Registration[] = [];
@@ -13,6 +13,8 @@ export function useMessages(userEmail: string | null) {
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState<string | null>(null);
   const [typingUsers, setTypingUsers] = useState<Record<string, boolean>>({});
+  // Cursor for the next page of older history (null once it is exhausted)
+  const [olderCursor, setOlderCursor] = useState<string | null>(null);
 
   // Load conversations
   const loadConversations = useCallback(async () => {
@@ -35,20 +37,22 @@ export function useMessages(userEmail: string | null) {
     }
   }, [userEmail]);
 
-  // Load messages for a conversation
+  // Load messages for a conversation. Pass `before` (see olderCursor) to
+  // prepend the next page of older history.
   const loadMessages = useCallback(
-    async (conversationId: string, limit: number = 30, skip: number = 0) => {
+    async (conversationId: string, limit: number = 30, before: string | null = null) => {
       setLoading(true);
       setError(null);
 
       try {
-        const msgs = await messagingApi.getMessages(conversationId, limit, skip);
-        if (skip === 0) {
-          setMessages(msgs);
+        const page = await messagingApi.getMessages(conversationId, limit, before);
+        if (!before) {
+          setMessages(page.messages);
         } else {
           // Prepend older messages when loading more
-          setMessages((prev: Message[]) => [...msgs, ...prev]);
+          setMessages((prev: Message[]) => [...page.messages, ...prev]);
         }
+        setOlderCursor(page.next_cursor);
       } catch (err) {
         setError(err instanceof Error ? err.message : "Failed to load messages");
       } finally {
@@ -157,8 +161,8 @@ export function useMessages(userEmail: string | null) {
 
     const startPolling = async (conversationId: string) => {
       try {
-        const msgs = await messagingApi.getMessages(conversationId, 30, 0);
-        if (!cancelled) setMessages(msgs);
+        const page = await messagingApi.getMessages(conversationId, 30);
+        if (!cancelled) setMessages(page.messages);
       } catch (err) {
         // ignore polling errors
       }
@@ -189,6 +193,7 @@ export function useMessages(userEmail: string | null) {
     typingUsers,
     loadConversations,
     loadMessages,
+    olderCursor,
     handleMessageReceived,
     handleMessageSent,
     handleMessageEdited,
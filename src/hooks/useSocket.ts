@@ -44,7 +44,11 @@ export function useSocket(
     // If socket already exists, reuse it
     if (!socketRef.current) {
       const socket = io(apiUrl(""), {
-        transports: ["websocket", "polling"],
+        // WebSocket only: with several backend workers (WEB_CONCURRENCY > 1)
+        // long-polling requests would land on workers that don't own the
+        // session unless the load balancer pins them, so there is no polling
+        // fallback.
+        transports: ["websocket"],
         reconnection: true,
         reconnectionDelay: 1000,
         reconnectionDelayMax: 5000,
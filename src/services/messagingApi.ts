@@ -2,7 +2,7 @@
  * REST API calls for messaging
  */
 import { apiUrl } from "../config";
-import { Message, Conversation, User } from "../types/messaging";
+import { Message, MessagePage, Conversation, User } from "../types/messaging";
 
 export const messagingApi = {
   /**
@@ -17,17 +17,17 @@ export const messagingApi = {
   },
 
   /**
-   * Get messages from a conversation
+   * Get a page of messages from a conversation (keyset pagination)
    */
   getMessages: async (
     conversationId: string,
     limit: number = 30,
-    skip: number = 0
-  ): Promise<Message[]> => {
+    before?: string | null
+  ): Promise<MessagePage> => {
+    const params = new URLSearchParams({ limit: String(limit) });
+    if (before) params.set("before", before);
     const response = await fetch(
-      apiUrl(
-        `/api/conversations/${conversationId}/messages?limit=${limit}&skip=${skip}`
-      )
+      apiUrl(`/api/conversations/${conversationId}/messages?${params.toString()}`)
     );
     if (!response.ok) throw new Error("Failed to fetch messages");
     return response.json();
@@ -14,6 +14,14 @@ export interface Message {
   attachments?: Array<{ filename: string; url: string; mime?: string; size?: number }>;
 }
 
+export interface MessagePage {
+  messages: Message[];
+  // pass as `before` to load older messages; null when at the start of history
+  next_cursor: string | null;
+  // pass as `after` to load newer messages; null when already at the latest
+  prev_cursor: string | null;
+}
+
 export interface Conversation {
   id: string;
   participants: string[];
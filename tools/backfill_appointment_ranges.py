@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""One-off migration: add start/end datetimes to existing appointments.
+
+Conflict detection now queries the indexed ``start``/``end`` fields, so
+appointments created before that change are invisible to it until this has
+been run. Safe to re-run; only appointments missing ``start`` are touched.
+
+Usage (from repo root):
+
+python tools/backfill_appointment_ranges.py [--batch-size 500] [--dry-run]
+"""
+import argparse
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend')))
+
+from pymongo import UpdateOne  # noqa: E402
+
+from database import appointments_collection  # noqa: E402
+from scheduling import MAX_APPOINTMENT_MINUTES, appointment_range  # noqa: E402
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Backfill appointment start/end ranges")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    updated = skipped = 0
+    last_id = None
+    while True:
+        query = {"start": {"$exists": False}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        batch = await appointments_collection.find(query, {"datetime": 1, "duration": 1}).sort("_id", 1).limit(args.batch_size).to_list(None)
+        if not batch:
+            break
+        last_id = batch[-1]["_id"]
+
+        ops = []
+        for appt in batch:
+            try:
+                duration = min(int(appt.get("duration", 60)), MAX_APPOINTMENT_MINUTES)
+                start, end = appointment_range(appt["datetime"], duration)
+            except Exception as e:
+                print(f"  skip {appt['_id']}: {e}")
+                skipped += 1
+                continue
+            ops.append(UpdateOne({"_id": appt["_id"]}, {"$set": {"start": start, "end": end}}))
+
+        if ops and not args.dry_run:
+            await appointments_collection.bulk_write(ops, ordered=False)
+        updated += len(ops)
+
+    print(f"Done: {updated} appointment(s) {'would be ' if args.dry_run else ''}updated, {skipped} skipped")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,86 @@
+"""Benchmark the conversation list: per-conversation count loop vs aggregations.
+
+Runs both strategies against the configured MongoDB (MONGO_URI) for one user
+and prints per-iteration latency. Use an account with many conversations to
+see the difference.
+
+Usage (from repo root):
+
+python tools/bench_conversation_list.py --user doctor1@gmail.com --iterations 20
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend')))
+
+from database import conversations_collection, messages_collection  # noqa: E402
+from messaging.service import get_user_conversations, read_watermark  # noqa: E402
+
+
+async def legacy_loop(user_email: str) -> list:
+    """
+    The previous strategy: one count_documents per conversation.
+
+    Counts against the read watermarks like the service does (messages past
+    the member's watermark, or still flagged unread before they have one),
+    so both strategies must report the same unread counts.
+    """
+    conversations = await conversations_collection.find(
+        {"participants": user_email}
+    ).sort("updated_at", -1).to_list(None)
+    for conv in conversations:
+        mark = read_watermark(conv, user_email)
+        if conv.get("type") == "group":
+            unread = {"index": {"$gt": (mark or {}).get("index", 0)}}
+        elif mark:
+            unread = {"receiver_email": user_email, "pos": {"$gt": mark["pos"]}}
+        else:
+            unread = {"receiver_email": user_email, "read": False}
+        conv["unread_count"] = await messages_collection.count_documents({"conversation_id": conv["_id"], **unread})
+    return conversations
+
+
+async def timed(fn, user_email: str, iterations: int) -> tuple:
+    samples = []
+    result = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        result = await fn(user_email)
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples, result
+
+
+def report(name: str, samples: list) -> None:
+    samples = sorted(samples)
+    p95 = samples[max(0, int(len(samples) * 0.95) - 1)]
+    print(f"{name:<12} median={statistics.median(samples):8.2f}ms  p95={p95:8.2f}ms  min={samples[0]:8.2f}ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--user", default=os.environ.get("SIM_SENDER", "doctor1@gmail.com"))
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    # warm up connection pool
+    await conversations_collection.find_one({})
+
+    loop_samples, loop_result = await timed(legacy_loop, args.user, args.iterations)
+    agg_samples, agg_result = await timed(get_user_conversations, args.user, args.iterations)
+
+    print(f"user={args.user} conversations={len(agg_result)} iterations={args.iterations}")
+    report("loop", loop_samples)
+    report("aggregate", agg_samples)
+
+    loop_counts = {str(c["_id"]): c["unread_count"] for c in loop_result}
+    agg_counts = {str(c["_id"]): c["unread_count"] for c in agg_result}
+    if loop_counts != agg_counts:
+        print("WARNING: unread counts differ between strategies")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,113 @@
+"""Benchmark Data API mode: client per call vs the pooled keep-alive client.
+
+Spawns tools/fake_data_api.py (unless --url points at a running Data API),
+seeds a user, then times login-style findOne calls sequentially and
+concurrently with a fresh ``httpx.AsyncClient`` per call (the old behaviour)
+and with backend/data_api.py's shared client.
+
+Usage (from repo root):
+
+python tools/bench_data_api.py --latency-ms 20 --handshake-ms 60 --calls 50
+python tools/bench_data_api.py --url https://data.mongodb-api.com/app/<app-id>/endpoint/data/v1 --key <api-key>
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+
+def spawn_fake_server(port: int, latency_ms: float, handshake_ms: float) -> subprocess.Popen:
+    proc = subprocess.Popen([
+        sys.executable, os.path.join(os.path.dirname(__file__), "fake_data_api.py"),
+        "--port", str(port), "--latency-ms", str(latency_ms), "--handshake-ms", str(handshake_ms),
+    ])
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/docs", timeout=0.5)
+            return proc
+        except httpx.TransportError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("fake Data API did not start")
+
+
+async def per_call_find_one(data_api, collection: str, filter: dict):
+    """The previous implementation: a new client (and connection) per request."""
+    async with httpx.AsyncClient(timeout=15.0) as client:
+        r = await client.post(
+            f"{data_api.ATLAS_DATA_API_URL}/action/findOne",
+            json={"dataSource": data_api.ATLAS_DATA_SOURCE, "database": data_api.ATLAS_DATABASE,
+                  "collection": collection, "filter": filter},
+            headers={"Content-Type": "application/json", "api-key": data_api.ATLAS_DATA_API_KEY},
+        )
+        r.raise_for_status()
+        return r.json().get("document")
+
+
+async def timed(fn, calls: int, concurrency: int) -> list:
+    samples = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            await fn()
+            samples.append((time.perf_counter() - start) * 1000)
+
+    await asyncio.gather(*(one() for _ in range(calls)))
+    return samples
+
+
+def report(name: str, samples: list) -> None:
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    print(f"{name:>22}: p50 {statistics.median(samples):8.1f} ms  p95 {p95:8.1f} ms  max {ordered[-1]:8.1f} ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark pooled vs per-call Data API clients")
+    parser.add_argument("--url", help="Data API base URL (default: spawn the local fake)")
+    parser.add_argument("--key", default="fake")
+    parser.add_argument("--port", type=int, default=8790)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--handshake-ms", type=float, default=60)
+    parser.add_argument("--calls", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10])
+    args = parser.parse_args()
+
+    proc = None
+    url = args.url
+    if not url:
+        proc = spawn_fake_server(args.port, args.latency_ms, args.handshake_ms)
+        url = f"http://127.0.0.1:{args.port}"
+
+    os.environ["ATLAS_DATA_API_URL"] = url
+    os.environ["ATLAS_DATA_API_KEY"] = args.key
+    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend')))
+    import data_api
+
+    try:
+        await data_api.start()
+        if proc:
+            await data_api.insert_one("users", {"email": "bench@example.com", "role": "doctor"})
+        query = {"email": "bench@example.com"}
+
+        for concurrency in args.concurrency:
+            print(f"{args.calls} findOne calls, concurrency {concurrency}")
+            report("client per call", await timed(lambda: per_call_find_one(data_api, "users", query), args.calls, concurrency))
+            report("pooled keep-alive", await timed(lambda: data_api.find_one("users", query), args.calls, concurrency))
+    finally:
+        await data_api.close()
+        if proc:
+            proc.terminate()
+            proc.wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,81 @@
+"""Benchmark Socket.IO emit cost: per-sid loop vs a single room emit.
+
+Runs entirely in-process: fake sessions are registered with the server
+manager and the engine.io transport is replaced by a no-op, so the numbers
+isolate packet encoding and fan-out overhead from the network.
+
+Usage (from repo root):
+
+python tools/bench_emit.py --tabs 1 2 4 --participants 2 10 50
+"""
+import argparse
+import asyncio
+import time
+
+import socketio
+
+
+PAYLOAD = {
+    "id": "6560f1e2c4b5a1d2e3f40001",
+    "conversation_id": "6560f1e2c4b5a1d2e3f40000",
+    "sender_email": "doctor1@gmail.com",
+    "receiver_email": "admin@mbctherapy.com",
+    "content": "Session notes attached, please review before the 3pm meeting." * 4,
+    "timestamp": "2025-01-01T12:00:00Z",
+    "read": False,
+}
+
+
+async def build_server(participants: int, tabs: int):
+    sio = socketio.AsyncServer(async_mode="asgi")
+    sent = {"packets": 0}
+
+    async def _send_eio_packet(eio_sid, pkt):
+        pkt.encode()
+        sent["packets"] += 1
+
+    sio._send_eio_packet = _send_eio_packet
+
+    sids = []
+    for p in range(participants):
+        for t in range(tabs):
+            sid = await sio.manager.connect(f"eio-{p}-{t}", "/")
+            await sio.enter_room(sid, "conv_bench")
+            sids.append(sid)
+    return sio, sids, sent
+
+
+async def per_sid_loop(sio, sids):
+    for sid in sids:
+        await sio.emit("receive_message", PAYLOAD, to=sid)
+
+
+async def room_emit(sio, sids):
+    await sio.emit("receive_message", PAYLOAD, room="conv_bench")
+
+
+async def measure(fn, sio, sids, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await fn(sio, sids)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-sid vs room emits")
+    parser.add_argument("--tabs", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--participants", type=int, nargs="+", default=[2, 10, 50])
+    parser.add_argument("--iterations", type=int, default=500)
+    args = parser.parse_args()
+
+    print(f"{'participants':>12} {'tabs':>5} {'sockets':>8} {'loop us':>10} {'room us':>10} {'speedup':>8}")
+    for participants in args.participants:
+        for tabs in args.tabs:
+            sio, sids, _ = await build_server(participants, tabs)
+            loop_us = await measure(per_sid_loop, sio, sids, args.iterations)
+            room_us = await measure(room_emit, sio, sids, args.iterations)
+            print(f"{participants:>12} {tabs:>5} {len(sids):>8} {loop_us:>10.1f} {room_us:>10.1f} {loop_us / room_us:>7.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,107 @@
+"""Load-test: does a burst of logins delay message delivery?
+
+Runs in-process. A Socket.IO server with two connected fake sessions relays a
+"message" every ``--interval`` ms while a burst of concurrent password
+verifications runs, first inline on the event loop (the old login path) and
+then through the off-loop hashing pool. Reports per-message delivery latency
+for each mode plus the pool's queue-time metrics.
+
+Usage (from repo root):
+
+python tools/bench_login_burst.py --logins 32 --interval 5
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+import socketio
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend')))
+
+from auth import hash_password, hash_pool_stats, verify_password, verify_password_async  # noqa: E402
+
+
+PASSWORD = "correct horse battery staple"
+
+
+async def build_server():
+    sio = socketio.AsyncServer(async_mode="asgi")
+    delivered = asyncio.Queue()
+
+    async def _send_eio_packet(eio_sid, pkt):
+        pkt.encode()
+        if eio_sid == "eio-receiver":
+            delivered.put_nowait(time.perf_counter())
+
+    sio._send_eio_packet = _send_eio_packet
+    receiver = await sio.manager.connect("eio-receiver", "/")
+    await sio.enter_room(receiver, "user_receiver")
+    return sio, delivered
+
+
+async def relay_messages(sio, delivered, interval: float, stop: asyncio.Event) -> list:
+    """Emit one message per ``interval`` and record send -> delivery latency (ms)."""
+    latencies = []
+    while not stop.is_set():
+        sent = time.perf_counter()
+        await sio.emit("receive_message", {"content": "ping"}, room="user_receiver")
+        done = await delivered.get()
+        latencies.append((done - sent) * 1000)
+        # Measure how late the next tick fires too: a blocked loop shows up here
+        tick = time.perf_counter()
+        await asyncio.sleep(interval)
+        latencies[-1] += max(0.0, (time.perf_counter() - tick - interval) * 1000)
+    return latencies
+
+
+async def inline_login(hashed: str) -> bool:
+    return verify_password(PASSWORD, hashed)
+
+
+async def pooled_login(hashed: str) -> bool:
+    return await verify_password_async(PASSWORD, hashed)
+
+
+async def run_burst(login, hashed: str, logins: int, interval: float) -> tuple:
+    sio, delivered = await build_server()
+    stop = asyncio.Event()
+    relay = asyncio.create_task(relay_messages(sio, delivered, interval, stop))
+    await asyncio.sleep(interval * 5)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(login(hashed) for _ in range(logins)))
+    burst_s = time.perf_counter() - start
+
+    stop.set()
+    latencies = await relay
+    return latencies, burst_s
+
+
+def summarize(name: str, latencies: list, burst_s: float) -> None:
+    ordered = sorted(latencies)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    print(
+        f"{name:>8}: burst {burst_s * 1000:8.1f} ms | messages {len(latencies):4d} | "
+        f"latency p50 {statistics.median(latencies):7.2f} ms  p95 {p95:7.2f} ms  max {ordered[-1]:7.2f} ms"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Message latency during a login burst")
+    parser.add_argument("--logins", type=int, default=32, help="concurrent logins in the burst")
+    parser.add_argument("--interval", type=float, default=5, help="ms between relayed messages")
+    args = parser.parse_args()
+
+    hashed = hash_password(PASSWORD)
+    interval = args.interval / 1000
+
+    summarize("inline", *await run_burst(inline_login, hashed, args.logins, interval))
+    summarize("pooled", *await run_burst(pooled_login, hashed, args.logins, interval))
+    print("pool:", hash_pool_stats())
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
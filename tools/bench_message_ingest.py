@@ -0,0 +1,119 @@
+"""Measure message ingestion throughput and latency against the batch window.
+
+Sends ``--messages`` messages through messaging.service.save_message with
+``--concurrency`` senders in flight, once per ``--windows`` value. Window 0
+is the unbatched baseline (one insert per message). Each row reports
+messages/second, per-message confirm latency and the average batch size.
+
+Uses the Data API repository against a spawned tools/fake_data_api.py
+(with ``--latency-ms`` per round trip) unless ``--backend motor`` is given,
+in which case MONGO_URI must point at a dev database.
+
+Usage (from repo root):
+
+python tools/bench_message_ingest.py
+python tools/bench_message_ingest.py --windows 0 2 5 10 20 --concurrency 200 --latency-ms 10
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend')))
+
+from bench_data_api import spawn_fake_server  # noqa: E402
+
+SENDER = "bench-sender@example.com"
+RECEIVER = "bench-receiver@example.com"
+
+
+async def run_window(window_ms: float, messages: int, concurrency: int) -> dict:
+    from messaging import service
+    from messaging.ingest import MessageIngestQueue
+    from messaging.write_behind import conversation_bumps
+
+    queue = MessageIngestQueue(service.write_messages, window_ms=window_ms)
+    service.message_ingest = queue
+    await queue.start()
+
+    conv = await service.get_or_create_conversation(SENDER, RECEIVER)
+    conv_id = str(conv["_id"])
+    semaphore = asyncio.Semaphore(concurrency)
+    samples = []
+
+    async def send(i: int):
+        async with semaphore:
+            start = time.perf_counter()
+            await service.save_message(conv_id, SENDER, RECEIVER, f"bench message {i}")
+            samples.append((time.perf_counter() - start) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(send(i) for i in range(messages)))
+    elapsed = time.perf_counter() - started
+    await queue.close()
+    await conversation_bumps.flush()
+
+    stats = queue.snapshot()
+    ordered = sorted(samples)
+    return {
+        "throughput": messages / elapsed,
+        "p50": statistics.median(samples),
+        "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        "batch": stats["avg_batch_size"] or 1.0,
+        "batches": stats["batches"] or messages,
+    }
+
+
+async def run(args) -> list:
+    from messaging.change_seq import change_seqs
+    from repository import repo
+
+    await repo.start()
+    try:
+        for email, role in ((SENDER, "admin"), (RECEIVER, "doctor")):
+            if not await repo.users.find_one({"email": email}):
+                await repo.users.insert_one({"email": email, "role": role, "full_name": email.split("@")[0]})
+        # Warm up connections before the first measured run
+        await run_window(0, min(20, args.messages), args.concurrency)
+        return [(w, await run_window(w, args.messages, args.concurrency)) for w in args.windows]
+    finally:
+        await change_seqs.close()
+        await repo.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark group-commit message ingestion")
+    parser.add_argument("--backend", default="data_api", choices=["motor", "data_api"])
+    parser.add_argument("--windows", type=float, nargs="+", default=[0, 2, 5, 10, 20], help="batch windows in ms")
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--port", type=int, default=8791)
+    parser.add_argument("--latency-ms", type=float, default=10, help="fake Data API round trip")
+    args = parser.parse_args()
+
+    proc = None
+    if args.backend == "data_api" and not os.getenv("ATLAS_DATA_API_URL"):
+        proc = spawn_fake_server(args.port, args.latency_ms, 0)
+        os.environ["ATLAS_DATA_API_URL"] = f"http://127.0.0.1:{args.port}"
+        os.environ["ATLAS_DATA_API_KEY"] = "fake"
+    os.environ["DB_BACKEND"] = args.backend
+
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait()
+
+    print(f"{args.messages} messages, {args.concurrency} concurrent senders")
+    print(f"{'window':>8} {'msg/s':>9} {'p50':>10} {'p95':>10} {'avg batch':>10} {'batches':>8}")
+    for window, r in results:
+        print(f"{window:>5.0f} ms {r['throughput']:>9.0f} {r['p50']:>7.1f} ms {r['p95']:>7.1f} ms "
+              f"{r['batch']:>10.1f} {r['batches']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Compare request latency of the Motor and Data API repository backends.
+
+Runs the same messaging-service code paths (login lookup, send message,
+conversation list, message page, unread count) against each backend by
+pointing the service at one repository at a time. The Motor backend needs
+MONGO_URI; the Data API backend uses ATLAS_DATA_API_URL/KEY or, when those
+are unset, a spawned tools/fake_data_api.py.
+
+Writes go to throwaway bench users, so point MONGO_URI at a dev database.
+
+Usage (from repo root):
+
+python tools/bench_repository.py --iterations 30
+python tools/bench_repository.py --backends data_api --latency-ms 20 --handshake-ms 60
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(__file__))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend')))
+
+from bench_data_api import spawn_fake_server  # noqa: E402
+
+SENDER = "bench-sender@example.com"
+RECEIVER = "bench-receiver@example.com"
+
+
+async def seed(repo) -> None:
+    for email, role in ((SENDER, "admin"), (RECEIVER, "doctor")):
+        if not await repo.users.find_one({"email": email}):
+            await repo.users.insert_one({"email": email, "role": role, "full_name": email.split("@")[0]})
+
+
+async def run_backend(name: str, iterations: int) -> dict:
+    import repository
+    from messaging import service
+
+    repo = repository.create_repository(name)
+    service.repo = repo
+    await repo.start()
+    try:
+        await seed(repo)
+        conv = await service.get_or_create_conversation(SENDER, RECEIVER)
+        conv_id = str(conv["_id"])
+
+        operations = {
+            "login lookup": lambda: repo.users.find_one({"email": SENDER}),
+            "send message": lambda: service.save_message(conv_id, SENDER, RECEIVER, "benchmark message"),
+            "conversation list": lambda: service.get_user_conversations(RECEIVER),
+            "message page": lambda: service.get_conversation_messages(conv_id, limit=30),
+            "unread count": lambda: service.get_unread_message_count(RECEIVER),
+        }
+        results = {}
+        for label, op in operations.items():
+            await op()  # warm up connections and caches
+            samples = []
+            for _ in range(iterations):
+                start = time.perf_counter()
+                await op()
+                samples.append((time.perf_counter() - start) * 1000)
+            results[label] = samples
+        return results
+    finally:
+        await repo.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Motor vs Data API repositories")
+    parser.add_argument("--backends", nargs="+", default=["motor", "data_api"], choices=["motor", "data_api"])
+    parser.add_argument("--iterations", type=int, default=30)
+    parser.add_argument("--port", type=int, default=8790)
+    parser.add_argument("--latency-ms", type=float, default=20, help="fake Data API round trip")
+    parser.add_argument("--handshake-ms", type=float, default=60, help="fake Data API connection setup")
+    args = parser.parse_args()
+
+    backends = list(args.backends)
+    if "motor" in backends and not os.getenv("MONGO_URI"):
+        print("MONGO_URI not set; skipping the motor backend")
+        backends.remove("motor")
+
+    proc = None
+    if "data_api" in backends and not os.getenv("ATLAS_DATA_API_URL"):
+        proc = spawn_fake_server(args.port, args.latency_ms, args.handshake_ms)
+        os.environ["ATLAS_DATA_API_URL"] = f"http://127.0.0.1:{args.port}"
+        os.environ["ATLAS_DATA_API_KEY"] = "fake"
+    # The module-level repository is built on import; make it a backend we can construct
+    os.environ.setdefault("DB_BACKEND", backends[0] if backends else "data_api")
+
+    try:
+        results = {name: asyncio.run(run_backend(name, args.iterations)) for name in backends}
+    finally:
+        if proc:
+            proc.terminate()
+            proc.wait()
+
+    header = f"{'operation':>18}" + "".join(f" {name + ' p50':>14} {name + ' p95':>14}" for name in results)
+    print(header)
+    for label in next(iter(results.values()), {}):
+        row = f"{label:>18}"
+        for samples in (r[label] for r in results.values()):
+            ordered = sorted(samples)
+            p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+            row += f" {statistics.median(samples):>11.1f} ms {p95:>11.1f} ms"
+        print(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""Calibrate password hash costs for this host and write them to config.
+
+Benchmarks argon2 (time cost x memory cost) and bcrypt rounds with the same
+passlib handlers auth.py uses, then picks the strongest parameters whose
+median hash time stays within ``--target-ms``. Costs never go below the
+floors (argon2 t=2, 19 MiB; bcrypt 10 rounds) even if the host is slow.
+
+The result is written to PASSWORD_HASH_CONFIG (default
+backend/password_hash.json). auth.py treats those costs as minimums, so after
+a restart existing hashes are upgraded one by one as users log in.
+
+Usage (from repo root):
+
+python tools/calibrate_password_hash.py --target-ms 250 --dry-run
+python tools/calibrate_password_hash.py --target-ms 250 --max-memory-mib 128
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+
+from passlib.hash import argon2, bcrypt
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend')))
+
+from auth import PASSWORD_HASH_CONFIG, load_hash_params  # noqa: E402
+
+
+SAMPLE_PASSWORD = "calibration-password-1234"
+ARGON2_MIN_TIME_COST = 2
+ARGON2_MIN_MEMORY_KIB = 19 * 1024
+BCRYPT_MIN_ROUNDS = 10
+
+
+def time_hash(handler, samples: int) -> float:
+    """Median milliseconds for one ``handler.hash`` call."""
+    timings = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        handler.hash(SAMPLE_PASSWORD)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def calibrate_argon2(target_ms: float, max_memory_kib: int, parallelism: int, samples: int) -> dict:
+    memory_steps = []
+    memory = ARGON2_MIN_MEMORY_KIB
+    while memory <= max_memory_kib:
+        memory_steps.append(memory)
+        memory *= 2
+
+    best = None
+    for memory_cost in memory_steps:
+        time_cost = ARGON2_MIN_TIME_COST
+        while True:
+            handler = argon2.using(rounds=time_cost, memory_cost=memory_cost, parallelism=parallelism)
+            ms = time_hash(handler, samples)
+            print(f"  argon2 m={memory_cost // 1024:>4} MiB t={time_cost:>2} p={parallelism}: {ms:8.1f} ms")
+            if ms > target_ms:
+                break
+            strength = memory_cost * time_cost
+            if best is None or strength > best["strength"]:
+                best = {"time_cost": time_cost, "memory_cost": memory_cost, "ms": ms, "strength": strength}
+            time_cost += 1
+        if time_cost == ARGON2_MIN_TIME_COST:
+            # Even the minimum time cost is too slow at this memory; more memory won't help
+            break
+
+    if best is None:
+        print("  warning: argon2 floor exceeds the target; using the floor")
+        best = {"time_cost": ARGON2_MIN_TIME_COST, "memory_cost": ARGON2_MIN_MEMORY_KIB, "ms": None}
+    return {"time_cost": best["time_cost"], "memory_cost": best["memory_cost"], "parallelism": parallelism, "ms": best["ms"]}
+
+
+def calibrate_bcrypt(target_ms: float, samples: int) -> dict:
+    chosen = {"rounds": BCRYPT_MIN_ROUNDS, "ms": None}
+    rounds = BCRYPT_MIN_ROUNDS
+    while rounds <= 16:
+        ms = time_hash(bcrypt.using(rounds=rounds), samples)
+        print(f"  bcrypt rounds={rounds:>2}: {ms:8.1f} ms")
+        if ms > target_ms:
+            break
+        chosen = {"rounds": rounds, "ms": ms}
+        rounds += 1
+    if chosen["ms"] is None:
+        print("  warning: bcrypt floor exceeds the target; using the floor")
+    return chosen
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate argon2/bcrypt costs to a target latency")
+    parser.add_argument("--target-ms", type=float, default=250, help="max median time per hash")
+    parser.add_argument("--max-memory-mib", type=int, default=128, help="argon2 memory cap per hash")
+    parser.add_argument("--parallelism", type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument("--samples", type=int, default=3, help="hashes timed per candidate")
+    parser.add_argument("--output", default=PASSWORD_HASH_CONFIG)
+    parser.add_argument("--dry-run", action="store_true", help="print the result without writing it")
+    args = parser.parse_args()
+
+    current = load_hash_params(args.output)
+    print(f"Current: {json.dumps(current)}")
+
+    print("Calibrating argon2...")
+    argon = calibrate_argon2(args.target_ms, args.max_memory_mib * 1024, args.parallelism, args.samples)
+    print("Calibrating bcrypt...")
+    bc = calibrate_bcrypt(args.target_ms, args.samples)
+
+    config = {
+        "argon2": {k: argon[k] for k in ("time_cost", "memory_cost", "parallelism")},
+        "bcrypt": {"rounds": bc["rounds"]},
+        "target_ms": args.target_ms,
+        "measured_ms": {"argon2": argon["ms"], "bcrypt": bc["ms"]},
+        "host": platform.node(),
+        "cpu_count": os.cpu_count(),
+        "calibrated_at": datetime.now(timezone.utc).isoformat(),
+    }
+    print(json.dumps(config, indent=2))
+
+    if args.dry_run:
+        print("Dry run: config not written")
+        return
+    with open(args.output, "w") as f:
+        json.dump(config, f, indent=2)
+        f.write("\n")
+    print(f"Wrote {args.output}; restart the backend to apply. Hashes are upgraded on next login.")
+
+
+if __name__ == "__main__":
+    main()
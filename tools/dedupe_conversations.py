@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""One-off migration: merge duplicate direct conversations and key them.
+
+Before conversations were upserted on ``participants_key``, two simultaneous
+first messages could each create a conversation for the same pair. This
+merges every such set into its oldest conversation: messages are re-pointed
+to it, its ``updated_at``/``last_message_at`` take the latest values and the
+duplicates are deleted (unread counts then follow from the keeper's read
+watermarks). Every direct conversation then gets its ``participants_key``
+and the unique index is created.
+
+Run it before (or right after) deploying the upsert-based
+get_or_create_conversation; conversations without a key are invisible to it.
+Safe to re-run.
+
+Usage (from repo root):
+
+python tools/dedupe_conversations.py --dry-run
+python tools/dedupe_conversations.py
+"""
+import argparse
+import asyncio
+import os
+import sys
+from datetime import datetime
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend')))
+
+from database import conversations_collection, messages_collection  # noqa: E402
+from indexes import INDEXES  # noqa: E402
+from messaging.service import participants_key  # noqa: E402
+
+DIRECT_TYPES = ["admin-admin", "admin-doctor", "doctor-doctor"]
+
+
+def _latest(values: list):
+    present = [v for v in values if isinstance(v, datetime)]
+    return max(present) if present else None
+
+
+async def dedupe(dry_run: bool) -> None:
+    conversations = await conversations_collection.find(
+        {"type": {"$in": DIRECT_TYPES}},
+        {"participants": 1, "participants_key": 1, "created_at": 1, "updated_at": 1, "last_message_at": 1},
+    ).to_list(None)
+
+    by_key = {}
+    for conv in conversations:
+        by_key.setdefault(participants_key(conv["participants"]), []).append(conv)
+
+    merged = keyed = 0
+    for key, group in by_key.items():
+        # Oldest conversation wins (ObjectIds are ordered by creation time)
+        group.sort(key=lambda c: c["_id"])
+        keeper, duplicates = group[0], group[1:]
+
+        for dup in duplicates:
+            moved = await messages_collection.count_documents({"conversation_id": dup["_id"]})
+            print(f"  merge {dup['_id']} -> {keeper['_id']} ({', '.join(keeper['participants'])}): {moved} message(s)")
+            if not dry_run:
+                await messages_collection.update_many(
+                    {"conversation_id": dup["_id"]}, {"$set": {"conversation_id": keeper["_id"]}}
+                )
+                await conversations_collection.delete_one({"_id": dup["_id"]})
+            merged += 1
+
+        changes = {}
+        if keeper.get("participants_key") != key:
+            changes["participants_key"] = key
+            keyed += 1
+        if duplicates:
+            changes["updated_at"] = _latest([c.get("updated_at") for c in group])
+            changes["last_message_at"] = _latest([c.get("last_message_at") for c in group])
+        if changes and not dry_run:
+            await conversations_collection.update_one({"_id": keeper["_id"]}, {"$set": changes})
+
+    prefix = "would be " if dry_run else ""
+    print(f"{merged} duplicate conversation(s) {prefix}merged, {keyed} conversation(s) {prefix}keyed")
+
+    if dry_run:
+        return
+
+    spec = next(s for s in INDEXES if s.name == "participants_key_unique")
+    await conversations_collection.create_index(list(spec.keys), name=spec.name, **spec.options)
+    print(f"Ensured index {spec.name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge duplicate direct conversations")
+    parser.add_argument("--dry-run", action="store_true", help="report without writing")
+    args = parser.parse_args()
+    asyncio.run(dedupe(args.dry_run))
+
+
+if __name__ == '__main__':
+    main()
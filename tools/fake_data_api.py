@@ -0,0 +1,374 @@
+"""Local fake of the Atlas Data API for offline testing and benchmarks.
+
+Serves ``POST /action/<action>`` for findOne, find, insertOne, insertMany,
+updateOne, updateMany, deleteOne, deleteMany and aggregate against in-memory
+collections, speaking Extended JSON like the real service. The query matcher covers the
+operators the backend uses ($eq/$ne/$gt/$gte/$lt/$lte/$in/$nin/$exists/
+$regex/$all, $and/$or/$nor, dotted paths, array membership); aggregate
+supports $match, $sort, $skip, $limit, $project, $addFields, $count, $lookup
+and $group with $sum, plus the $ifNull/$first/$substrCP/$size expressions.
+Inserting a duplicate ``_id`` fails with a duplicate key error.
+
+``--latency-ms`` adds a per-request delay (server round trip) and
+``--handshake-ms`` a one-off delay for each new client connection,
+approximating TCP+TLS setup to a remote endpoint. ``--fail-rate`` answers a
+fraction of requests with 503 to exercise client retries.
+
+Usage (from repo root):
+
+python tools/fake_data_api.py --port 8790 --latency-ms 20 --handshake-ms 60
+ATLAS_DATA_API_URL=http://127.0.0.1:8790 ATLAS_DATA_API_KEY=fake uvicorn backend.main:app
+"""
+import argparse
+import asyncio
+import copy
+import random
+import re
+
+import uvicorn
+from bson import ObjectId, json_util
+from bson.regex import Regex
+from fastapi import FastAPI, Request, Response
+
+
+app = FastAPI(title="Fake Atlas Data API")
+store = {}
+settings = {"latency": 0.0, "handshake": 0.0, "fail_rate": 0.0}
+_seen_connections = set()
+
+_MISSING = object()
+
+
+def _collection(payload: dict) -> list:
+    return store.setdefault((payload.get("database"), payload["collection"]), [])
+
+
+def _get_path(doc, path: str):
+    value = doc
+    for part in path.split("."):
+        if isinstance(value, dict):
+            value = value.get(part, _MISSING)
+        elif isinstance(value, list) and part.isdigit() and int(part) < len(value):
+            value = value[int(part)]
+        else:
+            return _MISSING
+        if value is _MISSING:
+            return _MISSING
+    return value
+
+
+def _compare(op: str, value, operand) -> bool:
+    candidates = value if isinstance(value, list) else [value]
+    for candidate in candidates:
+        if candidate is _MISSING or candidate is None:
+            continue
+        try:
+            if (op == "$gt" and candidate > operand) or (op == "$gte" and candidate >= operand) \
+                    or (op == "$lt" and candidate < operand) or (op == "$lte" and candidate <= operand):
+                return True
+        except TypeError:
+            continue
+    return False
+
+
+def _equals(value, operand) -> bool:
+    if value is _MISSING:
+        return operand is None
+    if isinstance(value, list) and not isinstance(operand, list):
+        return operand in value
+    return value == operand
+
+
+def _match_condition(value, condition) -> bool:
+    if isinstance(condition, dict) and condition and all(k.startswith("$") for k in condition):
+        for op, operand in condition.items():
+            if op == "$eq" and not _equals(value, operand):
+                return False
+            if op == "$ne" and _equals(value, operand):
+                return False
+            if op in ("$gt", "$gte", "$lt", "$lte") and not _compare(op, value, operand):
+                return False
+            if op == "$in" and not any(_equals(value, o) for o in operand):
+                return False
+            if op == "$nin" and any(_equals(value, o) for o in operand):
+                return False
+            if op == "$exists" and (value is not _MISSING) != bool(operand):
+                return False
+            if op == "$all" and not (isinstance(value, list) and all(o in value for o in operand)):
+                return False
+            if op == "$regex":
+                flags = re.IGNORECASE if "i" in condition.get("$options", "") else 0
+                pattern = operand.pattern if hasattr(operand, "pattern") else operand
+                if not isinstance(value, str) or not re.search(pattern, value, flags):
+                    return False
+        return True
+    if isinstance(condition, Regex):
+        # EJSON decodes {"$regex": ..., "$options": ...} into a BSON Regex
+        condition = condition.try_compile()
+    if isinstance(condition, re.Pattern):
+        return isinstance(value, str) and bool(condition.search(value))
+    return _equals(value, condition)
+
+
+def matches(doc: dict, query: dict) -> bool:
+    for key, condition in (query or {}).items():
+        if key == "$and":
+            if not all(matches(doc, q) for q in condition):
+                return False
+        elif key == "$or":
+            if not any(matches(doc, q) for q in condition):
+                return False
+        elif key == "$nor":
+            if any(matches(doc, q) for q in condition):
+                return False
+        elif not _match_condition(_get_path(doc, key), condition):
+            return False
+    return True
+
+
+def _sort_key(value):
+    # Order None/missing first, then by type name so mixed types don't raise
+    if value is _MISSING or value is None:
+        return (0, "", 0)
+    return (1, type(value).__name__, value)
+
+
+def apply_sort(docs: list, sort: dict) -> list:
+    for field, direction in reversed(list((sort or {}).items())):
+        docs = sorted(docs, key=lambda d: _sort_key(_get_path(d, field)), reverse=direction < 0)
+    return docs
+
+
+def apply_projection(doc: dict, projection: dict) -> dict:
+    if not projection:
+        return doc
+    include = {k for k, v in projection.items() if v and k != "_id"}
+    if include:
+        result = {k: doc[k] for k in include if k in doc}
+        if projection.get("_id", 1) and "_id" in doc:
+            result["_id"] = doc["_id"]
+        return result
+    return {k: v for k, v in doc.items() if projection.get(k, 1)}
+
+
+def _set_path(doc: dict, path: str, value) -> None:
+    parts = path.split(".")
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    doc[parts[-1]] = value
+
+
+def apply_update(doc: dict, update: dict, inserting: bool = False) -> None:
+    for op, fields in update.items():
+        for path, value in fields.items():
+            current = _get_path(doc, path)
+            if op == "$set" or (op == "$setOnInsert" and inserting):
+                _set_path(doc, path, value)
+            elif op == "$unset":
+                parent = _get_path(doc, path.rpartition(".")[0]) if "." in path else doc
+                if isinstance(parent, dict):
+                    parent.pop(path.rpartition(".")[2], None)
+            elif op == "$inc":
+                _set_path(doc, path, (0 if current is _MISSING else current) + value)
+            elif op in ("$max", "$min"):
+                try:
+                    replace = current is _MISSING or (value > current if op == "$max" else value < current)
+                except TypeError:
+                    replace = True  # mixed BSON types; close enough for a test double
+                if replace:
+                    _set_path(doc, path, value)
+            elif op in ("$push", "$addToSet"):
+                items = [] if current is _MISSING else current
+                values = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+                for v in values:
+                    if op == "$push" or v not in items:
+                        items.append(v)
+                _set_path(doc, path, items)
+            elif op == "$pull" and isinstance(current, list):
+                _set_path(doc, path, [v for v in current if not _match_condition(v, value)])
+
+
+def _seed_from_query(query: dict) -> dict:
+    return {k: v for k, v in (query or {}).items() if not k.startswith("$") and not isinstance(v, dict)}
+
+
+def evaluate(expr, doc):
+    """Evaluate the aggregation expressions the backend's pipelines use."""
+    if isinstance(expr, str) and expr.startswith("$"):
+        value = _get_path(doc, expr[1:])
+        if value is _MISSING and "." in expr:
+            # "$array.field" maps the field over an array of sub-documents
+            head, _, rest = expr[1:].partition(".")
+            items = doc.get(head)
+            if isinstance(items, list):
+                return [v for v in (_get_path(i, rest) for i in items) if v is not _MISSING]
+        return None if value is _MISSING else value
+    if isinstance(expr, dict) and len(expr) == 1:
+        (op, args), = expr.items()
+        if op == "$ifNull":
+            value = evaluate(args[0], doc)
+            return evaluate(args[1], doc) if value is None else value
+        if op == "$first":
+            value = evaluate(args, doc)
+            return value[0] if value else None
+        if op == "$substrCP":
+            value = evaluate(args[0], doc) or ""
+            return value[args[1]:args[1] + args[2]]
+        if op == "$size":
+            return len(evaluate(args, doc) or [])
+        if op == "$cond":
+            cond, then, otherwise = args if isinstance(args, list) else (args["if"], args["then"], args["else"])
+            return evaluate(then if evaluate(cond, doc) else otherwise, doc)
+        if op == "$eq":
+            return _equals(evaluate(args[0], doc), evaluate(args[1], doc))
+        if op == "$subtract":
+            return (evaluate(args[0], doc) or 0) - (evaluate(args[1], doc) or 0)
+        if op in ("$max", "$min") and isinstance(args, list):
+            values = [v for v in (evaluate(a, doc) for a in args) if v is not None]
+            return (max if op == "$max" else min)(values) if values else None
+    if isinstance(expr, dict):
+        return {k: evaluate(v, doc) for k, v in expr.items()}
+    return expr
+
+
+def _project_stage(doc: dict, spec: dict) -> dict:
+    computed = {k: v for k, v in spec.items() if not isinstance(v, (int, bool))}
+    if not computed:
+        return apply_projection(doc, spec)
+    result = apply_projection(doc, {k: v for k, v in spec.items() if k not in computed} or {"_id": 1})
+    result.update({k: evaluate(v, doc) for k, v in computed.items()})
+    return result
+
+
+def run_pipeline(docs: list, pipeline: list, database) -> list:
+    for stage in pipeline:
+        (name, spec), = stage.items()
+        if name == "$match":
+            docs = [d for d in docs if matches(d, spec)]
+        elif name == "$sort":
+            docs = apply_sort(docs, spec)
+        elif name == "$skip":
+            docs = docs[spec:]
+        elif name == "$limit":
+            docs = docs[:spec]
+        elif name == "$project":
+            docs = [_project_stage(d, spec) for d in docs]
+        elif name in ("$addFields", "$set"):
+            docs = [{**d, **{k: evaluate(v, d) for k, v in spec.items()}} for d in docs]
+        elif name == "$count":
+            docs = [{spec: len(docs)}] if docs else []
+        elif name == "$lookup":
+            foreign = store.get((database, spec["from"]), [])
+            for d in docs:
+                joined = foreign
+                if "localField" in spec:
+                    local = _get_path(d, spec["localField"])
+                    joined = [f for f in foreign if _equals(_get_path(f, spec["foreignField"]), local)]
+                d[spec["as"]] = run_pipeline(copy.deepcopy(joined), spec.get("pipeline", []), database)
+        elif name == "$group":
+            groups = {}
+            for d in docs:
+                key = evaluate(spec["_id"], d)
+                group = groups.setdefault(repr(key), {"_id": key})
+                for field, acc in spec.items():
+                    if field == "_id":
+                        continue
+                    inc = evaluate(acc["$sum"], d)
+                    group[field] = group.get(field, 0) + (inc or 0)
+            docs = list(groups.values())
+        else:
+            raise ValueError(f"unsupported pipeline stage {name}")
+    return docs
+
+
+def handle(action: str, payload: dict) -> dict:
+    coll = _collection(payload)
+    query = payload.get("filter") or {}
+
+    if action == "findOne":
+        doc = next((d for d in coll if matches(d, query)), None)
+        return {"document": apply_projection(copy.deepcopy(doc), payload.get("projection")) if doc else None}
+    if action == "find":
+        docs = apply_sort([d for d in coll if matches(d, query)], payload.get("sort"))
+        docs = docs[payload.get("skip", 0):]
+        if payload.get("limit"):
+            docs = docs[:payload["limit"]]
+        return {"documents": [apply_projection(copy.deepcopy(d), payload.get("projection")) for d in docs]}
+    if action in ("insertOne", "insertMany"):
+        new_docs = [payload["document"]] if action == "insertOne" else payload["documents"]
+        ids = []
+        existing = {repr(d["_id"]) for d in coll}
+        for doc in new_docs:
+            doc = copy.deepcopy(doc)
+            doc.setdefault("_id", ObjectId())
+            if repr(doc["_id"]) in existing:
+                raise ValueError(f"Duplicate key error: _id {doc['_id']}")
+            existing.add(repr(doc["_id"]))
+            coll.append(doc)
+            ids.append(doc["_id"])
+        return {"insertedId": ids[0]} if action == "insertOne" else {"insertedIds": ids}
+    if action == "updateMany":
+        docs = [d for d in coll if matches(d, query)]
+        for doc in docs:
+            apply_update(doc, payload["update"])
+        return {"matchedCount": len(docs), "modifiedCount": len(docs)}
+    if action == "updateOne":
+        doc = next((d for d in coll if matches(d, query)), None)
+        if doc is None:
+            if not payload.get("upsert"):
+                return {"matchedCount": 0, "modifiedCount": 0}
+            doc = _seed_from_query(query)
+            doc.setdefault("_id", ObjectId())
+            apply_update(doc, payload["update"], inserting=True)
+            coll.append(doc)
+            return {"matchedCount": 0, "modifiedCount": 0, "upsertedId": doc["_id"]}
+        apply_update(doc, payload["update"])
+        return {"matchedCount": 1, "modifiedCount": 1}
+    if action in ("deleteOne", "deleteMany"):
+        victims = [d for d in coll if matches(d, query)]
+        if action == "deleteOne":
+            victims = victims[:1]
+        for d in victims:
+            coll.remove(d)
+        return {"deletedCount": len(victims)}
+    if action == "aggregate":
+        docs = run_pipeline(copy.deepcopy(coll), payload.get("pipeline", []), payload.get("database"))
+        return {"documents": docs}
+    raise ValueError(f"unsupported action {action}")
+
+
+@app.post("/action/{action}")
+async def action_endpoint(action: str, request: Request):
+    connection = request.scope.get("client")
+    if connection not in _seen_connections:
+        _seen_connections.add(connection)
+        if settings["handshake"]:
+            await asyncio.sleep(settings["handshake"])
+    if settings["latency"]:
+        await asyncio.sleep(settings["latency"])
+    if settings["fail_rate"] and random.random() < settings["fail_rate"]:
+        return Response(status_code=503)
+
+    payload = json_util.loads(await request.body())
+    try:
+        result = handle(action, payload)
+    except (ValueError, KeyError) as e:
+        return Response(content=json_util.dumps({"error": str(e)}), status_code=400, media_type="application/ejson")
+    return Response(content=json_util.dumps(result), media_type="application/ejson")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local fake Atlas Data API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8790)
+    parser.add_argument("--latency-ms", type=float, default=0, help="added delay per request")
+    parser.add_argument("--handshake-ms", type=float, default=0, help="added delay per new connection")
+    parser.add_argument("--fail-rate", type=float, default=0, help="fraction of requests answered 503")
+    args = parser.parse_args()
+
+    settings.update(latency=args.latency_ms / 1000, handshake=args.handshake_ms / 1000, fail_rate=args.fail_rate)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""One-off migration: convert ISO-string timestamps to BSON dates.
+
+Messages and conversations used to store timestamps as ISO strings, which the
+``expires_at`` TTL index ignores and which sort as text. This rewrites the
+string fields of ``messages`` and ``conversations`` in batches and is safe to
+re-run: only documents that still hold a string are touched.
+
+Usage (from repo root):
+
+python tools/migrate_message_dates.py                     # convert strings only
+python tools/migrate_message_dates.py --backfill-expiry   # also set expires_at
+                                                          # on messages lacking it
+python tools/migrate_message_dates.py --batch-size 500 --dry-run
+"""
+import argparse
+import asyncio
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'backend')))
+
+from pymongo import UpdateOne  # noqa: E402
+
+from database import messages_collection, conversations_collection  # noqa: E402
+from messaging.service import MESSAGE_RETENTION_DAYS  # noqa: E402
+
+MESSAGE_FIELDS = ["timestamp", "read_at", "expires_at", "edited_at", "deleted_at"]
+CONVERSATION_FIELDS = ["created_at", "updated_at", "last_message_at"]
+
+
+def parse_iso(value: str):
+    """Parse an ISO string into a naive UTC datetime (how the driver stores dates)."""
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except (ValueError, AttributeError):
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+async def migrate(collection, fields: list, batch_size: int, dry_run: bool, backfill_expiry: bool = False) -> int:
+    string_filter = {"$or": [{f: {"$type": "string"}} for f in fields]}
+    if backfill_expiry:
+        string_filter["$or"].append({"expires_at": {"$exists": False}})
+
+    updated = 0
+    last_id = None
+    while True:
+        query = dict(string_filter)
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        batch = await collection.find(query, {f: 1 for f in fields}).sort("_id", 1).limit(batch_size).to_list(None)
+        if not batch:
+            break
+        last_id = batch[-1]["_id"]
+
+        ops = []
+        for doc in batch:
+            changes = {}
+            for f in fields:
+                if isinstance(doc.get(f), str):
+                    parsed = parse_iso(doc[f])
+                    if parsed is not None:
+                        changes[f] = parsed
+            if backfill_expiry and "expires_at" not in doc:
+                ts = changes.get("timestamp", doc.get("timestamp"))
+                if isinstance(ts, datetime):
+                    changes["expires_at"] = ts + timedelta(days=MESSAGE_RETENTION_DAYS)
+            if changes:
+                ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": changes}))
+
+        if ops and not dry_run:
+            await collection.bulk_write(ops, ordered=False)
+        updated += len(ops)
+        print(f"  {collection.name}: {updated} document(s) {'would be ' if dry_run else ''}updated so far")
+
+    return updated
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Convert string timestamps to BSON dates")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--backfill-expiry", action="store_true",
+                        help=f"set expires_at = timestamp + {MESSAGE_RETENTION_DAYS} days where missing")
+    args = parser.parse_args()
+
+    msgs = await migrate(messages_collection, MESSAGE_FIELDS, args.batch_size, args.dry_run, args.backfill_expiry)
+    convs = await migrate(conversations_collection, CONVERSATION_FIELDS, args.batch_size, args.dry_run)
+    print(f"Done: messages={msgs} conversations={convs}{' (dry run)' if args.dry_run else ''}")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
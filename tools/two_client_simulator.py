@@ -84,20 +84,31 @@ async def run_test(sender_email: str, receiver_email: str):
             conv_id = convs[0]['id']
 
         if conv_id:
-            r = await client.get(f"{API_BASE}/api/conversations/{conv_id}/messages?limit=30&skip=0")
+            r = await client.get(f"{API_BASE}/api/conversations/{conv_id}/messages?limit=30")
             print(f"Messages for conv {conv_id}: status={r.status_code}")
             if r.status_code == 200:
                 print(json.dumps(r.json(), indent=2))
             else:
                 print(r.text)
 
-    # Simulate disconnect of B and reconnect
-    print("[Test] Disconnecting B...")
+    # Simulate disconnect of B, a message it misses, and reconnect + delta sync
+    async with httpx.AsyncClient() as client:
+        r = await client.get(f"{API_BASE}/api/sync?user_email={receiver_email}")
+        cursor = r.json().get("cursor") if r.status_code == 200 else None
+    print("[Test] Disconnecting B at sync cursor", cursor)
     await sio_b.disconnect()
     await asyncio.sleep(0.2)
+    await sio_a.emit("send_message", {"receiver_email": receiver_email, "content": content + ' (while B offline)'})
+    await asyncio.sleep(0.5)
     print("[Test] Reconnecting B...")
     await sio_b.connect(WS_BASE, transports=["websocket"]) 
     await asyncio.sleep(0.5)
+    if cursor is not None:
+        async with httpx.AsyncClient() as client:
+            r = await client.get(f"{API_BASE}/api/sync", params={"user_email": receiver_email, "since": cursor})
+            print(f"[B] sync since {cursor}: status={r.status_code}")
+            if r.status_code == 200:
+                print(json.dumps(r.json(), indent=2))
 
     # Send another message to ensure multi-sid / reconnect works
     print("[A] Emitting second send_message...")